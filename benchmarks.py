@@ -0,0 +1,341 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import pandas as pd
+import datacache
+import openslotsdata
+import outputdb
+import pipeline
+import rollups
+import runreport
+import snapshots
+import synthdata
+
+# Scale benchmarks of the pipeline and the dashboard. Every scale gets a folder
+# bench/scale-<N> with synthetic extracts (synthdata.py) of N times the base number
+# of resources, like a country added to the extracts: N times the shops with the same
+# resources per shop, and more resources per shop once the 3-character shop codes run
+# out (synthdata.scaled). Extracts larger than an Excel sheet are written as CSV. The pipeline runs there without its stage cache, and its run report gives
+# the time, memory and rows of every stage. The dashboard's filter, group and pivot
+# steps are then timed on the outputs of the run, for all shops, one region, one area
+# and one shop, with the rows filtered in memory and queried from the output database. Every scale runs in a process of its own, so the peak memory of one
+# scale is not carried into the next. Results are appended to bench/results.json
+# with the earlier benchmark runs, to compare a scale across changes.
+
+BENCH_FOLDER = 'bench'
+RESULTS_FILE = 'results.json'
+SCALES = [1, 10, 100]
+HISTORY_LENGTH = runreport.HISTORY_LENGTH
+
+# A step taking this many times longer than in the previous benchmark run is reported as slower
+SLOWER_FACTOR = 1.5
+
+# Outputs of a run that the generated extracts are not, cleared before every run
+RUN_FOLDERS = [openslotsdata.output_folder_path, openslotsdata.shift_folder_path, datacache.CACHE_DIR]
+
+
+def scale_folder(scale, folder=BENCH_FOLDER):
+    return os.path.join(folder, f'scale-{scale:g}')
+
+
+def run_params(params):
+    """ Pipeline run parameters over the days of the generated extracts, the run date halfway through. """
+    start_date = pd.Timestamp(params['start']).to_pydatetime()
+    # Like horizon.run_window, the end is the last day at 00:00
+    end_date = start_date + pd.Timedelta(days=params['days'] - 1)
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'current_date': (start_date + pd.Timedelta(days=params['days'] // 2)).strftime('%Y-%m-%d'),
+        'incremental_mode': False,
+        'workers': 1,
+        'excluded_statuses': openslotsdata.EXCLUDED_APPOINTMENT_STATUSES,
+    }
+
+
+# Dashboard steps as fastopenslotsapp.py runs them, the app is a Streamlit script and cannot be imported
+
+def filter_rows(data, selected_region, selected_area, selected_shop, shop_column='Shop[Name]', iso_week_filter=None):
+    """ Rows of a selection, like filter_data (with an ISO week) and filter_hcp_shift_slots / filter_hcm_data (without). """
+    filtered_data = data[data['iso_week'] == iso_week_filter] if iso_week_filter is not None else data.copy()
+    if selected_region != "All":
+        filtered_data = filtered_data[filtered_data['Region'] == selected_region]
+    if selected_area != "All":
+        filtered_data = filtered_data[filtered_data['Area'] == selected_area]
+    if selected_shop != "All":
+        filtered_data = filtered_data[filtered_data[shop_column] == selected_shop]
+    return filtered_data
+
+
+def aggregate_shop_days(filtered_data):
+    return filtered_data.groupby(['GT_ShopCode__c', 'Shop[Name]', 'date', 'weekday']).agg(
+        OpenHours=('OpenHours', 'sum'),
+        TotalHours=('TotalHours', 'sum'),
+        BlockedHoursPercentage=('BlockedHoursPercentage', 'mean')
+    ).reset_index()
+
+
+def aggregate_resource_days(filtered_hcp_shift_slots):
+    return filtered_hcp_shift_slots.groupby(['PersonalNumberKey', 'GT_ServiceResource__r.Name', 'GT_ShopCode__c', 'Shop[Name]', 'ShiftDate', 'weekday']).agg(
+        AvailableHours=('ShiftDurationHoursAdjusted', 'sum'),
+        BlockedHours=('AbsenceDurationHours', 'sum'),
+    ).reset_index()
+
+
+def pivot_open_hours(aggregated_data):
+    # Open Hours / Total Hours tab
+    return aggregated_data.pivot_table(index=['Shop[Name]'], columns=['date', 'weekday'], values=['OpenHours', 'TotalHours'], aggfunc='sum', fill_value=0)
+
+
+def pivot_blocked_hours(aggregated_data):
+    # Blocked Hours % tab
+    return aggregated_data.pivot_table(index=['Shop[Name]'], columns=['date', 'weekday'], values='BlockedHoursPercentage', aggfunc='mean', fill_value=0)
+
+
+def pivot_hcm(filtered_hcm):
+    # HCM vs SF tab
+    return filtered_hcm.pivot_table(
+        index=['Resource Name', 'Shop Name'], columns='iso_week',
+        values=['Duración SF', 'Duración HCM', 'Diferencia de hcm duración'], aggfunc='sum', fill_value=0
+    )
+
+
+def pivot_overview(weekly_rollup):
+    # Overview tab, open hours per region and week
+    return weekly_rollup.pivot_table(index='Region', columns='iso_week', values='OpenHours', aggfunc='sum', fill_value=0)
+
+
+def time_dashboard(current_date):
+    """ Seconds of the dashboard's steps on the outputs of the run of `current_date`, in the current folder. """
+    timings = {}
+
+    def timed(step, func):
+        started = time.perf_counter()
+        value = func()
+        timings[step] = round(time.perf_counter() - started, 3)
+        return value
+
+    shift_slots = timed('load shiftslots', lambda: snapshots.read_snapshot(openslotsdata.shift_slots_file_path, 'shiftslots'))
+    hcp_shift_slots = timed('load hcpshiftslots', lambda: snapshots.read_snapshot(
+        os.path.join(openslotsdata.output_folder_path, 'hcpshiftslots.xlsx'), 'hcpshiftslots'))
+    hcm = timed('load hcm_sf_merged', lambda: snapshots.read_snapshot(
+        os.path.join(openslotsdata.output_folder_path, 'hcm_sf_merged.xlsx'), 'hcm_sf_merged'))
+    if shift_slots is None or shift_slots.empty:
+        return timings
+    timed('write output database', lambda: outputdb.write(
+        {'shiftslots': shift_slots, 'hcpshiftslots': hcp_shift_slots, 'hcm_sf_merged': hcm}, current_date))
+
+    # The run date's ISO week, and the first region, area and shop of the sidebar lists
+    iso_week = pd.Timestamp(current_date).isocalendar()[1]
+    region = sorted(shift_slots['Region'].dropna().unique())[0]
+    area = sorted(shift_slots.loc[shift_slots['Region'] == region, 'Area'].dropna().unique())[0]
+    shop = sorted(shift_slots.loc[shift_slots['Area'] == area, 'Shop[Name]'].dropna().unique())[0]
+    selections = {
+        'all': ('All', 'All', 'All'),
+        'region': (region, 'All', 'All'),
+        'area': (region, area, 'All'),
+        'shop': (region, area, shop),
+    }
+    for level, selection in selections.items():
+        filtered_data = timed(f'{level}: filter shiftslots', lambda: filter_rows(shift_slots, *selection, iso_week_filter=iso_week))
+        timed(f'{level}: query shiftslots', lambda: outputdb.read(
+            'shiftslots', current_date, outputdb.selection('shiftslots', *selection) + [('iso_week', '==', int(iso_week))]))
+        aggregated_data = timed(f'{level}: shop-day sums', lambda: aggregate_shop_days(filtered_data))
+        timed(f'{level}: open hours pivot', lambda: pivot_open_hours(aggregated_data))
+        timed(f'{level}: blocked hours pivot', lambda: pivot_blocked_hours(aggregated_data))
+        if hcp_shift_slots is not None:
+            filtered_hcp = timed(f'{level}: filter hcpshiftslots', lambda: filter_rows(hcp_shift_slots, *selection))
+            timed(f'{level}: query hcpshiftslots', lambda: outputdb.read('hcpshiftslots', current_date, outputdb.selection('hcpshiftslots', *selection)))
+            timed(f'{level}: resource-day sums', lambda: aggregate_resource_days(filtered_hcp))
+        if hcm is not None:
+            filtered_hcm = timed(f'{level}: filter hcm', lambda: filter_rows(hcm, *selection, shop_column='Shop Name'))
+            timed(f'{level}: query hcm', lambda: outputdb.read('hcm_sf_merged', current_date, outputdb.selection('hcm_sf_merged', *selection)))
+            timed(f'{level}: HCM pivot', lambda: pivot_hcm(filtered_hcm))
+        timed(f'{level}: week rollup read', lambda: rollups.read(
+            f'{rollups.level_of(*selection)}_week', current_date, rollups.selection(*selection) + [('iso_week', '==', int(iso_week))]))
+    region_weeks = timed('overview: region week rollup read', lambda: rollups.read('region_week', current_date))
+    if region_weeks is not None:
+        timed('overview: region pivot', lambda: pivot_overview(region_weeks))
+    return timings
+
+
+def _stage_results(report_path):
+    # Time, memory and rows of every stage of the last run in the run report
+    with open(report_path) as f:
+        run = json.load(f)['runs'][-1]
+    return {
+        record['stage']: {
+            'status': record['status'],
+            'seconds': record.get('seconds'),
+            'peak_rss_mb': record.get('peak_rss_mb'),
+            'output_rows': record.get('output_rows'),
+        }
+        for record in run['stages']
+    }
+
+
+def run_scale(scale, folder, params, workers=1):
+    """ Benchmark one scale in `folder`: generate its extracts unless they are there already, run the pipeline and time the dashboard. """
+    params = synthdata.scaled(params, scale)
+    result = {'scale': scale, 'shops': params['shops'], 'resources_per_shop': params['resources_per_shop'], 'status': 'ok', 'generate_seconds': None}
+    # Extracts generated with the same parameters are reused, writing them takes longer than some stages
+    manifest = synthdata.load_manifest(folder)
+    if manifest is None or manifest['params'] != json.loads(json.dumps(params, default=str)):
+        started = time.perf_counter()
+        try:
+            synthdata.generate(folder, **params)
+        except ValueError as error:
+            return dict(result, status='failed', error=str(error))
+        result['generate_seconds'] = round(time.perf_counter() - started, 3)
+        manifest = synthdata.load_manifest(folder)
+    result['rows'] = manifest['rows']
+
+    params_of_run = run_params(params)
+    report_path = os.path.join(openslotsdata.output_folder_path, 'run_report.json')
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        # Every run starts cold, without the outputs, caches and history of the previous one
+        for run_folder in RUN_FOLDERS:
+            shutil.rmtree(run_folder, ignore_errors=True)
+            os.makedirs(run_folder, exist_ok=True)
+        started = time.perf_counter()
+        try:
+            pipeline.run(openslotsdata.STAGES, params_of_run, use_cache=False, workers=workers, report_path=report_path)
+        except RuntimeError as error:
+            result.update(status='failed', error=str(error))
+        result['pipeline_seconds'] = round(time.perf_counter() - started, 3)
+        result['stages'] = _stage_results(report_path)
+        if result['status'] == 'ok':
+            result['dashboard'] = time_dashboard(params_of_run['current_date'])
+    finally:
+        os.chdir(cwd)
+    return result
+
+
+def _steps(result):
+    # Seconds of everything timed at one scale, by step name
+    steps = {}
+    if result.get('generate_seconds') is not None:
+        steps['generate'] = result['generate_seconds']
+    if result.get('pipeline_seconds') is not None:
+        steps['pipeline'] = result['pipeline_seconds']
+    for stage, record in result.get('stages', {}).items():
+        if record['status'] == 'ok':
+            steps[f'stage {stage}'] = record['seconds']
+    for step, seconds in result.get('dashboard', {}).items():
+        steps[f'dashboard {step}'] = seconds
+    return steps
+
+
+def print_summary(run, previous=None):
+    """ Seconds of every step per scale, and the steps slower than in the previous benchmark run. """
+    results = [result for result in run['scales'] if result['status'] == 'ok']
+    for result in run['scales']:
+        if result['status'] != 'ok':
+            print(f"Scale {result['scale']:g}x ({result['shops']} shops) failed: {result['error']}")
+    if results:
+        steps = {}
+        for result in results:
+            for step in _steps(result):
+                steps.setdefault(step, None)
+        width = max(len(step) for step in steps)
+        print(f"{'Seconds':<{width}}" + ''.join(f"{result['scale']:>10g}x" for result in results))
+        for step in steps:
+            print(f"{step:<{width}}" + ''.join(
+                f"{_steps(result)[step]:>11.2f}" if step in _steps(result) else f"{'-':>11}" for result in results
+            ))
+        for result in results:
+            peak = max((record['peak_rss_mb'] or 0 for record in result['stages'].values() if record['status'] == 'ok'), default=0)
+            shift_rows = next(rows for file_name, rows in result['rows'].items() if file_name.startswith('SFshifts_query.'))
+            print(f"Scale {result['scale']:g}x: {result['shops']} shops of {result['resources_per_shop']} resources, {shift_rows} shift rows, peak memory {peak:.0f} MB")
+
+    if previous is None:
+        return
+    earlier = {result['scale']: result for result in previous['scales'] if result['status'] == 'ok'}
+    for result in results:
+        if result['scale'] not in earlier:
+            continue
+        before = _steps(earlier[result['scale']])
+        for step, seconds in _steps(result).items():
+            if step in before and seconds > SLOWER_FACTOR * before[step] and seconds > 1:
+                print(f"Scale {result['scale']:g}x: {step} took {seconds:.1f}s, {before[step]:.1f}s in the benchmark of {previous['started_at']}")
+
+
+def write_results(path, run):
+    """ Append a benchmark run to the results at `path`, keeping the last HISTORY_LENGTH runs. Returns the previous run with the same parameters. """
+    runs = []
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                runs = json.load(f)['runs']
+        except (ValueError, KeyError):
+            print(f"Benchmark results {path} could not be read, starting a new history")
+    previous = next((other for other in reversed(runs) if other['params'] == run['params'] and other['workers'] == run['workers']), None)
+    runs = (runs + [run])[-HISTORY_LENGTH:]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'runs': runs}, f, indent=2, default=str)
+    print(f"Benchmark results written to {path}")
+    return previous
+
+
+def run(scales=SCALES, folder=BENCH_FOLDER, workers=1, **params):
+    """ Benchmark every scale in turn, `params` override synthdata.DEFAULTS (the 1x size). Returns the benchmark run. """
+    params = dict(synthdata.DEFAULTS, **params)
+    benchmark = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'params': json.loads(json.dumps(params, default=str)),
+        'workers': workers,
+        'cpu_count': os.cpu_count(),
+        'scales': [],
+    }
+    # Forked processes start without re-importing this module, elsewhere the platform default is used
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    for scale in scales:
+        print(f"----- Scale {scale:g}x -----")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(start_method)) as pool:
+            try:
+                result = pool.submit(run_scale, scale, scale_folder(scale, folder), params, workers).result()
+            except BrokenProcessPool as error:
+                # The scale's process was killed, most likely out of memory: the scale the pipeline stops at
+                scaled = synthdata.scaled(params, scale)
+                result = {'scale': scale, 'shops': scaled['shops'], 'resources_per_shop': scaled['resources_per_shop'],
+                          'status': 'failed', 'error': f"process ended abruptly ({error})"}
+        benchmark['scales'].append(result)
+    previous = write_results(os.path.join(folder, RESULTS_FILE), benchmark)
+    print_summary(benchmark, previous)
+    return benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline and the dashboard on synthetic extracts at several scales.')
+    parser.add_argument('--scales', nargs='+', type=float, default=SCALES, metavar='SCALE',
+                        help=f"Multiples of the base number of resources, default {' '.join(str(scale) for scale in SCALES)}")
+    parser.add_argument('--shops', type=int, default=synthdata.DEFAULTS['shops'], help='Shops at scale 1')
+    parser.add_argument('--resources-per-shop', type=int, default=synthdata.DEFAULTS['resources_per_shop'])
+    parser.add_argument('--days', type=int, default=synthdata.DEFAULTS['days'], help=f"Days of shifts from {synthdata.DEFAULTS['start']}")
+    parser.add_argument('--appointments-per-hour', type=float, default=synthdata.DEFAULTS['appointments_per_hour'],
+                        help='Mean appointments per shift hour')
+    parser.add_argument('--absence-rate', type=float, default=synthdata.DEFAULTS['absence_rate'],
+                        help='Share of working days with an absence')
+    parser.add_argument('--absence-hours', type=float, default=synthdata.DEFAULTS['absence_hours'], help='Mean length of an absence')
+    parser.add_argument('--seed', type=int, default=synthdata.DEFAULTS['seed'])
+    parser.add_argument('--stage-workers', type=int, default=1, help='Worker processes running independent stages at the same time')
+    parser.add_argument('--folder', default=BENCH_FOLDER, help=f'Folder of the generated extracts and the results, default {BENCH_FOLDER}')
+    args = parser.parse_args()
+    run(
+        args.scales, args.folder, args.stage_workers, shops=args.shops, resources_per_shop=args.resources_per_shop,
+        days=args.days, appointments_per_hour=args.appointments_per_hour, absence_rate=args.absence_rate,
+        absence_hours=args.absence_hours, seed=args.seed,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Clock-in/clock-out pairing of the clock exports, on whole columns. The records are
+# sorted once by employee and time. Within an employee-day they alternate clock-in,
+# clock-out; a clock-in is paired with the employee's next record when that one falls
+# on the same day, anything else is NC (no clock-out). A day is NC when none of its
+# clock-ins has a pair.
+
+NC = 'NC'
+
+
+def _run_starts(*columns):
+    # True where a row starts a new run of equal values in every column, the input is sorted by them
+    starts = np.zeros(len(columns[0]), dtype=bool)
+    starts[:1] = True
+    for values in columns:
+        starts[1:] |= values[1:] != values[:-1]
+    return starts
+
+
+def label_records(clock, person='ID RH', stamp='Fecha y hora fichaje'):
+    """ Clock records sorted by employee and time, with clock_type, next_fichaje and time_diff.
+
+    clock_type alternates 'Clock In'/'Clock Out' within an employee-day and is NaN for
+    records without a time. next_fichaje is the employee's next record, on any day. """
+    records = clock.sort_values(by=[person, stamp])
+    people = records[person].to_numpy()
+    stamps = records[stamp].to_numpy()
+    days = records[stamp].dt.normalize().to_numpy()
+    timed = ~np.isnat(stamps)
+
+    # Position of each record within its employee-day
+    position = np.arange(len(records))
+    run_start = np.maximum.accumulate(np.where(_run_starts(people, days), position, 0))
+    clock_in = (position - run_start) % 2 == 0
+    records['clock_type'] = pd.Series(np.where(clock_in, 'Clock In', 'Clock Out'), index=records.index, dtype=object).where(timed)
+
+    # The employee's next record, whatever its day
+    same_person = np.zeros(len(records), dtype=bool)
+    same_person[:-1] = people[1:] == people[:-1]
+    records['next_fichaje'] = np.where(same_person, np.roll(stamps, -1), np.datetime64('NaT', 'ns'))
+    records['time_diff'] = records['next_fichaje'] - records[stamp]
+    return records
+
+
+def hours_or_nc(hours, nc):
+    """ Hours where `nc` is False and 'NC' elsewhere. Stays a float column when nothing is NC. """
+    if not nc.any():
+        return hours.astype('float64')
+    return hours.astype(object).where(~nc, NC)
+
+
+def pair_hours(records, person='ID RH', stamp='Fecha y hora fichaje'):
+    """ The clock-in records of `label_records` with their pair's hours and NC flags.
+
+    hours_worked holds the hours to the paired clock-out or 'NC', hours_worked_numeric
+    the hours with 0 for NC, and is_nc is 1 on every clock-in of a day without any pair. """
+    clock_in = records[records['clock_type'] == 'Clock In'].copy()
+    day = clock_in[stamp].dt.normalize()
+    paired = (clock_in['time_diff'].notna() & (clock_in['next_fichaje'].dt.normalize() == day)).to_numpy()
+    hours = clock_in['time_diff'].dt.total_seconds() / 3600
+
+    clock_in['hours_worked'] = hours_or_nc(hours, ~paired)
+    clock_in['hours_worked_numeric'] = hours.where(paired, 0).astype('float64')
+    clock_in['Date'] = clock_in[stamp].dt.date
+
+    # A day is NC when none of its clock-ins is paired, clock-ins of an employee-day are consecutive
+    starts = _run_starts(clock_in[person].to_numpy(), day.to_numpy())
+    if len(clock_in):
+        day_paired = np.logical_or.reduceat(paired, np.flatnonzero(starts))
+        clock_in['is_nc'] = (~day_paired[np.cumsum(starts) - 1]).astype('int64')
+    else:
+        clock_in['is_nc'] = pd.Series(dtype='int64')
+    return clock_in
@@ -0,0 +1,248 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import datacache
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # only the watch mode needs it
+    FileSystemEventHandler = object
+    Observer = None
+
+# Store of the parsed clock exports. Every export in the clock folder is parsed once
+# (header=6, ID RH normalized) and kept as Parquet under .cache/clock, with a manifest
+# entry holding its size, mtime and content hash. Each row carries the export it came
+# from in `source_file`. A sync only parses the exports that are new or changed, on a
+# process pool when there are several, and reports the employee-days they touch, so
+# the clock comparison can be recomputed for those alone. `watch` runs the sync
+# whenever the clock folder changes.
+
+STORE_DIR = os.path.join(datacache.CACHE_DIR, 'clock')
+
+SOURCE_COLUMN = 'source_file'
+PERSON = 'ID RH'
+STAMP = 'Fecha y hora fichaje/declarac.'
+
+# Seconds without file events before a sync, exports are written in several steps
+SETTLE_SECONDS = 5
+
+
+def normalize_ids(ids):
+    """ Personal numbers as text. Excel hands them back as int or float, '.0' included. """
+    return ids.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+
+def parse_export(file_path):
+    """ Rows of one clock export with normalized ID RH. """
+    df = pd.read_excel(file_path, header=6)
+    df[PERSON] = normalize_ids(df[PERSON])
+    return df
+
+
+def _store_path(store_dir, name):
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(store_dir, f"{name.replace(' ', '_')}-{digest}.parquet")
+
+
+def _load_manifest(store_dir):
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _save_manifest(store_dir, manifest):
+    # Written to a temporary file and renamed, an interrupted sync leaves the previous manifest
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def _restore_missing(df):
+    # Arrow hands back None for missing strings, the parsers use NaN
+    object_cols = df.columns[df.dtypes == object]
+    df[object_cols] = df[object_cols].where(df[object_cols].notna(), np.nan)
+    return df
+
+
+def _read_rows(parquet_path):
+    return _restore_missing(pd.read_parquet(parquet_path))
+
+
+def employee_days(rows):
+    """ The (ID RH, day) pairs of some clock rows, as a frame with columns key and day. """
+    return pd.DataFrame({
+        'key': rows[PERSON].to_numpy(),
+        'day': pd.to_datetime(rows[STAMP]).dt.normalize().to_numpy(),
+    }).drop_duplicates()
+
+
+def in_days(people, dates, days):
+    """ Mask of the rows whose (person, day) pair is in the `employee_days` frame `days`. """
+    wanted = pd.MultiIndex.from_frame(days[['key', 'day']])
+    return pd.MultiIndex.from_arrays([np.asarray(people), pd.to_datetime(dates).dt.normalize().to_numpy()]).isin(wanted)
+
+
+def _ingest(file_path, parquet_path, name):
+    """ Parse one export into the store, in a pool worker when there are several. Returns its parse time and employee-days, or the error. """
+    started = time.perf_counter()
+    try:
+        rows = parse_export(file_path)
+    except Exception as ex:
+        return {'error': f"{type(ex).__name__}: {ex}"}
+    seconds = time.perf_counter() - started
+    rows[SOURCE_COLUMN] = name
+    rows.to_parquet(parquet_path + '.tmp', index=False)
+    os.replace(parquet_path + '.tmp', parquet_path)
+    return {'rows': len(rows), 'seconds': round(seconds, 3), 'touched': employee_days(rows)}
+
+
+def _ingest_all(jobs, workers):
+    workers = min(len(jobs), workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [_ingest(*job) for job in jobs]
+    # Forked workers start without re-importing the caller, elsewhere the platform default is used
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as pool:
+        return list(pool.map(_ingest, *zip(*jobs)))
+
+
+def sync(directory, file_pattern, store_dir=STORE_DIR, workers=None):
+    """ Bring the store in line with the exports in `directory` matching `file_pattern`.
+
+    An export whose size and mtime (or, failing that, content hash) match its manifest
+    entry is a cache hit. The others are parsed on up to `workers` processes, one per
+    CPU by default. Returns the names of the added, changed, removed and unreadable
+    exports, one entry per export in `files` (hit or miss, rows, parse seconds) and the
+    employee-days whose rows were added or removed (`touched`, see employee_days). An
+    unreadable export, usually one still being written, stays out of the store. """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = _load_manifest(store_dir)
+    names = sorted(name for name in os.listdir(directory) if file_pattern.match(name))
+    changes = {'added': [], 'changed': [], 'removed': [], 'failed': [], 'files': []}
+    touched = []
+    jobs = []
+    stats = {}
+
+    for name in names:
+        file_path = os.path.join(directory, name)
+        stat = os.stat(file_path)
+        entry = manifest.get(name)
+        if entry is not None and datacache.is_fresh(entry, file_path, stat):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            changes['files'].append({'file': name, 'cache': 'hit', 'rows': entry['rows'], 'parse_seconds': None})
+            continue
+        if entry is not None:
+            # The rows the export held before are touched as well, they may be gone now
+            touched.append(employee_days(_read_rows(_store_path(store_dir, name))))
+        jobs.append((file_path, _store_path(store_dir, name), name))
+        stats[name] = stat
+
+    for (file_path, _, name), result in zip(jobs, _ingest_all(jobs, workers)):
+        if 'error' in result:
+            print(f"Could not read {file_path}, it stays out of the clock store: {result['error']}")
+            changes['failed'].append(name)
+            changes['files'].append({'file': name, 'cache': 'failed', 'rows': None, 'parse_seconds': None})
+            continue
+        print(f"Parsed {file_path} in {result['seconds']:.1f}s")
+        touched.append(result['touched'])
+        changes['changed' if name in manifest else 'added'].append(name)
+        changes['files'].append({'file': name, 'cache': 'miss', 'rows': result['rows'], 'parse_seconds': result['seconds']})
+        manifest[name] = {
+            'source': file_path,
+            'size': stats[name].st_size,
+            'mtime_ns': stats[name].st_mtime_ns,
+            'sha256': datacache.content_hash(file_path),
+            'rows': result['rows'],
+            'parse_seconds': result['seconds'],
+            'ingested': pd.Timestamp.now().isoformat(timespec='seconds'),
+        }
+    # A failed re-parse leaves the previous rows of the export in the store, drop them with the entry
+    for name in changes['failed']:
+        manifest.pop(name, None)
+
+    for name in sorted(set(manifest) - set(names)):
+        parquet_path = _store_path(store_dir, name)
+        if os.path.exists(parquet_path):
+            touched.append(employee_days(_read_rows(parquet_path)))
+            os.remove(parquet_path)
+        del manifest[name]
+        changes['removed'].append(name)
+
+    _save_manifest(store_dir, manifest)
+    changes['touched'] = pd.concat(touched, ignore_index=True).drop_duplicates() if touched else pd.DataFrame(columns=['key', 'day'])
+    hits = sum(file['cache'] == 'hit' for file in changes['files'])
+    print(f"Clock store: {hits} cached, {len(changes['added'])} added, {len(changes['changed'])} changed, "
+          f"{len(changes['removed'])} removed, {len(changes['failed'])} unreadable, {len(changes['touched'])} employee-days touched")
+    return changes
+
+
+def records(store_dir=STORE_DIR):
+    """ Every row of the store, exports in name order. None when the store is empty.
+
+    The exports are joined as Arrow tables and converted once, instead of building
+    a frame per export and copying them all into the result. """
+    manifest = _load_manifest(store_dir)
+    if not manifest:
+        return None
+    tables = [pq.read_table(_store_path(store_dir, name)) for name in sorted(manifest)]
+    # A column typed null (empty) or int64 (no gaps) in one export is widened like pd.concat would
+    return _restore_missing(pa.concat_tables(tables, promote_options='permissive').to_pandas())
+
+
+class _ExportEvents(FileSystemEventHandler):
+    """ Remembers when an export matching the pattern was last created, written, moved or deleted. """
+
+    def __init__(self, file_pattern):
+        super().__init__()
+        self.file_pattern = file_pattern
+        self.last_event = None
+
+    def on_any_event(self, event):
+        # Our own reads of the exports show up as opened events
+        if event.is_directory or event.event_type == 'opened':
+            return
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if any(self.file_pattern.match(os.path.basename(path)) for path in paths if path):
+            self.last_event = time.monotonic()
+
+
+def watch(directory, file_pattern, on_change, store_dir=STORE_DIR, settle=SETTLE_SECONDS):
+    """ Sync the store whenever exports in `directory` change and call on_change with the changes. Runs until interrupted.
+
+    A sync waits for `settle` seconds without events, so a file being copied is read
+    once it is complete. """
+    if Observer is None:
+        raise RuntimeError("The watch mode needs the watchdog package, see requirements.txt")
+    events = _ExportEvents(file_pattern)
+    observer = Observer()
+    observer.schedule(events, directory, recursive=False)
+    observer.start()
+    print(f"Watching {directory} for clock exports, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+            if events.last_event is None or time.monotonic() - events.last_event < settle:
+                continue
+            events.last_event = None
+            changes = sync(directory, file_pattern, store_dir)
+            if changes['failed']:
+                # Try the unreadable exports again after another quiet period
+                events.last_event = time.monotonic()
+            if len(changes['touched']):
+                on_change(changes)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        observer.stop()
+        observer.join()
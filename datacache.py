@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Columnar cache for the Salesforce/HCM extracts. Each source file is parsed once
+# per set of read options and stored as typed Parquet next to a small manifest
+# holding the source path, size, mtime and content hash. Writing an entry removes the
+# entries of the same file under other read options, so the cache holds one per file.
+
+CACHE_DIR = '.cache'
+
+
+def content_hash(file_path, chunk_size=1 << 20):
+    """ SHA-256 of a file, read in chunks. """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _options_key(reader, usecols, kwargs):
+    # dtype maps hold classes such as `str`, so fall back to repr for anything json cannot encode
+    options = json.dumps({'reader': reader, 'usecols': usecols, 'kwargs': kwargs}, sort_keys=True, default=repr)
+    return hashlib.sha1(options.encode('utf-8')).hexdigest()[:16]
+
+
+def _cache_paths(file_path, key, cache_dir):
+    name = os.path.basename(file_path).replace(' ', '_')
+    base = os.path.join(cache_dir, f"{name}-{key}")
+    return base + '.parquet', base + '.json'
+
+
+def _remove_superseded(file_path, key, cache_dir):
+    # Each source file is read with one set of options per run, so the entries of its other options
+    # (earlier run windows, other columns) are superseded by the one just written
+    name = os.path.basename(file_path).replace(' ', '_')
+    for entry in os.listdir(cache_dir):
+        base, extension = os.path.splitext(entry)
+        other_name, _, other_key = base.rpartition('-')
+        if other_name == name and other_key != key and len(other_key) == 16 and extension in ('.parquet', '.json'):
+            os.remove(os.path.join(cache_dir, entry))
+
+
+def is_fresh(manifest, file_path, stat):
+    """ True when a manifest's size, mtime and content hash still describe file_path. """
+    if manifest['size'] != stat.st_size:
+        return False
+    if manifest['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    # Checkouts and copies touch mtime without changing the content
+    return manifest['sha256'] == content_hash(file_path)
+
+
+def _read_cached(parquet_path):
+    df = pd.read_parquet(parquet_path)
+    # Arrow hands back None for missing strings, the parsers use NaN
+    object_cols = df.columns[df.dtypes == object]
+    df[object_cols] = df[object_cols].where(df[object_cols].notna(), np.nan)
+    return df
+
+
+def cached_read(reader, read, file_path, usecols=None, cache_dir=CACHE_DIR, **kwargs):
+    """ Return `read(file_path, usecols=usecols, **kwargs)`, served from the Parquet cache when the source is unchanged. """
+    key = _options_key(reader, usecols, kwargs)
+    parquet_path, manifest_path = _cache_paths(file_path, key, cache_dir)
+    stat = os.stat(file_path)
+
+    if os.path.exists(parquet_path) and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if is_fresh(manifest, file_path, stat):
+            if manifest['mtime_ns'] != stat.st_mtime_ns:
+                manifest['mtime_ns'] = stat.st_mtime_ns
+                with open(manifest_path, 'w') as f:
+                    json.dump(manifest, f, indent=2)
+            print(f"Loading {file_path} from cache")
+            return _read_cached(parquet_path)
+
+    print(f"Parsing {file_path}")
+    df = read(file_path, usecols=usecols, **kwargs)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_parquet(parquet_path, index=False)
+    except (ValueError, TypeError, NotImplementedError, ImportError) as ex:
+        # Mixed-type object columns cannot be typed for Arrow, keep the parsed frame uncached
+        print(f"Not caching {file_path}: {ex}")
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        return df
+    manifest = {
+        'source': file_path,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': content_hash(file_path),
+        'options': json.loads(json.dumps({'usecols': usecols, 'kwargs': kwargs}, default=repr)),
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    _remove_superseded(file_path, key, cache_dir)
+    return df
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+# Dtype policy of the SF frames. Shop and resource attributes repeat on every shift,
+# absence and appointment row, so they are stored as categoricals; keys, names and
+# ids are Arrow-backed strings. Every stage applies the policy to the frames it
+# returns, which undoes the object columns merges and concats fall back to, and the
+# exports convert back to plain object columns.
+
+STRING = 'string[pyarrow]'
+
+CATEGORICAL_COLUMNS = [
+    'Shop[Name]', 'Shop[Country]', 'Shop[GT_CountryCode__c]', 'Shop[GT_AreaManagerCode__c]',
+    'Shop[GT_AreaCode__c]', 'Shop[GT_StoreType__c]', 'Shift[Label]', 'Service Resource[GT_Role__c]',
+    'Service Resource[IsActive]', 'Type', 'StartDateHour',
+    'Service Appointment[Status]', 'Service Appointment[GT_Cluster__c]', 'Service Appointment[GT_Macrocategory__c]',
+    'Service Appointment[Business_Shop__c]', 'Service Appointment[ServiceTerritoryId]',
+]
+
+STRING_COLUMNS = [
+    # HCM mapping key of the resources
+    'PersonalNumber SF',
+    # Shop codes
+    'GT_ShopCode__c', 'Shop[GT_ShopCode__c]', 'Resource.RelatedRecord.GT_StoreCode__c', 'Service Appointment[GT_ShopCode__c]',
+    # Resources
+    'Service Resource[GT_PersonalNumber__c]', 'Resource.GT_PersonalNumber__c', 'Service Resource[Name]',
+    'GT_ServiceResource__r.Name', 'Resource.Name', 'Service Resource[Id]', 'Shift[ServiceResourceId]',
+    'Service Territory Member[ServiceResourceId]', 'Service Appointment[GT_ServiceResource__c]',
+    # Record ids and dd/mm/YYYY day strings
+    'Shift[ShiftNumber]', 'AbsenceNumber', 'date', 'Service Appointment[AppointmentNumber]',
+    'Service Appointment[GT_AccountNameConcatenated__c]',
+]
+
+
+def compact(df):
+    """ Apply the dtype policy to the object columns of df it covers. Dates and numbers are left alone. """
+    for column in df.columns.intersection(CATEGORICAL_COLUMNS + STRING_COLUMNS):
+        if df[column].dtype == object:
+            df[column] = df[column].astype('category' if column in CATEGORICAL_COLUMNS else STRING)
+    return df
+
+
+def for_export(df):
+    """ Plain object columns with NaN for missing values, the way the exports and the dashboard expect them. """
+    df = df.copy()
+    for column in df.columns:
+        dtype = df[column].dtype
+        # Any string storage, state read back from parquet comes as string[python]
+        if isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            values = df[column].astype(object)
+            df[column] = values.where(values.notna(), np.nan)
+    return df
+
+
+def memory_mb(df):
+    """ Memory held by a frame in MB, strings included. """
+    return df.memory_usage(deep=True).sum() / 2**20
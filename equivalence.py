@@ -0,0 +1,225 @@
+from contextlib import contextmanager
+from datetime import datetime
+import importlib
+import json
+import os
+import pandas as pd
+import clockpairs
+import occupancy
+import runreport
+import slotstages
+
+# Equivalence of a candidate engine with the current code. An engine is a module
+# defining some of the HOOKS functions with the same signature and result as the
+# current ones, e.g. a compiled slot counter or a faster clock pairing. The check
+# computes the outputs twice on the same inputs (see openslotsdata.engine_outputs),
+# once with the current functions (legacy) and once with the candidate's in their
+# place. It compares shift_slots, sfshifts_merged, all_composite_keys (the HCM
+# comparison) and clockin_merged (the clock comparison) row by row on their keys,
+# with a tolerance per column. Rows missing on one side or with a value out of
+# tolerance are reported with their shops, resources and dates, together with the
+# time of each engine. Nothing is exported.
+
+# Functions an engine can replace, as (module, name)
+HOOKS = {
+    # Slot counting, absence overlap and booked slots per resource-day, see slotstages.resource_day_slots
+    'resource_day_slots': (slotstages, 'resource_day_slots'),
+    # Absences split into days, with the evening cutoff and the daily cap
+    'split_absence_days': (occupancy, 'split_absence_days'),
+    # Clock-in/clock-out labels and pairs, see clockpairs.py
+    'label_records': (clockpairs, 'label_records'),
+    'pair_hours': (clockpairs, 'pair_hours'),
+}
+
+# Outputs compared: the columns identifying a row, and the columns holding its shop, resource and date
+OUTPUTS = {
+    'shift_slots': {'keys': ['GT_ShopCode__c', 'date'], 'shop': 'GT_ShopCode__c', 'resource': None, 'date': 'date'},
+    'sfshifts_merged': {'keys': ['PersonalNumberId', 'ShiftDate'], 'shop': 'GT_ShopCode__c', 'resource': 'GT_ServiceResource__r.Name', 'date': 'ShiftDate'},
+    'all_composite_keys': {'keys': ['Clave compuesta'], 'shop': 'Shop Code', 'resource': 'Personal Number', 'date': 'iso_week'},
+    'clockin_merged': {'keys': ['PersonalNumber', 'Date'], 'shop': 'Shop Code', 'resource': 'PersonalNumber', 'date': 'Date'},
+}
+
+# Largest absolute difference accepted per numeric column, sums in another order differ in the last bits.
+# Other numeric columns get DEFAULT_TOLERANCE, text columns (the 'NC' of hours_worked) must be equal
+DEFAULT_TOLERANCE = 1e-9
+TOLERANCES = {
+    'TotalHours': 1e-9,
+    'BlockedHours': 1e-9,
+    'BookedHours': 1e-9,
+    'OpenHours': 1e-9,
+    'SaturationPercentage': 1e-6,
+    'BlockedHoursPercentage': 1e-6,
+    'hours_worked': 1e-6,
+    'hours_worked_numeric': 1e-6,
+    'Diferencia de act duración': 1e-6,
+}
+
+# Diverging shops, resources and dates printed per output, the report has all of them
+PRINT_LIMIT = 10
+
+
+def load_engine(module_name):
+    """ The HOOKS functions defined by module `module_name`, as {hook: function}. """
+    module = importlib.import_module(module_name)
+    replacements = {hook: getattr(module, hook) for hook in HOOKS if callable(getattr(module, hook, None))}
+    if not replacements:
+        raise ValueError(f"Module {module_name} defines none of {', '.join(HOOKS)}")
+    return replacements
+
+
+@contextmanager
+def engine(replacements):
+    """ Run the block with the `replacements` ({hook: function}) in place of the current functions. """
+    originals = {hook: getattr(*HOOKS[hook]) for hook in replacements}
+    try:
+        for hook, function in replacements.items():
+            module, name = HOOKS[hook]
+            setattr(module, name, function)
+        yield
+    finally:
+        for hook, function in originals.items():
+            module, name = HOOKS[hook]
+            setattr(module, name, function)
+
+
+def _plain(df):
+    # Categories and nullable types as plain values, the engines may differ in dtypes only
+    df = df.reset_index(drop=True).copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype) or pd.api.types.is_extension_array_dtype(df[column].dtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+def _keyed(df, keys):
+    # Rows sharing their keys are told apart by their order
+    return df.assign(_occurrence=df.groupby(keys, dropna=False, sort=False).cumcount())
+
+
+def _column_differs(legacy, candidate, tolerance):
+    # Numbers (text columns holding numbers included) within tolerance, anything else equal, missing on both sides is equal
+    legacy_numbers = pd.to_numeric(legacy, errors='coerce')
+    candidate_numbers = pd.to_numeric(candidate, errors='coerce')
+    numeric = legacy_numbers.notna() & candidate_numbers.notna()
+    differs = pd.Series(False, index=legacy.index)
+    differs[numeric] = (legacy_numbers[numeric] - candidate_numbers[numeric]).abs() > tolerance
+    other = ~numeric
+    both_missing = legacy.isna() & candidate.isna()
+    differs[other] = ~both_missing[other] & (legacy[other].astype(str) != candidate[other].astype(str))
+    return differs, (legacy_numbers[numeric] - candidate_numbers[numeric]).abs().max() if numeric.any() else None
+
+
+def _values(series):
+    values = series.dropna().unique().tolist()
+    return sorted(str(value.date()) if isinstance(value, pd.Timestamp) else str(value) for value in values)
+
+
+def compare(name, legacy, candidate):
+    """ Differences between the legacy and the candidate rows of output `name`, see OUTPUTS. """
+    spec = OUTPUTS[name]
+    keys = spec['keys'] + ['_occurrence']
+    legacy = _keyed(_plain(legacy), spec['keys'])
+    candidate = _keyed(_plain(candidate), spec['keys'])
+    merged = legacy.merge(candidate, on=keys, how='outer', suffixes=('', '__candidate'), indicator=True)
+    result = {
+        'legacy_rows': len(legacy),
+        'candidate_rows': len(candidate),
+        'legacy_only_rows': int((merged['_merge'] == 'left_only').sum()),
+        'candidate_only_rows': int((merged['_merge'] == 'right_only').sum()),
+        'missing_columns': sorted(set(legacy.columns) ^ set(candidate.columns)),
+        'columns': {},
+    }
+    both = merged['_merge'] == 'both'
+    diverging = merged['_merge'] != 'both'
+    for column in legacy.columns:
+        if column in keys or column not in candidate.columns:
+            continue
+        differs, max_difference = _column_differs(merged[column], merged[f'{column}__candidate'], TOLERANCES.get(column, DEFAULT_TOLERANCE))
+        differs &= both
+        if differs.any():
+            result['columns'][column] = {
+                'rows': int(differs.sum()),
+                'max_abs_difference': None if max_difference is None else float(max_difference),
+            }
+            diverging |= differs
+    # Shops, resources and dates of the diverging rows, from whichever side has the row
+    rows = merged[diverging]
+    for entity in ('shop', 'resource', 'date'):
+        column = spec[entity]
+        if column is None or column not in merged.columns:
+            continue
+        values = rows[column]
+        if f'{column}__candidate' in rows.columns:
+            values = values.fillna(rows[f'{column}__candidate'])
+        result[f'{entity}s'] = _values(values)
+    result['diverging_rows'] = int(diverging.sum())
+    result['equivalent'] = result['diverging_rows'] == 0 and not result['missing_columns']
+    return result
+
+
+def print_report(report):
+    """ Times, speedups and the diverging rows of an equivalence check. """
+    print(f"Engine {report['candidate']} against the current code:")
+    for part, legacy_seconds in report['legacy_seconds'].items():
+        candidate_seconds = report['candidate_seconds'][part]
+        print(f"  {part:<12} legacy {legacy_seconds:8.2f}s  candidate {candidate_seconds:8.2f}s  speedup {report['speedup'][part]}x")
+    for name, result in report['outputs'].items():
+        if result['equivalent']:
+            print(f"  {name}: equivalent, {result['legacy_rows']} rows")
+            continue
+        print(f"  {name}: {result['diverging_rows']} diverging rows of {result['legacy_rows']} "
+              f"({result['legacy_only_rows']} legacy only, {result['candidate_only_rows']} candidate only)")
+        if result['missing_columns']:
+            print(f"    columns on one side only: {', '.join(result['missing_columns'])}")
+        for column, difference in result['columns'].items():
+            print(f"    {column}: {difference['rows']} rows, max difference {difference['max_abs_difference']}")
+        for entity in ('shops', 'resources', 'dates'):
+            if result.get(entity):
+                more = f" and {len(result[entity]) - PRINT_LIMIT} more" if len(result[entity]) > PRINT_LIMIT else ''
+                print(f"    {entity}: {', '.join(result[entity][:PRINT_LIMIT])}{more}")
+    print("Equivalent" if report['equivalent'] else "NOT equivalent")
+
+
+def write_report(path, report):
+    """ Append an equivalence check to the reports at `path`, keeping the last runreport.HISTORY_LENGTH. """
+    checks = []
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                checks = json.load(f)['checks']
+        except (ValueError, KeyError):
+            print(f"Equivalence report {path} could not be read, starting a new history")
+    checks = (checks + [report])[-runreport.HISTORY_LENGTH:]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'checks': checks}, f, indent=2, default=str)
+    print(f"Equivalence report written to {path}")
+
+
+def check(module_name, compute, run_params, report_path=None):
+    """ Compare the outputs of the current code with those of the engine in module `module_name`, and time both.
+
+    compute() returns the outputs ({name: frame}) and the seconds of each part of
+    computing them, with the functions in place when it is called. It runs once as
+    is and once with the engine's functions. Returns the report. """
+    replacements = load_engine(module_name)
+    legacy, legacy_seconds = compute()
+    with engine(replacements):
+        candidate, candidate_seconds = compute()
+    legacy_seconds['total'] = round(sum(legacy_seconds.values()), 3)
+    candidate_seconds['total'] = round(sum(candidate_seconds.values()), 3)
+    report = {
+        'checked_at': datetime.now().isoformat(timespec='seconds'),
+        'candidate': module_name,
+        'hooks': sorted(replacements),
+        'params': {name: str(value) for name, value in run_params.items()},
+        'legacy_seconds': legacy_seconds,
+        'candidate_seconds': candidate_seconds,
+        'speedup': {part: round(legacy_seconds[part] / max(candidate_seconds[part], 1e-6), 2) for part in legacy_seconds},
+        'outputs': {name: compare(name, legacy[name], candidate[name]) for name in OUTPUTS if name in legacy and name in candidate},
+    }
+    report['equivalent'] = all(result['equivalent'] for result in report['outputs'].values())
+    print_report(report)
+    if report_path is not None:
+        write_report(report_path, report)
+    return report
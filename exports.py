@@ -0,0 +1,145 @@
+from datetime import date, datetime, time as clock_time
+import os
+import tempfile
+import time
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.worksheet.table import Table, TableStyleInfo
+import xlsxwriter
+
+# Excel exports written in one pass with xlsxwriter. The rows go out in order in
+# constant-memory mode, so a row's XML is flushed to disk once the next row starts
+# and memory stays flat whatever the size of the export. An export with a table is
+# the exception: xlsxwriter cannot add tables in constant-memory mode, those are
+# written in the normal mode with the table defined before the workbook is closed.
+# The cells hold what to_excel(engine='openpyxl') wrote: the same header, blanks for
+# missing values, strings never read as formulas or links, and pandas' formats for
+# dates and times. read_excel gives back the same frame from both.
+
+SHEET_NAME = 'Sheet1'
+
+# pandas' to_excel formats
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+DATE_FORMAT = 'yyyy-mm-dd'
+TIME_FORMAT = 'hh:mm:ss'
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+TABLE_STYLE = 'Table Style Medium 9'
+
+
+def _column_values(series):
+    # Python values of a column with None for missing ones, xlsxwriter skips those cells
+    values = series.to_numpy(dtype=object)
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+
+def _value_formats(formats):
+    """ The cell format of a date, datetime or time value, None for the other values. """
+    def value_format(value):
+        if isinstance(value, datetime):
+            return formats['datetime']
+        if isinstance(value, date):
+            return formats['date']
+        if isinstance(value, clock_time):
+            return formats['time']
+        return None
+    return value_format
+
+
+def write_excel(df, path, table_name=None, table_style=TABLE_STYLE):
+    """ Write df to the first sheet of `path` like to_excel(path, index=False), in one pass.
+
+    With `table_name` the rows are an Excel table in `table_style`, with banded rows and columns. """
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': table_name is None,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        # Infinite values become error cells, read_excel gives them back as NaN
+        'nan_inf_to_errors': True,
+    })
+    try:
+        worksheet = workbook.add_worksheet(SHEET_NAME)
+        header_format = workbook.add_format(HEADER_FORMAT)
+        formats = {
+            'datetime': workbook.add_format({'num_format': DATETIME_FORMAT}),
+            'date': workbook.add_format({'num_format': DATE_FORMAT}),
+            'time': workbook.add_format({'num_format': TIME_FORMAT}),
+        }
+        value_format = _value_formats(formats)
+        columns = [_column_values(df.iloc[:, i]) for i in range(df.shape[1])]
+        # Numeric and datetime columns go straight to their cell writer, object columns can hold anything
+        writers = []
+        for dtype in df.dtypes:
+            if pd.api.types.is_bool_dtype(dtype):
+                writers.append((worksheet.write_boolean, None))
+            elif pd.api.types.is_numeric_dtype(dtype):
+                writers.append((worksheet.write_number, None))
+            elif pd.api.types.is_datetime64_any_dtype(dtype):
+                writers.append((worksheet.write_datetime, formats['datetime']))
+            else:
+                writers.append((None, None))
+
+        worksheet.write_row(0, 0, list(df.columns), header_format)
+        for row, values in enumerate(zip(*columns), start=1):
+            for column, value in enumerate(values):
+                if value is None:
+                    continue
+                write, cell_format = writers[column]
+                if write is None:
+                    worksheet.write(row, column, value, value_format(value))
+                else:
+                    write(row, column, value, cell_format)
+
+        if table_name is not None and df.shape[1]:
+            # A table needs a data row, an empty export gets a blank one
+            worksheet.add_table(0, 0, max(len(df), 1), df.shape[1] - 1, {
+                'name': table_name,
+                'style': table_style,
+                'banded_columns': True,
+                'columns': [{'header': str(column), 'header_format': header_format} for column in df.columns],
+            })
+    finally:
+        workbook.close()
+    return path
+
+
+def _write_openpyxl(df, path, table_name=None):
+    """ The former export path: to_excel with openpyxl, then the table added by loading and saving the file again. """
+    df.to_excel(path, index=False, engine='openpyxl')
+    if table_name is None:
+        return path
+    wb = load_workbook(path)
+    ws = wb.active
+    table = Table(displayName=table_name, ref=f"{ws.cell(row=ws.min_row, column=ws.min_column).coordinate}:{ws.cell(row=ws.max_row, column=ws.max_column).coordinate}")
+    table.tableStyleInfo = TableStyleInfo(name='TableStyleMedium9', showFirstColumn=False, showLastColumn=False, showRowStripes=True, showColumnStripes=True)
+    ws.add_table(table)
+    wb.save(path)
+    return path
+
+
+def benchmark(frames, tables=None, compare=True):
+    """ Time the exports of `frames` ({file name: frame}) with the former openpyxl path and with write_excel.
+
+    `tables` maps file names to their table name. With `compare`, both files are read
+    back and their frames compared. Returns one dict per file and prints them. """
+    tables = tables or {}
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for file_name, df in frames.items():
+            result = {'file': file_name, 'rows': len(df), 'columns': df.shape[1]}
+            for writer, write in (('openpyxl', _write_openpyxl), ('xlsxwriter', write_excel)):
+                path = os.path.join(folder, f'{writer}-{file_name}')
+                started = time.perf_counter()
+                write(df, path, tables.get(file_name))
+                result[f'{writer}_seconds'] = round(time.perf_counter() - started, 2)
+                result[f'{writer}_mb'] = round(os.path.getsize(path) / 2**20, 2)
+            if compare:
+                expected = pd.read_excel(os.path.join(folder, f'openpyxl-{file_name}'))
+                written = pd.read_excel(os.path.join(folder, f'xlsxwriter-{file_name}'))
+                result['same'] = expected.equals(written)
+            result['speedup'] = round(result['openpyxl_seconds'] / max(result['xlsxwriter_seconds'], 1e-6), 1)
+            print(f"{file_name}: {result['rows']} rows, openpyxl {result['openpyxl_seconds']}s, xlsxwriter {result['xlsxwriter_seconds']}s "
+                  f"({result['speedup']}x)" + (f", same frame read back: {result['same']}" if compare else ''))
+            results.append(result)
+    return results
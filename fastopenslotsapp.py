@@ -12,6 +12,11 @@ from st_aggrid.AgGridReturn import AgGridReturn
 import json
 import os
 import numpy as np
+import history
+import horizon
+import outputdb
+import rollups
+import snapshots
 
 @st.cache_data
 def load_excel(file_path, usecols=None, **kwargs):
@@ -24,14 +29,14 @@ def load_excel(file_path, usecols=None, **kwargs):
         print(f"File {file_path} not found.")
         return None
 
-def find_last_working_day(start_date):
-    """ Helper function to find the last working day before a given start date. """
-    current_date = start_date
-    while True:
-        # Assuming Monday to Friday are working days (customize as needed)
-        if current_date.weekday() < 5:  # Monday is 0 and Friday is 4
-            return current_date
-        current_date -= timedelta(days=1)
+@st.cache_data
+def load_output(file_path, snapshot):
+    """ Load a pipeline output, preferring its Parquet snapshot over the Excel export. """
+    data = snapshots.read_snapshot(file_path, snapshot)
+    if data is not None:
+        print(f"Loaded snapshot of {file_path}")
+        return data
+    return load_excel(file_path)
 
 st.set_page_config(layout="wide")
 
@@ -127,120 +132,135 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
-def get_first_iso_week_start_date_current_month():
-    # Get the current date
-    today = datetime.today()
-    
-    # Get the first day of the current month with the time set to 00:00:00
-    first_day_of_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # Check if the first day of the month is a Sunday
-    if first_day_of_month.weekday() == 6:  # Sunday is represented by 6 in weekday()
-        # If Sunday, move to the next Monday
-        first_day_of_month += timedelta(days=1)
-    
-    # Get the ISO calendar week and weekday of the first day of the month
-    iso_year, iso_week, iso_weekday = first_day_of_month.isocalendar()
-    
-    # Calculate the difference to get back to the Monday of that ISO week
-    # ISO weeks start on Monday (iso_weekday = 1), so subtract the days to go back to Monday
-    start_date = first_day_of_month - timedelta(days=iso_weekday - 1)
-    
-    # Ensure the time part is set to 00:00:00
-    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    return start_date
+folder_path = 'shiftslots'
 
-def get_last_iso_week_end_date_current_month():
-    # Get the current date
-    today = datetime.today()
-    
-    # Get the last day of the current month with the time set to 00:00:00
-    last_day_of_month = today.replace(day=calendar.monthrange(today.year, today.month)[1], hour=0, minute=0, second=0, microsecond=0)
-    
-    # Get the ISO calendar week and weekday of the last day of the month
-    iso_year, iso_week, iso_weekday = last_day_of_month.isocalendar()
-    
-    # Calculate the difference to get to Sunday of that ISO week
-    # ISO weeks end on Sunday (iso_weekday = 7), so add the days to go to Sunday
-    end_date = last_day_of_month + timedelta(days=(7 - iso_weekday))
-    
-    # Ensure the time part is set to 00:00:00
-    end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    return end_date
+@st.cache_data
+def load_months(name, start_date, end_date):
+    """ Load the rows of a pipeline output from start_date to end_date out of its month partitions. """
+    data = horizon.read_months(name, start_date, end_date)
+    if data is not None:
+        print(f"Loaded month partitions of {name}")
+    return data
 
-folder_path = 'shiftslots'
+@st.cache_data
+def load_history(when, start_date, end_date):
+    """ Load the shiftslots rows from start_date to end_date as the latest run on or before `when` left them. """
+    data = history.as_of(when, start_date, end_date)
+    if data is not None:
+        print(f"Loaded shiftslots history as of {history.resolve(when)}")
+    return data
 
-# Example usage: dynamically calculate start and end dates for the current month
-start_date = get_first_iso_week_start_date_current_month()
-end_date = get_last_iso_week_end_date_current_month()
+@st.cache_data
+def query_output(name, snapshot, filters=(), columns=None, distinct=False):
+    """ Load the rows of a pipeline output passing `filters` from its snapshot in the output database. """
+    data = outputdb.read(name, snapshot, filters, columns, distinct)
+    print(f"Queried {len(data)} rows of {name} as of {snapshot}")
+    return data
 
-start_iso_year, start_iso_week, _ = start_date.isocalendar()
-end_iso_year, end_iso_week, _ = end_date.isocalendar()
-current_iso_year, current_iso_week, _ = datetime.now().isocalendar()
+@st.cache_data
+def load_rollup(table, when, filters=()):
+    """ Load the rows of a pipeline rollup passing `filters` as the latest run on or before `when` wrote them. """
+    data = rollups.read(table, when, filters)
+    if data is not None:
+        print(f"Loaded {len(data)} rows of rollup {table} as of {rollups.resolve(table, when)}")
+    return data
+
+@st.cache_resource
+def build_output_db(run_date):
+    """ Build the output database from the month partitions and snapshots of the run of `run_date`, once per run. """
+    run_months = [pd.Period(label, freq='M') for label in horizon.load_manifest()['horizon']]
+    outputdb.build(run_date, *horizon.run_window(run_months))
+    print(f"Built the output database for the run of {run_date}")
+
+# Months of the pipeline's rolling horizon, the current month when there are no month partitions yet
+current_month = pd.Period(datetime.now(), freq='M')
+manifest = horizon.load_manifest()
+horizon_months = [pd.Period(label, freq='M') for label in manifest['horizon']] or [current_month]
+selected_month = st.sidebar.selectbox(
+    'Select Month', horizon_months,
+    index=horizon_months.index(current_month) if current_month in horizon_months else 0,
+    format_func=lambda month: month.strftime('%B %Y')
+)
 
-def get_start_and_end_of_current_month():
-    # Get the current date
-    today = datetime.today()
-    
-    # Start date is the 1st day of the current month
-    month_start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # End date is the last day of the current month
-    last_day_of_month = calendar.monthrange(today.year, today.month)[1]  # Get last day of current month
-    month_end_date = today.replace(day=last_day_of_month, hour=23, minute=59, second=59, microsecond=999999)
-    
-    return month_start_date, month_end_date
+# ISO weeks of the selected month, the first one starting on the Monday before the 1st unless that is a Sunday
+start_date, end_date = horizon.month_window(selected_month)
+window_weeks = horizon.iso_weeks(start_date, end_date)
+current_iso_year, current_iso_week, _ = datetime.now().isocalendar()
 
-# Example usage to get the start and end dates of the current month
-month_start_date, month_end_date = get_start_and_end_of_current_month()
+# Calendar days of the selected month
+month_start_date = selected_month.start_time
+month_end_date = selected_month.end_time
+# The agenda as it was on the first day of the current month, for the comparisons
+comparison_start_date = current_month.start_time
 current_date = datetime.now()
 yesterday_date = current_date - timedelta(days=1)
 
-# Determine if today is Monday
-if current_date.weekday() == 0:  # Monday
-    print("Today is Monday, directly finding last Friday's file...")
-    # On Monday, skip Sunday and Saturday
-    last_working_day = find_last_working_day(current_date - timedelta(days=3))
+# The latest run's export, earlier runs are only in the shiftslots history
+latest_file_name = 'shiftslots.xlsx'
+
+# Yesterday's and the month start's agenda come from the rollups, these rows are only read without them
+def load_shift_slots_yesterday():
+    """ Yesterday's agenda from the shiftslots history, the latest run before today (the last working day's on a Monday). """
+    return load_history(yesterday_date, start_date, end_date)
+
+def load_shift_slots_sep6():
+    """ The agenda of the first day of the current month from the shiftslots history. """
+    return load_history(comparison_start_date, start_date, end_date)
+
+# The pipeline's output database has the latest snapshot of every output. Its rows are queried with the sidebar
+# filters pushed down, a session keeps the rows of its selection only. Without it the outputs are loaded whole.
+# The database is not committed, it is built here when it is missing or older than the latest run
+latest_snapshot = outputdb.resolve('shiftslots', current_date)
+if manifest.get('run_date') and manifest['horizon'] and (latest_snapshot is None or latest_snapshot < manifest['run_date']):
+    build_output_db(manifest['run_date'])
+output_snapshots = {name: outputdb.resolve(name, current_date) for name in outputdb.TABLES}
+use_output_db = output_snapshots['shiftslots'] is not None
+
+if use_output_db:
+    shift_slots = None
+    # Region, Area, Shop[Name] and ISO week of the selected month's rows, for the sidebar lists
+    dimensions = query_output(
+        'shiftslots', output_snapshots['shiftslots'], tuple(outputdb.window('shiftslots', start_date, end_date)),
+        ('Region', 'Area', 'Shop[Name]', 'iso_week'), distinct=True
+    )
 else:
-    # On other days, start with today
-    last_working_day = find_last_working_day(current_date)
-
-today_file_name = f"shiftslots_{current_date.strftime('%Y-%m-%d')}.xlsx"
-yesterday_file_name = f"shiftslots_{yesterday_date.strftime('%Y-%m-%d')}.xlsx"
-sep6_file_name = f"shiftslots_{month_start_date.strftime('%Y-%m-%d')}.xlsx"
-last_working_day_file_name = f"shiftslots_{last_working_day.strftime('%Y-%m-%d')}.xlsx"
-
-shift_slots = load_excel(os.path.join(folder_path, today_file_name))
-
-# Fallback to yesterday's file if today’s file is missing and it’s not Monday
-if shift_slots is None and current_date.weekday() != 0:
-    print("Today's file not found, trying yesterday's file...")
-    shift_slots = load_excel(os.path.join(folder_path, yesterday_file_name))
+    # The selected month from the month partitions, frozen months included
+    shift_slots = load_months('shiftslots', start_date, end_date)
+
+    # Without month partitions, the latest run's export, or the latest run in the history
+    if shift_slots is None:
+        shift_slots = load_output(os.path.join(folder_path, latest_file_name), 'shiftslots')
+    if shift_slots is None:
+        shift_slots = load_history(current_date, start_date, end_date)
+
+    # Stop if no run left its shift slots
+    if shift_slots is None:
+        st.error("No shift slots found: neither the latest export nor the shiftslots history.")
+        st.stop()
+
+    hcp_shift_slots = load_months('hcpshiftslots', start_date, end_date)
+    if hcp_shift_slots is None:
+        hcp_shift_slots = load_output('output/hcpshiftslots.xlsx', 'hcpshiftslots')
+    hcm = load_output('output/hcm_sf_merged.xlsx', 'hcm_sf_merged')
+    clock= load_output('output/clock.xlsx', 'clock')
+
+    # The exports cover every open month of the horizon, keep the selected month's weeks
+    shift_slots = shift_slots[(shift_slots['date'] >= start_date) & (shift_slots['date'] <= end_date)]
+    hcp_shift_slots = hcp_shift_slots[(hcp_shift_slots['ShiftDate'] >= start_date) & (hcp_shift_slots['ShiftDate'] <= end_date)]
+    hcm = hcm[hcm['iso_week'].isin([week for _, week in window_weeks])]
+    dimensions = shift_slots[['Region', 'Area', 'Shop[Name]', 'iso_week']]
+if dimensions.empty:
+    st.error(f"No shift slots for {selected_month.strftime('%B %Y')}.")
+    st.stop()
 
-# Fallback to last working day’s file if both today’s and yesterday’s files are missing
-if shift_slots is None:
-    print("No file found for today or yesterday, trying the last working day's file...")
-    shift_slots = load_excel(os.path.join(folder_path, last_working_day_file_name))
+def load_month_shift_slots():
+    """ The selected month's shift slots, queried whole from the output database when they were not loaded. """
+    if shift_slots is not None:
+        return shift_slots
+    return query_output('shiftslots', output_snapshots['shiftslots'], tuple(outputdb.window('shiftslots', start_date, end_date)))
 
-# Stop if no file is found after all attempts
-if shift_slots is None:
-    st.error("No file found for today, yesterday, or the last working day.")
-    st.stop()
-shift_slots_yesterday = load_excel(os.path.join(folder_path, yesterday_file_name))
-if shift_slots_yesterday is None:
-    print("Yesterday's file not found, finding the last working day...")
-    last_working_day_yesterday = find_last_working_day(yesterday_date)
-    last_working_day_yesterday_file_name = f"shiftslots_{last_working_day_yesterday.strftime('%Y-%m-%d')}.xlsx"
-    shift_slots_yesterday = load_excel(os.path.join(folder_path, last_working_day_yesterday_file_name))
-
-shift_slots_sep6 = load_excel(os.path.join(folder_path, sep6_file_name))
-hcp_shift_slots = load_excel('output/hcpshiftslots.xlsx')
-hcm = load_excel('output/hcm_sf_merged.xlsx')
-clock= load_excel('output/clock.xlsx')
-# Assuming `shift_slots['iso_week']` is a list of ISO weeks
-available_weeks = sorted(shift_slots['iso_week'].unique())
+# ISO weeks of the month with data, in calendar order across a year end
+available_weeks = [week for _, week in window_weeks if week in set(dimensions['iso_week'])]
 # Find the index of the current ISO week in the list
 if current_iso_week in available_weeks:
     current_week_index = available_weeks.index(current_iso_week)
@@ -250,16 +270,12 @@ else:
 # Sidebar filters (all converted to single-selection using selectbox)
 iso_week_filter = st.sidebar.selectbox('Select ISO Week', available_weeks, index=current_week_index)
 
-# Calculate the previous ISO week and year based on the selected ISO week
-selected_iso_year = datetime.now().year  # Assuming current year, adjust if you have a different dataset
-previous_iso_week = iso_week_filter - 1
-previous_iso_year = selected_iso_year
-if previous_iso_week == 0:
-    previous_iso_year -= 1
-    previous_iso_week = 52 if (pd.Timestamp(f"{previous_iso_year}-12-28").isocalendar()[1] == 52) else 53
+# Calculate the previous ISO week and year based on the selected ISO week, the year is the one the week has in the selected month
+selected_iso_year = dict((week, year) for year, week in window_weeks)[iso_week_filter]
+previous_iso_year, previous_iso_week, _ = (datetime.fromisocalendar(selected_iso_year, int(iso_week_filter), 1) - timedelta(days=7)).isocalendar()
 
 # Sidebar filter for Region
-region_list = sorted(shift_slots['Region'].dropna().unique().tolist())
+region_list = sorted(dimensions['Region'].dropna().unique().tolist())
 region_options = ["All"] + region_list
 
 selected_region = st.sidebar.selectbox(
@@ -270,9 +286,9 @@ selected_region = st.sidebar.selectbox(
 )
 # Filter data based on the selected region
 if selected_region == "All":
-    filtered_shift_slots_by_region = shift_slots
+    filtered_shift_slots_by_region = dimensions
 else:
-    filtered_shift_slots_by_region = shift_slots[shift_slots['Region'] == selected_region]
+    filtered_shift_slots_by_region = dimensions[dimensions['Region'] == selected_region]
 
 # Sidebar filter for Area based on filtered data by Region
 area_list = sorted(filtered_shift_slots_by_region['Area'].dropna().unique().tolist())
@@ -349,29 +365,55 @@ def filter_hcp_shift_slots(data, selected_region, selected_area, selected_shop):
 
     return filtered_data
 
-# Apply the filters fo r the other datasets
-filtered_data = filter_data(shift_slots, iso_week_filter, selected_region, selected_area, selected_shop, 'iso_week')
-filtered_hcp_shift_slots = filter_hcp_shift_slots(hcp_shift_slots, selected_region, selected_area, selected_shop)
-weekly_shift_slots = filter_hcp_shift_slots(shift_slots, selected_region, selected_area, selected_shop)
-weekly_shift_slots_yesterday = filter_hcp_shift_slots(shift_slots_yesterday, selected_region, selected_area, selected_shop)
-weekly_shift_sep6 = filter_hcp_shift_slots(shift_slots_sep6, selected_region, selected_area, selected_shop)
-
-# Apply the filters to HCM data (without iso_week filter)
-filtered_hcm = filter_hcm_data(hcm, selected_region, selected_area, selected_shop)
-filtered_clock = filter_data(clock,iso_week_filter, selected_region, selected_area, selected_shop, 'iso_week')
-filtered_clock_noiso = filter_hcp_shift_slots(clock, selected_region, selected_area, selected_shop)
-
-# Filter data for the previous ISO week without applying the current filters (directly from shift_slots)
-previous_week_data = shift_slots[
-    (shift_slots['iso_week'] == previous_iso_week) &
-    (shift_slots['Region'] == selected_region if selected_region != "All" else True) &
-    (shift_slots['Area'] == selected_area if selected_area != "All" else True) &
-    (shift_slots['Shop[Name]'] == selected_shop if selected_shop != "All" else True)
-]
+def query_selection(name, filters=()):
+    """ Rows of a pipeline output in the sidebar's Region / Area / Shop selection passing `filters`, from the output database. """
+    return query_output(name, output_snapshots[name], tuple(
+        outputdb.selection(name, selected_region, selected_area, selected_shop) + list(filters)
+    ))
+
+if use_output_db:
+    # The same rows as the filters below, selected by the database
+    month_rows = outputdb.window('shiftslots', start_date, end_date)
+    filtered_data = query_selection('shiftslots', month_rows + [('iso_week', '==', iso_week_filter)])
+    filtered_hcp_shift_slots = query_selection('hcpshiftslots', outputdb.window('hcpshiftslots', start_date, end_date))
+    weekly_shift_slots = query_selection('shiftslots', month_rows)
+    filtered_hcm = query_selection('hcm_sf_merged', [('iso_week', 'in', [week for _, week in window_weeks])])
+    filtered_clock = query_selection('clock', [('iso_week', '==', iso_week_filter)])
+    filtered_clock_noiso = query_selection('clock')
+else:
+    # Apply the filters fo r the other datasets
+    filtered_data = filter_data(shift_slots, iso_week_filter, selected_region, selected_area, selected_shop, 'iso_week')
+    filtered_hcp_shift_slots = filter_hcp_shift_slots(hcp_shift_slots, selected_region, selected_area, selected_shop)
+    weekly_shift_slots = filter_hcp_shift_slots(shift_slots, selected_region, selected_area, selected_shop)
+
+    # Apply the filters to HCM data (without iso_week filter)
+    filtered_hcm = filter_hcm_data(hcm, selected_region, selected_area, selected_shop)
+    filtered_clock = filter_data(clock,iso_week_filter, selected_region, selected_area, selected_shop, 'iso_week')
+    filtered_clock_noiso = filter_hcp_shift_slots(clock, selected_region, selected_area, selected_shop)
+
+# Sidebar stats and Overview sums come from the pipeline's rollups at the level of the selection
+rollup_level = rollups.level_of(selected_region, selected_area, selected_shop)
+rollup_selection = rollups.selection(selected_region, selected_area, selected_shop)
+
+def load_rollup_or_rows(table, when, load_rows, filters=()):
+    """ Rows of a rollup as of `when`, rolled up from load_rows() when the pipeline wrote none (an empty rollup without rows either). """
+    data = load_rollup(table, when, tuple(filters))
+    if data is None:
+        rows = load_rows()
+        data = rollups.select(rollups.build(outputdb.read('shiftslots', None) if rows is None else rows, [table])[table], filters)
+    return data
+
+# Week sums of the selected and the previous ISO week, the previous one from the month before when it starts the month
+weeks_rollup = load_rollup_or_rows(
+    f'{rollup_level}_week', current_date, load_month_shift_slots,
+    rollup_selection + [('iso_week', 'in', [int(iso_week_filter), int(previous_iso_week)])]
+)
+selected_week_rows = (weeks_rollup['iso_year'] == selected_iso_year) & (weeks_rollup['iso_week'] == iso_week_filter)
+previous_week_rows = (weeks_rollup['iso_year'] == previous_iso_year) & (weeks_rollup['iso_week'] == previous_iso_week)
 
 # Calculate Open Hours for the current and previous weeks
-open_hours_this_week = filtered_data['OpenHours'].sum()
-open_hours_last_week = previous_week_data['OpenHours'].sum()
+open_hours_this_week = weeks_rollup.loc[selected_week_rows, 'OpenHours'].sum()
+open_hours_last_week = weeks_rollup.loc[previous_week_rows, 'OpenHours'].sum()
 
 # Calculate percentage change from last week, with checks to prevent division by zero
 if open_hours_last_week != 0:
@@ -380,18 +422,24 @@ else:
     change_from_last_week = 0  # Or handle differently, depending on your needs
 
 # Calculate the start and end dates for the selected ISO week
-selected_week_start = pd.Timestamp(selected_iso_year, 1, 1) + pd.offsets.Week(weekday=0) * (int(iso_week_filter) - 1)
+selected_week_start = pd.Timestamp(datetime.fromisocalendar(selected_iso_year, int(iso_week_filter), 1))
 selected_week_end = selected_week_start + pd.offsets.Week(weekday=6)
 today = pd.Timestamp(datetime.now().date())
-end_of_month = today.replace(day=1) + pd.offsets.MonthEnd(0)
-# Calculate "Open Hours for the month to go" using the entire dataset
-month_to_go_data = shift_slots[(shift_slots['date'] >= today) & (shift_slots['date'] <= end_of_month)]
-open_hours_month_to_go = month_to_go_data['OpenHours'].sum()
+end_of_month = month_end_date.normalize()
+# Calculate "Open Hours for the month to go" from the day sums, all of a month still to come and nothing of a past one
+month_to_go_data = load_rollup_or_rows(
+    f'{rollup_level}_date', current_date, load_month_shift_slots,
+    rollup_selection + [('month', '==', str(selected_month)), ('date', '>=', max(today, month_start_date))]
+)
+open_hours_month_to_go = month_to_go_data.loc[month_to_go_data['date'] <= end_of_month, 'OpenHours'].sum()
 
 
-# Determine the best configured region      
+# Determine the best configured region, the highest mean SaturationPercentage over the weeks of the month
 
-best_configured_region = shift_slots.groupby('Region')['SaturationPercentage'].mean().idxmax() if not filtered_data.empty else 'N/A'
+region_weeks = load_rollup_or_rows('region_week', current_date, load_month_shift_slots, [('iso_week', 'in', [week for _, week in window_weeks])])
+region_weeks = region_weeks[pd.MultiIndex.from_frame(region_weeks[['iso_year', 'iso_week']]).isin(window_weeks)]
+region_saturation = region_weeks.groupby('Region')[['SaturationPercentageSum', 'SaturationPercentageCount']].sum()
+best_configured_region = (region_saturation['SaturationPercentageSum'] / region_saturation['SaturationPercentageCount']).idxmax() if not filtered_data.empty else 'N/A'
 st.sidebar.markdown(f"<div class='sidebar-stats-box'>Open hours for the selected week: {open_hours_this_week:,.0f}</div>", unsafe_allow_html=True)
 st.sidebar.markdown(f"<div class='sidebar-stats-box'>Change from last week: {change_from_last_week:,.0f}%</div>", unsafe_allow_html=True)
 st.sidebar.markdown(f"<div class='sidebar-stats-box'>Open hours for month to go: {open_hours_month_to_go:,.0f}</div>", unsafe_allow_html=True)
@@ -840,7 +888,7 @@ with tab4:
 
     ]
     # Append dynamic column definitions for each week's SF, HCM, Delta (apply color coding based on Delta value)
-    for week in range(start_iso_week, end_iso_week+1):
+    for _, week in window_weeks:
         columnDefs.append({
             "headerName": f"Week {week}",
             "children": [
@@ -1268,12 +1316,17 @@ with tab3:
 #     # Display the plotly graph in Streamlit
 #     st.plotly_chart(fig, use_container_width=True)
 with tab6:
-    if weekly_shift_slots.empty:
+    # Week sums of the selected month's days in the selection, as of today, yesterday and the month start
+    overview_filters = rollup_selection + [('month', '==', str(selected_month))]
+    weekly_rollup = load_rollup_or_rows(f'{rollup_level}_week', current_date, load_month_shift_slots, overview_filters)
+    weekly_rollup_yesterday = load_rollup_or_rows(f'{rollup_level}_week', yesterday_date, load_shift_slots_yesterday, overview_filters)
+    weekly_rollup_sep6 = load_rollup_or_rows(f'{rollup_level}_week', comparison_start_date, load_shift_slots_sep6, overview_filters)
+    if weekly_rollup.empty:
         st.warning("No shops found for the selected filter criteria.")
-    if weekly_shift_slots_yesterday.empty:
+    if weekly_rollup_yesterday.empty:
         st.warning("No shops found for the selected filter criteria.")
 
-    formatted_month_start_date = month_start_date.strftime("%B %#d").lstrip('0')
+    formatted_month_start_date = comparison_start_date.strftime("%B %#d").lstrip('0')
 
     st.markdown("### Weekly Overview")
     # Add a new selectbox for comparison options
@@ -1294,48 +1347,42 @@ with tab6:
     # Get the column associated with the selected metric
     metric_column = metric_map[selected_metric]
 
-    weekly_shift_slots = weekly_shift_slots[(weekly_shift_slots['date'] >= month_start_date) & (weekly_shift_slots['date'] <= month_end_date)].copy()
-    weekly_shift_slots_yesterday = weekly_shift_slots_yesterday[(weekly_shift_slots_yesterday['date'] >= month_start_date) & (weekly_shift_slots_yesterday['date'] <= month_end_date)].copy()
-    weekly_shift_sep6 = weekly_shift_sep6[(weekly_shift_sep6['date'] >= month_start_date) & (weekly_shift_sep6['date'] <= month_end_date)].copy()
-    
     # Step: Calculate Saturation for each DataFrame
-    for df in [weekly_shift_slots, weekly_shift_slots_yesterday, weekly_shift_sep6]:
+    for df in [weekly_rollup, weekly_rollup_yesterday, weekly_rollup_sep6]:
         df['Saturation'] = (
-            (df['BlockedHours'] + df['BookedHours']) /
+            df['SaturatedHours'] /
             df['TotalHours'].replace(0, np.nan)
         ).fillna(0)
 
     # Choose the appropriate comparison DataFrame
     if selected_comparison == f'Comparison with start of the month ({formatted_month_start_date})':
-        comparison_df = weekly_shift_sep6
+        comparison_df = weekly_rollup_sep6
         comparison_label = formatted_month_start_date
     else:
-        comparison_df = weekly_shift_slots_yesterday
+        comparison_df = weekly_rollup_yesterday
         comparison_label = 'Yesterday'
 
     # For 'Saturation % change', handle calculations differently
     if selected_metric == 'Saturation % change':
         # Step 1: Aggregate the sums of the hours for each Region and iso_week
-        grouped_today = weekly_shift_slots.groupby(['Region', 'iso_week']).agg({
-            'BlockedHours': 'sum',
-            'BookedHours': 'sum',
+        grouped_today = weekly_rollup.groupby(['Region', 'iso_week']).agg({
+            'SaturatedHours': 'sum',
             'TotalHours': 'sum'
         }).reset_index()
 
         grouped_comparison = comparison_df.groupby(['Region', 'iso_week']).agg({
-            'BlockedHours': 'sum',
-            'BookedHours': 'sum',
+            'SaturatedHours': 'sum',
             'TotalHours': 'sum'
         }).reset_index()
 
         # Step 2: Calculate Saturation for each group
         grouped_today['Saturation_today'] = (
-            (grouped_today['BlockedHours'] + grouped_today['BookedHours']) /
+            grouped_today['SaturatedHours'] /
             grouped_today['TotalHours'].replace(0, np.nan)
         ).fillna(0)
 
         grouped_comparison['Saturation_comparison'] = (
-            (grouped_comparison['BlockedHours'] + grouped_comparison['BookedHours']) /
+            grouped_comparison['SaturatedHours'] /
             grouped_comparison['TotalHours'].replace(0, np.nan)
         ).fillna(0)
 
@@ -1361,13 +1408,9 @@ with tab6:
         merged_grouped = merged_data.copy()
 
         # Calculate monthly totals
-        monthly_total_today = (
-            weekly_shift_slots['BlockedHours'].sum() + weekly_shift_slots['BookedHours'].sum()
-        ) / weekly_shift_slots['TotalHours'].sum()
+        monthly_total_today = weekly_rollup['SaturatedHours'].sum() / weekly_rollup['TotalHours'].sum()
 
-        monthly_total_comparison = (
-            comparison_df['BlockedHours'].sum() + comparison_df['BookedHours'].sum()
-        ) / comparison_df['TotalHours'].sum()
+        monthly_total_comparison = comparison_df['SaturatedHours'].sum() / comparison_df['TotalHours'].sum()
 
         monthly_percentage_change = calculate_percentage_change(monthly_total_today, monthly_total_comparison)
 
@@ -1391,7 +1434,7 @@ with tab6:
                 fill_value=0
             ).reset_index()
 
-        weekly_aggregated = pivot_metric(weekly_shift_slots)
+        weekly_aggregated = pivot_metric(weekly_rollup)
         comparison_aggregated = pivot_metric(comparison_df)
 
         # Step 2: Melt the data to convert wide to long format
@@ -1477,12 +1520,10 @@ with tab6:
     for week_col, week in zip(week_columns, iso_weeks):
         if selected_metric == 'Saturation % change':
             total_saturation_today = (
-                weekly_shift_slots.loc[weekly_shift_slots['iso_week'] == week, 'BlockedHours'].sum() +
-                weekly_shift_slots.loc[weekly_shift_slots['iso_week'] == week, 'BookedHours'].sum()
-            ) / weekly_shift_slots.loc[weekly_shift_slots['iso_week'] == week, 'TotalHours'].sum()
+                weekly_rollup.loc[weekly_rollup['iso_week'] == week, 'SaturatedHours'].sum()
+            ) / weekly_rollup.loc[weekly_rollup['iso_week'] == week, 'TotalHours'].sum()
             total_saturation_comparison = (
-                comparison_df.loc[comparison_df['iso_week'] == week, 'BlockedHours'].sum() +
-                comparison_df.loc[comparison_df['iso_week'] == week, 'BookedHours'].sum()
+                comparison_df.loc[comparison_df['iso_week'] == week, 'SaturatedHours'].sum()
             ) / comparison_df.loc[comparison_df['iso_week'] == week, 'TotalHours'].sum()
             total_percentage_change = calculate_percentage_change(total_saturation_today, total_saturation_comparison)
         else:
@@ -1761,7 +1802,8 @@ with tab6:
     # Get today's date
     today = datetime.now().date()
 
-    # Convert the 'date' column to datetime
+    # Convert the 'date' column to datetime, today's shops are listed from the selected month's rows
+    weekly_shift_slots = weekly_shift_slots[(weekly_shift_slots['date'] >= month_start_date) & (weekly_shift_slots['date'] <= month_end_date)].copy()
     weekly_shift_slots['date'] = pd.to_datetime(weekly_shift_slots['date'], format='%Y-%m-%d')
 
     # Step 1: Filter the dataset to include necessary columns for today
@@ -0,0 +1,255 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import snapshots
+
+# History of the daily shiftslots exports. Instead of a full copy per run, the store
+# keeps one version of each (shop, date) row per period in which it did not change.
+# current.parquet holds the rows as of the latest snapshot, each with the snapshot it
+# first appeared in (valid_from). A run appends the versions it replaced or removed
+# to a segment, closed with its own snapshot (valid_to). A snapshot is the run date,
+# YYYY-MM-DD. `as_of` rebuilds the rows of a snapshot and `changes` lists the rows
+# that differ between two, both reading only the segments whose validity can overlap
+# the snapshots asked for. `compact` drops old snapshots and merges the segments.
+
+HISTORY_DIR = os.path.join('shiftslots', 'history')
+NAME = 'shiftslots'
+KEY = ['GT_ShopCode__c', 'date']
+VALID_FROM = 'valid_from'
+VALID_TO = 'valid_to'
+ROW_HASH = 'row_hash'
+
+# Daily snapshots kept by compact, the first snapshot of every month is kept as well
+KEEP_DAYS = 45
+
+
+def _manifest_path(history_dir):
+    return os.path.join(history_dir, 'history.json')
+
+
+def _load_manifest(history_dir):
+    if not os.path.exists(_manifest_path(history_dir)):
+        return {'snapshots': [], 'segments': []}
+    with open(_manifest_path(history_dir)) as f:
+        return json.load(f)
+
+
+def _save_manifest(history_dir, manifest):
+    # Written to a temporary file and renamed, an interrupted run leaves the previous manifest
+    with open(_manifest_path(history_dir) + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(_manifest_path(history_dir) + '.tmp', _manifest_path(history_dir))
+
+
+def _write(df, path):
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _typed(df):
+    """ The rows as the snapshot schema types them, with a hash of their values. """
+    rows = snapshots.to_table(df, NAME).to_pandas()
+    values = [column for column in rows.columns if column not in KEY]
+    rows[ROW_HASH] = pd.util.hash_pandas_object(rows[values], index=False).to_numpy().view('int64')
+    return rows
+
+
+def _read_current(history_dir):
+    current_path = os.path.join(history_dir, 'current.parquet')
+    if not os.path.exists(current_path):
+        return None
+    return pd.read_parquet(current_path)
+
+
+def snapshot_ids(history_dir=HISTORY_DIR):
+    """ The snapshots kept in the store, oldest first. """
+    return [entry['snapshot'] for entry in _load_manifest(history_dir)['snapshots']]
+
+
+def resolve(when, history_dir=HISTORY_DIR):
+    """ The latest kept snapshot on or before `when` (a date or YYYY-MM-DD), None if there is none. """
+    when = pd.Timestamp(when).strftime('%Y-%m-%d')
+    earlier = [snapshot for snapshot in snapshot_ids(history_dir) if snapshot <= when]
+    return earlier[-1] if earlier else None
+
+
+def _undo_latest(history_dir, manifest):
+    # The latest snapshot is recorded again: its new versions go and the ones it closed are current again
+    latest = manifest['snapshots'].pop()['snapshot']
+    current = _read_current(history_dir)
+    current = current[current[VALID_FROM] != latest]
+    segment = f'closed-{latest}.parquet'
+    if any(entry['file'] == segment for entry in manifest['segments']):
+        reopened = pd.read_parquet(os.path.join(history_dir, segment)).drop(columns=[VALID_TO])
+        current = pd.concat([current, reopened], ignore_index=True)
+        manifest['segments'] = [entry for entry in manifest['segments'] if entry['file'] != segment]
+        os.remove(os.path.join(history_dir, segment))
+    return current
+
+
+def record(df, snapshot, start_date=None, end_date=None, history_dir=HISTORY_DIR):
+    """ Record the shiftslots rows of a run as snapshot `snapshot` (YYYY-MM-DD).
+
+    Only rows dated from start_date to end_date, the run's window, are compared: rows
+    of other dates stay as they were. Recording the latest snapshot again replaces it,
+    an older one is refused. Returns the number of added, changed and removed rows. """
+    os.makedirs(history_dir, exist_ok=True)
+    manifest = _load_manifest(history_dir)
+    latest = manifest['snapshots'][-1]['snapshot'] if manifest['snapshots'] else None
+    if latest is not None and snapshot < latest:
+        print(f"History: snapshot {snapshot} is older than the latest one ({latest}), not recorded")
+        return None
+    current = _undo_latest(history_dir, manifest) if snapshot == latest else _read_current(history_dir)
+
+    rows = _typed(df)
+    if current is None:
+        current = rows.iloc[:0].assign(**{VALID_FROM: pd.Series(dtype=object)})
+    in_window = pd.Series(True, index=current.index)
+    if start_date is not None:
+        in_window &= current['date'] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        in_window &= current['date'] <= pd.Timestamp(end_date)
+
+    # Rows whose key is new, gone or has other values than its current version
+    compared = current.loc[in_window, KEY + [ROW_HASH]].merge(rows[KEY + [ROW_HASH]], on=KEY, how='outer', suffixes=('_old', '_new'), indicator=True)
+    unchanged = compared[(compared['_merge'] == 'both') & (compared[f'{ROW_HASH}_old'] == compared[f'{ROW_HASH}_new'])]
+    unchanged_keys = pd.MultiIndex.from_frame(unchanged[KEY])
+    kept = current[~in_window | pd.MultiIndex.from_frame(current[KEY]).isin(unchanged_keys)]
+    closed = current[in_window & ~pd.MultiIndex.from_frame(current[KEY]).isin(unchanged_keys)]
+    opened = rows[~pd.MultiIndex.from_frame(rows[KEY]).isin(unchanged_keys)].assign(**{VALID_FROM: snapshot})
+
+    counts = {
+        'added': int((compared['_merge'] == 'right_only').sum()),
+        'changed': int(((compared['_merge'] == 'both') & (compared[f'{ROW_HASH}_old'] != compared[f'{ROW_HASH}_new'])).sum()),
+        'removed': int((compared['_merge'] == 'left_only').sum()),
+    }
+    if len(closed):
+        segment = f'closed-{snapshot}.parquet'
+        _write(closed.assign(**{VALID_TO: snapshot}), os.path.join(history_dir, segment))
+        manifest['segments'].append({
+            'file': segment,
+            'rows': len(closed),
+            'first_valid_from': closed[VALID_FROM].min(),
+            'last_valid_to': snapshot,
+        })
+    current = pd.concat([kept, opened], ignore_index=True).sort_values(KEY).reset_index(drop=True)
+    _write(current, os.path.join(history_dir, 'current.parquet'))
+    manifest['snapshots'].append(dict(snapshot=snapshot, rows=len(current), **counts))
+    _save_manifest(history_dir, manifest)
+    print(f"History: snapshot {snapshot} recorded, {counts['added']} added, {counts['changed']} changed, {counts['removed']} removed rows")
+    return counts
+
+
+def _versions(history_dir, manifest, first, last, start_date, end_date):
+    """ Versions valid at some snapshot from `first` to `last`, from the current rows and the segments that can hold them. """
+    date_filter = None
+    if start_date is not None:
+        date_filter = ds.field('date') >= pa.scalar(pd.Timestamp(start_date), type=pa.timestamp('ns'))
+    if end_date is not None:
+        upper = ds.field('date') <= pa.scalar(pd.Timestamp(end_date), type=pa.timestamp('ns'))
+        date_filter = upper if date_filter is None else date_filter & upper
+
+    def read(path, extra):
+        row_filter = extra if date_filter is None else date_filter & extra
+        return ds.dataset(path, format='parquet').to_table(filter=row_filter).to_pandas()
+
+    frames = [read(os.path.join(history_dir, 'current.parquet'), ds.field(VALID_FROM) <= last).assign(**{VALID_TO: None})]
+    for entry in manifest['segments']:
+        # A segment closed before `first` or whose versions all start after `last` has nothing valid in between
+        if entry['last_valid_to'] <= first or entry['first_valid_from'] > last:
+            continue
+        frames.append(read(os.path.join(history_dir, entry['file']), (ds.field(VALID_FROM) <= last) & (ds.field(VALID_TO) > first)))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _state(versions, snapshot):
+    valid = (versions[VALID_FROM] <= snapshot) & (versions[VALID_TO].isna() | (versions[VALID_TO] > snapshot))
+    return versions[valid]
+
+
+def _restore_missing(df):
+    # Parquet hands back None for missing values of object columns, the exports hold NaN
+    object_cols = df.columns[df.dtypes == object]
+    df[object_cols] = df[object_cols].where(df[object_cols].notna(), np.nan)
+    return df
+
+
+def as_of(when, start_date=None, end_date=None, history_dir=HISTORY_DIR):
+    """ The shiftslots rows as the latest snapshot on or before `when` had them, dated from start_date to end_date. None without such a snapshot. """
+    snapshot = resolve(when, history_dir)
+    if snapshot is None:
+        return None
+    versions = _versions(history_dir, _load_manifest(history_dir), snapshot, snapshot, start_date, end_date)
+    state = _state(versions, snapshot).drop(columns=[VALID_FROM, VALID_TO, ROW_HASH])
+    return _restore_missing(state.sort_values(KEY).reset_index(drop=True))
+
+
+def changes(before, after, start_date=None, end_date=None, history_dir=HISTORY_DIR):
+    """ Rows that differ between the snapshots of `before` and `after`, one per key.
+
+    `change` is 'added', 'removed' or 'changed'. The columns hold the values as of
+    `after`, or as of `before` for removed rows, and `valid_from` the snapshot the
+    row's values first appeared in. """
+    first, last = resolve(before, history_dir), resolve(after, history_dir)
+    if first is None or last is None:
+        return None
+    versions = _versions(history_dir, _load_manifest(history_dir), first, last, start_date, end_date)
+    old, new = _state(versions, first), _state(versions, last)
+    compared = old[KEY + [ROW_HASH]].merge(new[KEY + [ROW_HASH]], on=KEY, how='outer', suffixes=('_old', '_new'), indicator=True)
+    compared['change'] = compared['_merge'].map({'left_only': 'removed', 'right_only': 'added', 'both': 'changed'}).astype(object)
+    compared = compared[(compared['_merge'] != 'both') | (compared[f'{ROW_HASH}_old'] != compared[f'{ROW_HASH}_new'])]
+    rows = pd.concat([new, old[~pd.MultiIndex.from_frame(old[KEY]).isin(pd.MultiIndex.from_frame(new[KEY]))]], ignore_index=True)
+    rows = compared[KEY + ['change']].merge(rows.drop(columns=[VALID_TO, ROW_HASH]), on=KEY, how='left')
+    return _restore_missing(rows.sort_values(KEY).reset_index(drop=True))
+
+
+def compact(keep_days=KEEP_DAYS, history_dir=HISTORY_DIR):
+    """ Drop the snapshots older than `keep_days` before the latest one, except the first of each month, and merge the segments.
+
+    Versions no kept snapshot can see are removed. The latest snapshot's segment
+    stays apart so that snapshot can still be recorded again. """
+    manifest = _load_manifest(history_dir)
+    if not manifest['snapshots']:
+        print("History: nothing to compact")
+        return None
+    ids = [entry['snapshot'] for entry in manifest['snapshots']]
+    latest = ids[-1]
+    cutoff = (pd.Timestamp(latest) - pd.Timedelta(days=keep_days)).strftime('%Y-%m-%d')
+    month_firsts = {snapshot[:7]: snapshot for snapshot in reversed(ids)}
+    kept_ids = [snapshot for snapshot in ids if snapshot >= cutoff or month_firsts[snapshot[:7]] == snapshot]
+
+    latest_segment = f'closed-{latest}.parquet'
+    merge = [entry for entry in manifest['segments'] if entry['file'] != latest_segment]
+    versions = pd.concat([pd.read_parquet(os.path.join(history_dir, entry['file'])) for entry in merge], ignore_index=True) if merge else None
+    dropped_versions = 0
+    if versions is not None:
+        # A version is seen by a kept snapshot when one falls in [valid_from, valid_to)
+        kept = np.array(kept_ids)
+        first_kept = np.searchsorted(kept, versions[VALID_FROM].to_numpy(dtype=str), side='left')
+        seen = first_kept < len(kept)
+        seen[seen] = kept[first_kept[seen]] < versions[VALID_TO].to_numpy(dtype=str)[seen]
+        dropped_versions = int((~seen).sum())
+        versions = versions[seen].sort_values(KEY + [VALID_FROM]).reset_index(drop=True)
+
+    for entry in merge:
+        os.remove(os.path.join(history_dir, entry['file']))
+    segments = [entry for entry in manifest['segments'] if entry['file'] == latest_segment]
+    if versions is not None and len(versions):
+        compacted = f'compacted-{latest}.parquet'
+        _write(versions, os.path.join(history_dir, compacted))
+        segments.insert(0, {
+            'file': compacted,
+            'rows': len(versions),
+            'first_valid_from': versions[VALID_FROM].min(),
+            'last_valid_to': versions[VALID_TO].max(),
+        })
+    manifest['segments'] = segments
+    manifest['snapshots'] = [entry for entry in manifest['snapshots'] if entry['snapshot'] in kept_ids]
+    _save_manifest(history_dir, manifest)
+    result = {'snapshots_dropped': len(ids) - len(kept_ids), 'versions_dropped': dropped_versions, 'segments_merged': len(merge)}
+    print(f"History: {result['snapshots_dropped']} snapshots and {dropped_versions} versions dropped, {len(merge)} segments merged")
+    return result
@@ -0,0 +1,182 @@
+import calendar
+import json
+import os
+from datetime import timedelta
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import snapshots
+
+# Rolling horizon of months. A run covers the months from MONTHS_BACK before the
+# current month to MONTHS_AHEAD after it. Its shift slot outputs are stored per
+# calendar month under output/months/<output>/month=YYYY-MM, cast to the snapshot
+# schemas, with a months.json manifest. A month is closed once its last ISO week has
+# ended: the run that first sees it closed writes it one last time and freezes it.
+# Later runs leave frozen months out of their date window and never rewrite them, so
+# a run computes the open months only, however far back the horizon reaches. The
+# manifest also records the date of the run that wrote it last.
+# A run window starts and ends with ISO weeks that reach into the neighbouring
+# months. Their days are written to those months' partitions as well, and a
+# partition keeps its rows of the days outside the run window, so a month is built
+# up from partial writes. Only closed months of the horizon, computed in full, freeze.
+
+MONTHS_FOLDER = os.path.join('output', 'months')
+MONTHS_BACK = 1
+MONTHS_AHEAD = 3
+
+# Outputs kept per month and the date column their rows are split on
+PARTITIONED = {
+    'shiftslots': 'date',
+    'hcpshiftslots': 'ShiftDate',
+}
+
+OPEN = 'open'
+FROZEN = 'frozen'
+
+
+def month_window(month):
+    """ Monday of the month's first ISO week and Sunday of its last one, as datetimes at 00:00.
+
+    A month starting on a Sunday starts with the week of the following Monday. """
+    first_day_of_month = month.start_time.to_pydatetime()
+    # Check if the first day of the month is a Sunday
+    if first_day_of_month.weekday() == 6:  # Sunday is represented by 6 in weekday()
+        # If Sunday, move to the next Monday
+        first_day_of_month += timedelta(days=1)
+    # ISO weeks start on Monday (iso_weekday = 1), so subtract the days to go back to Monday
+    start_date = first_day_of_month - timedelta(days=first_day_of_month.isoweekday() - 1)
+
+    last_day_of_month = first_day_of_month.replace(day=calendar.monthrange(month.year, month.month)[1])
+    # ISO weeks end on Sunday (iso_weekday = 7), so add the days to go to Sunday
+    end_date = last_day_of_month + timedelta(days=7 - last_day_of_month.isoweekday())
+    return start_date, end_date
+
+
+def month_windows(dates):
+    """ month_window of the calendar month of each date, as a start and an end Series. """
+    months = pd.Series(pd.to_datetime(dates)).dt.to_period('M')
+    windows = {month: month_window(month) for month in months.dropna().unique()}
+    starts = months.map(lambda month: windows[month][0] if month in windows else pd.NaT)
+    ends = months.map(lambda month: windows[month][1] if month in windows else pd.NaT)
+    return pd.to_datetime(starts), pd.to_datetime(ends)
+
+
+def iso_weeks(start_date, end_date):
+    """ (ISO year, ISO week) of the weeks from start_date to end_date, in calendar order across a year end. """
+    weeks = pd.date_range(start_date, end_date, freq='W-MON').isocalendar()
+    return [(int(year), int(week)) for year, week in zip(weeks['year'], weeks['week'])]
+
+
+def months(today, back=MONTHS_BACK, ahead=MONTHS_AHEAD):
+    """ The months of the horizon around today's month, oldest first. """
+    current = pd.Period(today, freq='M')
+    return [current + offset for offset in range(-back, ahead + 1)]
+
+
+def is_closed(month, today):
+    """ True once the last ISO week of the month has ended. """
+    return pd.Timestamp(today).normalize() > pd.Timestamp(month_window(month)[1])
+
+
+def _manifest_path(folder):
+    return os.path.join(folder, 'months.json')
+
+
+def load_manifest(folder=MONTHS_FOLDER):
+    """ The months.json of the month partitions, empty when nothing was written yet. """
+    if not os.path.exists(_manifest_path(folder)):
+        return {'horizon': [], 'months': {}}
+    with open(_manifest_path(folder)) as f:
+        return json.load(f)
+
+
+def _save_manifest(folder, manifest):
+    # Written to a temporary file and renamed, an interrupted run leaves the previous manifest
+    with open(_manifest_path(folder) + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(_manifest_path(folder) + '.tmp', _manifest_path(folder))
+
+
+def open_months(horizon, folder=MONTHS_FOLDER):
+    """ The months of the horizon that are not frozen, the ones a run has to compute. """
+    frozen = {label for label, entry in load_manifest(folder)['months'].items() if entry['state'] == FROZEN}
+    return [month for month in horizon if str(month) not in frozen]
+
+
+def run_window(months):
+    """ Date window of a run over consecutive months: the first one's start to the last one's end. """
+    return month_window(months[0])[0], month_window(months[-1])[1]
+
+
+def _partition_path(folder, name, month):
+    return os.path.join(folder, name, f'month={month}', 'part-0.parquet')
+
+
+def _with_kept_days(stored, fresh, name, start_date, end_date):
+    """ The fresh rows of a month, plus the stored ones dated outside the run window that the run did not compute. """
+    column = PARTITIONED[name]
+    dates = pd.to_datetime(stored[column], errors='coerce')
+    kept = stored[(dates < pd.Timestamp(start_date)) | (dates > pd.Timestamp(end_date))]
+    if kept.empty or fresh.empty:
+        return fresh if kept.empty else kept
+    return pd.concat([kept, fresh], ignore_index=True).sort_values(column, kind='stable')
+
+
+def write_months(horizon, start_date, end_date, today, outputs, folder=MONTHS_FOLDER):
+    """ Store the rows of `outputs` ({name: frame}) per month of the run window, skipping frozen months.
+
+    Closed months of the horizon are frozen after this write. The months before and
+    after the horizon get the days of the window's first and last ISO weeks, they
+    stay open. Rows of days outside the window are kept from the month's partition.
+    Returns the labels of the months written. """
+    os.makedirs(folder, exist_ok=True)
+    manifest = load_manifest(folder)
+    labels = [str(month) for month in horizon]
+    written = []
+    for month in pd.period_range(start_date, end_date, freq='M'):
+        label = str(month)
+        entry = manifest['months'].get(label)
+        if entry is not None and entry['state'] == FROZEN:
+            continue
+        # A month outside the horizon is only partly inside the window, it is never frozen
+        closed = is_closed(month, today) and label in labels
+        rows = {}
+        for name, df in outputs.items():
+            dates = pd.to_datetime(df[PARTITIONED[name]], errors='coerce')
+            month_rows = df[(dates >= month.start_time) & (dates <= month.end_time)]
+            partition_path = _partition_path(folder, name, label)
+            if os.path.exists(partition_path):
+                month_rows = _with_kept_days(pq.ParquetFile(partition_path).read().to_pandas(), month_rows, name, start_date, end_date)
+            table = snapshots.to_table(month_rows, name)
+            os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+            pq.write_table(table, partition_path + '.tmp')
+            os.replace(partition_path + '.tmp', partition_path)
+            rows[name] = table.num_rows
+        month_start, month_end = month_window(month)
+        manifest['months'][label] = {
+            'state': FROZEN if closed else OPEN,
+            'window': [month_start.isoformat(), month_end.isoformat()],
+            'rows': rows,
+            'written': pd.Timestamp.now().isoformat(timespec='seconds'),
+        }
+        written.append(label)
+    manifest['horizon'] = labels
+    manifest['run_date'] = pd.Timestamp(today).strftime('%Y-%m-%d')
+    _save_manifest(folder, manifest)
+    frozen = [label for label in written if manifest['months'][label]['state'] == FROZEN]
+    print(f"Month partitions written for {', '.join(written) or 'no month'}" + (f", frozen now: {', '.join(frozen)}" if frozen else ''))
+    return written
+
+
+def read_months(name, start_date, end_date, folder=MONTHS_FOLDER):
+    """ Rows of output `name` dated from start_date to end_date, from the month partitions. None when there are none. """
+    paths = [
+        _partition_path(folder, name, str(month))
+        for month in pd.period_range(start_date, end_date, freq='M')
+        if os.path.exists(_partition_path(folder, name, str(month)))
+    ]
+    if not paths:
+        return None
+    df = ds.dataset(paths, schema=snapshots.SCHEMAS[name], format='parquet').to_table().to_pandas()
+    dates = df[PARTITIONED[name]]
+    return df[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))].reset_index(drop=True)
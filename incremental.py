@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import datacache
+import keys
+import slotstages
+
+# Incremental mode for the per resource-day slot stages. The results of the previous
+# run are kept under .cache/incremental together with one fingerprint per source row
+# and the LastModifiedDate watermarks of shifts and appointments. On the next run only
+# the resource-days whose source rows were added, removed or modified are recomputed.
+
+STATE_DIR = os.path.join(datacache.CACHE_DIR, 'incremental')
+STATE_VERSION = 2
+
+# Neighbouring days are recomputed as well, shifts and appointments can run past midnight
+_DAY_MARGIN = 1
+
+_STAGE_SOURCES = ['occupancy.py', 'slotstages.py', 'incremental.py', 'keys.py']
+
+
+def _code_hash():
+    # Stored results are only reused by the code that produced them
+    digest = hashlib.sha256()
+    for name in _STAGE_SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _row_fingerprints(df, columns):
+    # 44-bit row hashes, small enough to be summed per resource-day without overflowing int64
+    return (pd.util.hash_pandas_object(df[columns], index=False).to_numpy() >> 20).astype('int64')
+
+
+def _fingerprint_table(df, key_cols, date_col, columns):
+    """ One row per source row: the resource keys, the day and a fingerprint of the row content. """
+    table = df[key_cols].reset_index(drop=True)
+    table['day'] = pd.to_datetime(df[date_col]).dt.normalize().to_numpy()
+    table['fingerprint'] = _row_fingerprints(df, columns)
+    return table
+
+
+def _changed_days(previous, current, key):
+    """ Days of `key` whose rows differ between two fingerprint tables, in either direction. """
+    old = previous.groupby([key, 'day'], dropna=False)['fingerprint'].agg(['sum', 'size'])
+    new = current.groupby([key, 'day'], dropna=False)['fingerprint'].agg(['sum', 'size'])
+    both = old.join(new, how='outer', lsuffix='_old', rsuffix='_new')
+    changed = (both['sum_old'] != both['sum_new']) | (both['size_old'] != both['size_new'])
+    return both.index[changed].to_frame(index=False).rename(columns={key: 'key'})
+
+
+def _modified_since(df, key, date_col, modified_col, watermark):
+    """ Days of `key` with a row modified after the previous run's watermark. """
+    if watermark is None:
+        return pd.DataFrame(columns=['key', 'day'])
+    modified = df[pd.to_datetime(df[modified_col]) > pd.Timestamp(watermark)]
+    return pd.DataFrame({'key': modified[key].array, 'day': pd.to_datetime(modified[date_col]).dt.normalize().to_numpy()})
+
+
+def _with_margin(days):
+    return pd.concat(
+        [days.assign(day=days['day'] + pd.Timedelta(days=offset)) for offset in range(-_DAY_MARGIN, _DAY_MARGIN + 1)],
+        ignore_index=True
+    ).drop_duplicates()
+
+
+def _in_days(ids, day, days):
+    """ Mask of the rows whose (key, day) pair is in `days`. """
+    wanted = pd.MultiIndex.from_frame(days[['key', 'day']])
+    return pd.MultiIndex.from_arrays([ids.array, pd.to_datetime(day).dt.normalize().to_numpy()]).isin(wanted)
+
+
+def _watermark(series):
+    latest = pd.to_datetime(series, errors='coerce').max()
+    return None if pd.isna(latest) else latest.isoformat()
+
+
+def _load_state(state_dir):
+    state_path = os.path.join(state_dir, 'state.json')
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as f:
+        state = json.load(f)
+    frames = {}
+    for name in state['frames']:
+        frames[name] = pd.read_parquet(os.path.join(state_dir, f'{name}.parquet'))
+    return state, frames
+
+
+def _save_state(state_dir, state, frames):
+    os.makedirs(state_dir, exist_ok=True)
+    _clear_state(state_dir)
+    for name, frame in frames.items():
+        frame.to_parquet(os.path.join(state_dir, f'{name}.parquet'), index=False)
+    state['frames'] = sorted(frames)
+    # state.json is removed first and written last, a run interrupted while saving leaves no state and the next run is a full one
+    with open(os.path.join(state_dir, 'state.json'), 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def _clear_state(state_dir):
+    state_path = os.path.join(state_dir, 'state.json')
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+
+def _restore_missing(df):
+    # Parquet hands back None for missing values of object columns, the stages produce NaN
+    object_cols = df.columns[df.dtypes == object]
+    df[object_cols] = df[object_cols].where(df[object_cols].notna(), np.nan)
+    return df
+
+
+def _concat(frames):
+    # Empty frames are left out, their dtypes would decide the result's (a pandas FutureWarning)
+    non_empty = [frame for frame in frames if len(frame)]
+    return pd.concat(non_empty or frames[:1], ignore_index=True)
+
+
+def resource_day_slots(shifts_grouped, absences_grouped, appointments_filtered, window, enabled=True, workers=1, state_dir=STATE_DIR):
+    """ slotstages.resource_day_slots, recomputing only the resource-days changed since the previous run.
+
+    Falls back to a full computation when there is no usable state: first run, other
+    date window, or a change to the stage code. The state is refreshed on every run. """
+    if not enabled:
+        return slotstages.resource_day_slots_by_shop(shifts_grouped, absences_grouped, appointments_filtered, workers)
+
+    appointments = appointments_filtered.assign(
+        PersonalidId=keys.ids(appointments_filtered['Service Appointment[GT_ShopCode__c]'], appointments_filtered['Service Appointment[GT_ServiceResource__c]'])
+    )
+    absence_ids = keys.ids(absences_grouped['Resource.RelatedRecord.GT_StoreCode__c'], absences_grouped['Service Resource[Id]'])
+
+    fingerprints = {
+        'shift_rows': _fingerprint_table(shifts_grouped, ['PersonalNumberId', 'ShopResourceId'], 'ShiftDate', list(shifts_grouped.columns)),
+        'absence_rows': _fingerprint_table(absences_grouped.assign(PersonalidId=absence_ids), ['PersonalNumberId', 'PersonalidId'], 'AbsenceDate', list(absences_grouped.columns)),
+        'appointment_rows': _fingerprint_table(appointments, ['PersonalidId'], 'ApptStartTime', ['PersonalidId', 'ApptStartTime', 'ApptEndTime']),
+    }
+    state = {
+        'version': STATE_VERSION,
+        'code': _code_hash(),
+        'window': [pd.Timestamp(window[0]).isoformat(), pd.Timestamp(window[1]).isoformat()],
+        'watermarks': {
+            'Shift[LastModifiedDate]': _watermark(shifts_grouped['LastModifiedDate']),
+            'Service Appointment[LastModifiedDate]': _watermark(appointments_filtered['ApptsLastModifiedDate']),
+        },
+    }
+
+    previous = _load_state(state_dir)
+    reusable = previous is not None and all(previous[0].get(field) == state[field] for field in ['version', 'code', 'window'])
+    if not reusable:
+        print("Incremental: no reusable state, computing every resource-day")
+        # Drop the old state first so a failed run never leaves results that do not match the fingerprints
+        _clear_state(state_dir)
+        sfshifts_merged, booked_slots, overlapping_slots = slotstages.resource_day_slots_by_shop(shifts_grouped, absences_grouped, appointments_filtered, workers)
+        _save_state(state_dir, state, dict(fingerprints, sfshifts_merged=sfshifts_merged, booked_slots=booked_slots, overlapping_slots=overlapping_slots))
+        return sfshifts_merged, booked_slots, overlapping_slots
+
+    previous_state, stored = previous
+    previous_watermarks = previous_state['watermarks']
+
+    # Rows modified after the watermark, plus added and removed rows which the watermark cannot see
+    shift_rows = pd.concat([stored['shift_rows'], fingerprints['shift_rows']], ignore_index=True)
+    absence_rows = pd.concat([stored['absence_rows'], fingerprints['absence_rows']], ignore_index=True)
+    touched_numbers = pd.concat([
+        _changed_days(stored['shift_rows'], fingerprints['shift_rows'], 'PersonalNumberId'),
+        _changed_days(stored['absence_rows'], fingerprints['absence_rows'], 'PersonalNumberId'),
+        _modified_since(shifts_grouped, 'PersonalNumberId', 'ShiftDate', 'LastModifiedDate', previous_watermarks['Shift[LastModifiedDate]']),
+    ], ignore_index=True).drop_duplicates()
+
+    # Booked slots are keyed by the resource id, a changed shift day touches the ids it had before and after
+    touched_shift_days = shift_rows[_in_days(shift_rows['PersonalNumberId'], shift_rows['day'], touched_numbers)]
+    touched_absence_days = absence_rows[_in_days(absence_rows['PersonalNumberId'], absence_rows['day'], touched_numbers)]
+    touched_ids = pd.concat([
+        pd.DataFrame({'key': touched_shift_days['ShopResourceId'].array, 'day': touched_shift_days['day'].to_numpy()}),
+        pd.DataFrame({'key': touched_absence_days['PersonalidId'].array, 'day': touched_absence_days['day'].to_numpy()}),
+        _changed_days(stored['appointment_rows'], fingerprints['appointment_rows'], 'PersonalidId'),
+        _modified_since(appointments, 'PersonalidId', 'ApptStartTime', 'ApptsLastModifiedDate', previous_watermarks['Service Appointment[LastModifiedDate]']),
+    ], ignore_index=True).dropna().drop_duplicates()
+
+    print(f"Incremental: {len(touched_numbers)} resource-days changed by shifts/absences, {len(touched_ids)} by appointments/shifts/absences")
+
+    # Every source row within the margin of a touched resource-day takes part in its recomputation
+    numbers_margin = _with_margin(touched_numbers)
+    ids_margin = _with_margin(touched_ids)
+    shifts_subset = shifts_grouped[
+        _in_days(shifts_grouped['PersonalNumberId'], shifts_grouped['ShiftDate'], numbers_margin)
+        | _in_days(shifts_grouped['ShopResourceId'], shifts_grouped['ShiftDate'], ids_margin)
+    ]
+    absences_subset = absences_grouped[
+        _in_days(absences_grouped['PersonalNumberId'], absences_grouped['AbsenceDate'], numbers_margin)
+        | _in_days(absence_ids, absences_grouped['AbsenceDate'], ids_margin)
+    ]
+    appointments_subset = appointments_filtered[_in_days(appointments['PersonalidId'], appointments['ApptStartTime'], ids_margin)]
+    fresh_sfshifts, fresh_booked, fresh_overlapping = slotstages.resource_day_slots_by_shop(shifts_subset, absences_subset, appointments_subset, workers)
+
+    # Replace the stored results of the touched resource-days with the recomputed ones
+    sfshifts_merged = _restore_missing(stored['sfshifts_merged'])
+    sfshifts_merged = _concat([
+        sfshifts_merged[~_in_days(sfshifts_merged['PersonalNumberId'], sfshifts_merged['ShiftDate'], touched_numbers)],
+        fresh_sfshifts[_in_days(fresh_sfshifts['PersonalNumberId'], fresh_sfshifts['ShiftDate'], touched_numbers)],
+    ])
+    sfshifts_merged = sfshifts_merged.sort_values(['PersonalNumberId', 'ShiftDate'], kind='stable').reset_index(drop=True)
+
+    slots = {}
+    for name, fresh in [('booked_slots', fresh_booked), ('overlapping_slots', fresh_overlapping)]:
+        kept = stored[name][~_in_days(stored[name]['PersonalidId'], stored[name]['date'], touched_ids)]
+        fresh = fresh[_in_days(fresh['PersonalidId'], fresh['date'], touched_ids)]
+        slots[name] = _concat([kept, fresh]).sort_values(slotstages.RESOURCE_KEYS + ['date']).reset_index(drop=True)
+
+    _save_state(state_dir, state, dict(fingerprints, sfshifts_merged=sfshifts_merged, **slots))
+    return sfshifts_merged, slots['booked_slots'], slots['overlapping_slots']
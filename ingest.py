@@ -0,0 +1,169 @@
+from datetime import date, datetime
+import csv
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+from pandas.io.parsers import TextParser
+
+# Readers that push the run's filters down into the parse. A filter is a
+# (column, op, value) tuple and a row is kept when it passes all of them. Rows that
+# fail are dropped while the file is streamed (openpyxl read_only rows for xlsx,
+# pyarrow record batches for csv), before they become DataFrame rows. Only the
+# `usecols` columns are kept.
+#
+# The readers drop a row only when its value can be compared and the comparison
+# fails. A value that cannot be parsed is kept. So the callers still apply their own
+# exact filters afterwards, and those see the same rows as before, minus the ones
+# they would have dropped anyway. Timestamps are compared as wall time, without the
+# UTC offset, like to_datetime(...).dt.tz_localize(None).
+
+OPS = {
+    '>=': lambda values, bound: values >= bound,
+    '<=': lambda values, bound: values <= bound,
+    '>': lambda values, bound: values > bound,
+    '<': lambda values, bound: values < bound,
+    '==': lambda values, bound: values == bound,
+    'in': lambda values, bound: values in bound,
+    'not in': lambda values, bound: values not in bound,
+}
+
+# pandas' default missing-value markers, so csv strings come out as read_csv gives them
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+
+def _is_timestamp(value):
+    return isinstance(value, (datetime, date, pd.Timestamp))
+
+
+def _as_timestamp(value):
+    # Wall time of a cell value, None when it is not a timestamp
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.strip()).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+
+def _as_number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _passes(value, op, bound):
+    """ False only when the value can be compared with bound and the comparison fails. """
+    if op in ('in', 'not in'):
+        return OPS[op](value, bound)
+    if value is None or value == '':
+        # Missing values are NaT/NaN, every comparison with them fails
+        return False
+    if _is_timestamp(bound):
+        value = _as_timestamp(value)
+        bound = pd.Timestamp(bound).to_pydatetime()
+    elif isinstance(bound, (int, float)):
+        value = _as_number(value)
+    if value is None:
+        return True
+    return OPS[op](value, bound)
+
+
+def _convert_cell(cell):
+    # Same conversion as pandas' openpyxl reader, so TextParser sees the values read_excel would
+    if cell.value is None:
+        return ''
+    if cell.data_type == 'e':
+        return np.nan
+    if cell.data_type == 'n':
+        number = int(cell.value)
+        return number if number == cell.value else float(cell.value)
+    return cell.value
+
+
+def read_excel(file_path, usecols=None, filters=(), dtype=None, sheet_name=0, **kwargs):
+    """ pd.read_excel of the first-row header and the rows passing `filters`, streamed with openpyxl. """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows()
+        header = [_convert_cell(cell) for cell in next(rows)]
+        columns = [i for i, name in enumerate(header) if usecols is None or name in usecols]
+        checks = [(header.index(column), op, bound) for column, op, bound in filters]
+        data = [[header[i] for i in columns]]
+        last_with_data = 1
+        for row in rows:
+            # Rows end at their last cell with a value, only the kept columns are converted
+            width = len(row)
+            if all(_passes(_convert_cell(row[i]) if i < width else '', op, bound) for i, op, bound in checks):
+                data.append([_convert_cell(row[i]) if i < width else '' for i in columns])
+                # Trailing empty rows are dropped, like read_excel does
+                if any(cell.value is not None for cell in row):
+                    last_with_data = len(data)
+    finally:
+        workbook.close()
+    return TextParser(data[:last_with_data], header=0, dtype=dtype, **kwargs).read()
+
+
+def _batch_mask(batch, column, op, bound):
+    values = batch.column(column)
+    if op in ('in', 'not in'):
+        mask = pc.is_in(values, value_set=pa.array(list(bound), type=values.type))
+        return pc.invert(mask) if op == 'not in' else mask
+    if _is_timestamp(bound):
+        bound = pd.Timestamp(bound).to_pydatetime()
+        if pa.types.is_string(values.type):
+            try:
+                values = pc.cast(values, pa.timestamp('us'))
+            except pa.ArrowInvalid:
+                # Not all ISO timestamps, the caller's own filter decides
+                return None
+        elif pa.types.is_timestamp(values.type) and values.type.tz is not None:
+            values = pc.local_timestamp(values)
+    elif pa.types.is_string(values.type):
+        return None
+    compare = {'>=': pc.greater_equal, '<=': pc.less_equal, '>': pc.greater, '<': pc.less, '==': pc.equal}[op]
+    return pc.fill_null(compare(values, pa.scalar(bound)), False)
+
+
+def read_csv(file_path, usecols=None, filters=(), dtype=None, **kwargs):
+    """ pd.read_csv of the rows passing `filters`, streamed in pyarrow record batches.
+
+    Columns given as str in `dtype` are read as strings, the others are typed by
+    pyarrow. Missing strings come back as NaN like read_csv gives them. """
+    dtype = dtype or {}
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        header = next(csv.reader(f))
+    # read_csv keeps the file's column order whatever the order of usecols
+    columns = [name for name in header if usecols is None or name in usecols]
+    include = columns + [column for column, _, _ in filters if column not in columns]
+    convert = pacsv.ConvertOptions(
+        include_columns=include,
+        column_types={column: pa.string() for column, kind in dtype.items() if kind is str},
+        null_values=NA_VALUES,
+        strings_can_be_null=True,
+    )
+    reader = pacsv.open_csv(file_path, convert_options=convert)
+    batches = []
+    for batch in reader:
+        for column, op, bound in filters:
+            mask = _batch_mask(batch, column, op, bound)
+            if mask is not None:
+                batch = batch.filter(mask)
+        batches.append(batch)
+    df = pa.Table.from_batches(batches, schema=reader.schema).select(columns).to_pandas()
+    object_cols = df.columns[df.dtypes == object]
+    df[object_cols] = df[object_cols].where(df[object_cols].notna(), np.nan)
+    return df
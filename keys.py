@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+# Surrogate keys. Resources, shop-resources and resource-weeks are identified by an
+# int64 id derived from the columns the key is made of, so merges and groupbys run on
+# integers instead of strings concatenated for the purpose. The ids depend on the
+# component values only: they are the same in every run and process, in the stage
+# cache and in the incremental state. The readable keys of the exports are built from
+# the same components with `labels`.
+
+# Separator of each key's readable form, as the exports and the dashboard show it
+KEYS = {
+    # Shop code and personal number, PersonalNumberKey
+    'resource': '_',
+    # Shop code and SF service resource id, ShopResourceKey and PersonalidKey
+    'shop_resource': '',
+    # Shop code, personal number, ISO year and ISO week, Clave compuesta
+    'resource_week': '_',
+}
+
+
+def _component(values):
+    values = pd.Series(values).reset_index(drop=True)
+    # Numbers are hashed as int64 whatever their dtype, an ISO week held as UInt32 meets the int64 of another frame
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.astype('float64').fillna(-1).astype('int64')
+    # Strings are hashed once per distinct value, a categorical hashes its categories and maps the codes
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype('category')
+    return values
+
+
+def ids(*components):
+    """ Stable int64 id of each row's component values, <NA> where a component is missing like the concatenated key was NaN. """
+    index = pd.Series(components[0]).index
+    missing = np.zeros(len(index), dtype=bool)
+    for values in components:
+        missing |= pd.Series(values).isna().to_numpy()
+    frame = pd.concat([_component(values) for values in components], axis=1, ignore_index=True)
+    hashed = pd.util.hash_pandas_object(frame, index=False).to_numpy().view('int64')
+    return pd.Series(pd.arrays.IntegerArray(hashed, missing), index=index)
+
+
+def labels(name, *components):
+    """ Readable form of key `name`, NaN where a component is missing. Only the exports need it. """
+    label = None
+    for values in components:
+        values = pd.Series(values)
+        part = values.astype(object).where(values.notna(), np.nan)
+        part = part.astype(str).where(part.notna(), np.nan)
+        label = part if label is None else label + KEYS[name] + part
+    return label
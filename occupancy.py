@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+# Interval arithmetic on the 5-minute slots used by openslotsdata.py.
+# Every interval is kept as a half-open [lo, hi) range of integer slot indexes,
+# so counting, clipping, union and intersection never materialize slot rows.
+# The slots of an interval start at its own start time, not at a 5-minute mark:
+# `phase` is how far the start lies past its mark, and two slots are the same
+# slot only when both their index and their phase match, as the old exact
+# timestamp merges of the expanded slot rows required.
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+_SLOT_NS = SLOT_MINUTES * 60 * 10**9
+_DAY_NS = SLOTS_PER_DAY * _SLOT_NS
+
+
+def to_slot_ranges(start, end):
+    """ Convert start/end timestamps into [lo, hi) slot index and phase arrays.
+
+    The old `while start < end: start += 5 minutes` loops produced the slots
+    lo * 5 minutes + phase for lo <= slot < hi, phase being the nanoseconds the
+    start lies past its 5-minute mark. """
+    start = pd.to_datetime(pd.Series(start)).to_numpy('datetime64[ns]')
+    end = pd.to_datetime(pd.Series(end)).to_numpy('datetime64[ns]')
+    valid = ~(np.isnat(start) | np.isnat(end))
+    start_ns = np.where(valid, start.astype(np.int64), 0)
+    end_ns = np.where(valid, end.astype(np.int64), 0)
+    duration = np.maximum(end_ns - start_ns, 0)
+    lo = start_ns // _SLOT_NS
+    phase = start_ns - lo * _SLOT_NS
+    hi = lo + (duration + _SLOT_NS - 1) // _SLOT_NS
+    return lo, np.where(valid, hi, lo), phase
+
+
+def slot_intervals(df, keys, start_col, end_col):
+    """ Build a keys + phase/lo/hi interval frame from a frame with start and end columns. """
+    lo, hi, phase = to_slot_ranges(df[start_col], df[end_col])
+    intervals = df[keys].reset_index(drop=True)
+    intervals['phase'] = phase
+    intervals['lo'] = lo
+    intervals['hi'] = hi
+    return intervals[(intervals['hi'] > intervals['lo']) & intervals[keys].notna().all(axis=1)]
+
+
+def _key_codes(df, keys):
+    # One integer code per distinct key combination, so sorting and sweeping never touch strings
+    return df.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+
+
+def union(intervals, keys):
+    """ Merge overlapping or touching intervals per key and phase into disjoint sorted runs. """
+    if intervals.empty:
+        return intervals[keys + ['phase', 'lo', 'hi']].reset_index(drop=True)
+    codes = _key_codes(intervals, keys + ['phase'])
+    lo = intervals['lo'].to_numpy()
+    hi = intervals['hi'].to_numpy()
+    order = np.lexsort((lo, codes))
+    codes, lo, hi = codes[order], lo[order], hi[order]
+
+    # A new run starts on a new key or when the start lies beyond every end seen so far for the key
+    key_start = np.r_[True, codes[1:] != codes[:-1]]
+    running_hi = pd.Series(hi).groupby(codes).cummax().to_numpy()
+    new_run = key_start | np.r_[True, lo[1:] > running_hi[:-1]]
+
+    first = np.flatnonzero(new_run)
+    merged = intervals[keys + ['phase']].iloc[order[first]].reset_index(drop=True)
+    merged['lo'] = lo[first]
+    merged['hi'] = np.maximum.reduceat(hi, first)
+    return merged
+
+
+def intersect(a, b, keys):
+    """ Intersection of the union of `a` with the union of `b`, per key and phase.
+
+    Both sides are unioned first, so each side contributes depth 1 at most and
+    the intersection is wherever the start/end event sweep reaches depth 2. """
+    a = union(a, keys)
+    b = union(b, keys)
+    both = pd.concat([a, b], ignore_index=True)
+    if a.empty or b.empty:
+        return both.iloc[0:0].reset_index(drop=True)
+    codes = _key_codes(both, keys + ['phase'])
+    events = pd.DataFrame({
+        'code': np.concatenate([codes, codes]),
+        'pos': np.concatenate([both['lo'].to_numpy(), both['hi'].to_numpy()]),
+        'delta': np.concatenate([np.ones(len(both), dtype=np.int64), -np.ones(len(both), dtype=np.int64)]),
+    })
+    # Sum coincident events so the depth holds for the whole segment starting at `pos`
+    events = events.groupby(['code', 'pos'], sort=True)['delta'].sum().reset_index()
+    events['depth'] = events.groupby('code')['delta'].cumsum()
+    events['next_pos'] = events.groupby('code')['pos'].shift(-1)
+    hits = events[events['depth'] == 2]
+
+    key_rows = pd.Series(np.arange(len(both))).groupby(codes).first()
+    result = both[keys + ['phase']].iloc[key_rows.loc[hits['code']].to_numpy()].reset_index(drop=True)
+    result['lo'] = hits['pos'].to_numpy()
+    result['hi'] = hits['next_pos'].to_numpy().astype(np.int64)
+    return result
+
+
+def _days_touched(first_day, last_day):
+    """ Row positions repeated once per day from first_day to last_day, and the day of each repeat. """
+    n_days = last_day - first_day + 1
+    rows = np.repeat(np.arange(len(n_days)), n_days)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+    return rows, first_day[rows] + offsets
+
+
+def split_by_day(intervals, keys):
+    """ Clip intervals at midnight so every row lies within a single calendar day. """
+    # Phases are shorter than a slot, so a slot lies in the day of its grid index
+    lo = intervals['lo'].to_numpy()
+    hi = intervals['hi'].to_numpy()
+    rows, day = _days_touched(lo // SLOTS_PER_DAY, (hi - 1) // SLOTS_PER_DAY)
+
+    segments = intervals[keys + ['phase']].iloc[rows].reset_index(drop=True)
+    segments['date'] = pd.to_datetime(day * SLOTS_PER_DAY * _SLOT_NS)
+    segments['lo'] = np.maximum(lo[rows], day * SLOTS_PER_DAY)
+    segments['hi'] = np.minimum(hi[rows], (day + 1) * SLOTS_PER_DAY)
+    return segments
+
+
+def slots_per_day(intervals, keys, name='slots'):
+    """ Number of distinct slots covered per key and calendar day, over all phases. """
+    segments = split_by_day(union(intervals, keys), keys)
+    segments[name] = segments['hi'] - segments['lo']
+    return segments.groupby(keys + ['date'], as_index=False, dropna=False)[name].sum()
+
+
+def nearest_slot(a, b, keys, tolerance=1):
+    """ Per key and day, the first `a` slot within `tolerance` slots of a `b` slot, and the nearest `b` slot to it.
+
+    This is what a `merge_asof(direction='nearest')` of the `a` slots onto the `b`
+    slots followed by a groupby `first` returned when both were expanded. Both
+    slots are returned as timestamps in the `slot` and `nearest` columns. """
+    reach = tolerance * _SLOT_NS
+    segments = split_by_day(union(a, keys), keys)
+    b = union(b, keys)
+
+    # The time within reach of a `b` run, repeated for every day it touches
+    b_first = b['lo'].to_numpy() * _SLOT_NS + b['phase'].to_numpy()
+    b_last = b['hi'].to_numpy() * _SLOT_NS + b['phase'].to_numpy() - _SLOT_NS
+    rows, day = _days_touched((b_first - reach) // _DAY_NS, (b_last + reach) // _DAY_NS)
+    windows = b[keys].iloc[rows].reset_index(drop=True)
+    windows['date'] = pd.to_datetime(day * _DAY_NS)
+    windows['b_first'] = b_first[rows]
+    windows['b_last'] = b_last[rows]
+
+    # Earliest slot of each `a` segment that lies within reach of each `b` run of the same key and day
+    pairs = segments.merge(windows, on=keys + ['date'])
+    a_first = pairs['lo'].to_numpy() * _SLOT_NS + pairs['phase'].to_numpy()
+    a_last = pairs['hi'].to_numpy() * _SLOT_NS + pairs['phase'].to_numpy() - _SLOT_NS
+    steps = np.maximum(-((a_first - pairs['b_first'].to_numpy() + reach) // _SLOT_NS), 0)
+    pairs['slot'] = a_first + steps * _SLOT_NS
+    pairs = pairs[(pairs['slot'] <= a_last) & (pairs['slot'] <= pairs['b_last'] + reach)]
+    first = pairs.groupby(keys + ['date'], as_index=False, dropna=False)['slot'].min()
+
+    # Nearest `b` slot on either side of it, merge_asof prefers the earlier one on a tie
+    pairs = windows.merge(first, on=keys + ['date'])
+    slot = pairs['slot'].to_numpy()
+    b_first = pairs['b_first'].to_numpy()
+    b_last = pairs['b_last'].to_numpy()
+    in_reach = (slot >= b_first - reach) & (slot <= b_last + reach)
+    # Missing sides hold the int64 extremes, the nanoseconds do not survive a float NaN
+    none_before, none_after = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+    pairs['before'] = np.where(in_reach & (slot >= b_first), np.minimum(b_first + (slot - b_first) // _SLOT_NS * _SLOT_NS, b_last), none_before)
+    pairs['after'] = np.where(in_reach & (slot <= b_last), np.maximum(b_first - (b_first - slot) // _SLOT_NS * _SLOT_NS, b_first), none_after)
+    nearest = pairs.groupby(keys + ['date', 'slot'], as_index=False, dropna=False).agg({'before': 'max', 'after': 'min'})
+    before, after, slot = nearest['before'].to_numpy(), nearest['after'].to_numpy(), nearest['slot'].to_numpy()
+    after_closer = (before == none_before) | ((after != none_after) & (after - slot < slot - before))
+    nearest['nearest'] = pd.to_datetime(np.where(after_closer, after, before))
+    nearest['slot'] = pd.to_datetime(slot)
+    return nearest[keys + ['date', 'slot', 'nearest']]
+
+
+def split_absence_days(absences, start_col='Start', end_col='End', evening_cutoff_hour=20, max_hours=8):
+    """ Repeat every absence once per calendar day it touches, in one batch.
+
+    Adds `AbsenceDate` and `AbsenceHours`. The first day counts from the start to
+    midnight (nothing when the absence starts after the evening cutoff), the last
+    day from midnight to the end, days in between count fully, and every day is
+    capped at `max_hours`. """
+    start = pd.to_datetime(absences[start_col]).to_numpy('datetime64[ns]')
+    end = pd.to_datetime(absences[end_col]).to_numpy('datetime64[ns]')
+    first_day = start.astype('datetime64[D]')
+    last_day = end.astype('datetime64[D]')
+    valid = ~(np.isnat(start) | np.isnat(end))
+    n_days = np.where(valid, (last_day - first_day).astype(np.int64) + 1, 0).clip(min=0)
+
+    rows = np.repeat(np.arange(len(absences)), n_days)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+    day = (first_day[rows] + offsets).astype('datetime64[ns]')
+    next_day = day + np.timedelta64(1, 'D')
+    day_start = start[rows]
+    day_end = end[rows]
+    is_first = offsets == 0
+    is_last = day == last_day[rows].astype('datetime64[ns]')
+
+    hours = np.select(
+        [is_first & is_last, is_first, is_last],
+        [day_end - day_start, next_day - day_start, day_end - day],
+        default=np.timedelta64(24, 'h')
+    ) / np.timedelta64(1, 'h')
+    after_cutoff = is_first & (day_start > day + np.timedelta64(evening_cutoff_hour, 'h'))
+    hours = np.minimum(np.where(after_cutoff, 0, hours), max_hours)
+
+    expanded = absences.iloc[rows].reset_index(drop=True)
+    expanded['AbsenceDate'] = pd.to_datetime(day).date
+    expanded['AbsenceHours'] = hours
+    return expanded
@@ -0,0 +1,223 @@
+import os
+import sqlite3
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import horizon
+import snapshots
+
+# Single-file SQLite database of the outputs the dashboard reads, output/outputs.sqlite.
+# A run loads the shift slots and HCP shifts of its horizon and its HCM and clock
+# comparisons as one more snapshot, the run date YYYY-MM-DD, in one transaction. The
+# dashboard pushes its sidebar filters down as parameterized queries and gets back
+# the rows of its selection only, typed as the Parquet snapshots type them, instead
+# of a full month per session. Every table is indexed on the snapshot followed by
+# Region, Area, shop, iso_week and date: a query pins one snapshot, and the index
+# narrows it to the selection. The database is in WAL mode, so the dashboard keeps
+# reading the previous snapshot while a run writes the next one.
+# Only the latest snapshot is kept and the file is vacuumed after pruning, the dashboard
+# queries nothing older (yesterday and the month start come from the rollups). The
+# database is not committed: the dashboard builds it with `build` from the month
+# partitions and the Parquet snapshots that are, whenever a newer run wrote them.
+
+DB_PATH = os.path.join('output', 'outputs.sqlite')
+SNAPSHOT = 'snapshot'
+
+# Snapshots kept per table
+KEEP_SNAPSHOTS = 1
+
+# Excel exports whose Parquet snapshots hold the tables that have no month partitions
+EXPORTS = {
+    'hcm_sf_merged': os.path.join('output', 'hcm_sf_merged.xlsx'),
+    'clock': os.path.join('output', 'clock.xlsx'),
+}
+
+# Outputs stored, with the shop name column the Shop filter applies to and the date column of their rows
+TABLES = {
+    'shiftslots': {'shop': 'Shop[Name]', 'date': 'date'},
+    'hcpshiftslots': {'shop': 'Shop[Name]', 'date': 'ShiftDate'},
+    'hcm_sf_merged': {'shop': 'Shop Name', 'date': None},
+    'clock': {'shop': 'Shop[Name]', 'date': 'Date'},
+}
+
+# Timestamps are stored as text in this format, which sorts and compares as the dates do
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+OPERATORS = {'==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_type(field):
+    if pa.types.is_integer(field.type):
+        return 'INTEGER'
+    if pa.types.is_floating(field.type):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _index_columns(name):
+    spec = TABLES[name]
+    columns = [SNAPSHOT, 'Region', 'Area', spec['shop'], 'iso_week']
+    return columns + ([spec['date']] if spec['date'] else [])
+
+
+def connect(path=DB_PATH):
+    """ A connection to the output database at `path`, in WAL mode. """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    con = sqlite3.connect(path, timeout=60)
+    con.execute('PRAGMA journal_mode=WAL')
+    return con
+
+
+def _create(con, name):
+    # A table whose columns no longer match the snapshot schema is dropped and created again
+    columns = [SNAPSHOT] + snapshots.SCHEMAS[name].names
+    existing = [row[1] for row in con.execute(f'PRAGMA table_info({_quote(name)})')]
+    if existing and existing != columns:
+        print(f"Output database: the columns of {name} changed, dropping its snapshots")
+        con.execute(f'DROP TABLE {_quote(name)}')
+    definitions = [f'{_quote(SNAPSHOT)} TEXT NOT NULL'] + [f'{_quote(field.name)} {_sql_type(field)}' for field in snapshots.SCHEMAS[name]]
+    con.execute(f'CREATE TABLE IF NOT EXISTS {_quote(name)} ({", ".join(definitions)})')
+    con.execute(
+        f'CREATE INDEX IF NOT EXISTS {_quote(f"{name}_selection")} ON {_quote(name)} '
+        f'({", ".join(_quote(column) for column in _index_columns(name))})'
+    )
+
+
+def _rows(df, name, snapshot):
+    """ The rows of an output frame as tuples to insert, cast to its snapshot schema with the snapshot first. """
+    table = snapshots.to_table(df, name)
+    columns = [np.full(table.num_rows, snapshot, dtype=object)]
+    for field, column in zip(table.schema, table.columns):
+        values = column.to_pandas()
+        if pa.types.is_timestamp(field.type):
+            values = values.dt.strftime(TIMESTAMP_FORMAT)
+        values = values.to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        columns.append(values)
+    return zip(*(values.tolist() for values in columns))
+
+
+def write(outputs, snapshot, path=DB_PATH, keep=KEEP_SNAPSHOTS):
+    """ Store the frames of `outputs` ({name: frame}, None skipped) as snapshot `snapshot` (YYYY-MM-DD).
+
+    The rows of the same snapshot are replaced and only the `keep` latest snapshots
+    of each table are kept. All tables change in one transaction. """
+    con = connect(path)
+    deleted = 0
+    try:
+        with con:
+            for name, df in outputs.items():
+                if df is None:
+                    continue
+                _create(con, name)
+                deleted += con.execute(f'DELETE FROM {_quote(name)} WHERE {_quote(SNAPSHOT)} = ?', (snapshot,)).rowcount
+                placeholders = ', '.join('?' * (len(snapshots.SCHEMAS[name]) + 1))
+                con.executemany(f'INSERT INTO {_quote(name)} VALUES ({placeholders})', _rows(df, name, snapshot))
+                kept = [row[0] for row in con.execute(
+                    f'SELECT DISTINCT {_quote(SNAPSHOT)} FROM {_quote(name)} ORDER BY {_quote(SNAPSHOT)} DESC LIMIT ?', (keep,))]
+                # An empty frame of a table with no earlier snapshot leaves nothing to prune
+                if kept:
+                    deleted += con.execute(f'DELETE FROM {_quote(name)} WHERE {_quote(SNAPSHOT)} < ?', (kept[-1],)).rowcount
+                print(f"Output database: {len(df)} rows of {name} written as snapshot {snapshot}")
+        # Deleted rows leave free pages behind, the file only shrinks once they are vacuumed
+        if deleted:
+            con.execute('VACUUM')
+        # Statistics of the new rows for the query planner
+        con.execute('PRAGMA optimize')
+    finally:
+        con.close()
+    return path
+
+
+def build(snapshot, start_date, end_date, path=DB_PATH):
+    """ Store as snapshot `snapshot` the month partitions' rows from start_date to end_date and the HCM and clock snapshots. """
+    outputs = {name: horizon.read_months(name, start_date, end_date) for name in horizon.PARTITIONED}
+    outputs.update({name: snapshots.read_snapshot(file_path, name) for name, file_path in EXPORTS.items()})
+    return write(outputs, snapshot, path)
+
+
+def resolve(name, when, path=DB_PATH):
+    """ The latest snapshot of table `name` on or before `when` (a date or YYYY-MM-DD), None if there is none. """
+    if not os.path.exists(path):
+        return None
+    when = pd.Timestamp(when).strftime('%Y-%m-%d')
+    con = sqlite3.connect(path, timeout=60)
+    try:
+        row = con.execute(f'SELECT MAX({_quote(SNAPSHOT)}) FROM {_quote(name)} WHERE {_quote(SNAPSHOT)} <= ?', (when,)).fetchone()
+    except sqlite3.OperationalError:
+        # No such table, the runs so far did not write it
+        return None
+    finally:
+        con.close()
+    return row[0]
+
+
+def selection(name, selected_region, selected_area, selected_shop):
+    """ The (column, op, value) filters of a Region / Area / Shop selection on table `name`, 'All' leaving a filter open. """
+    chosen = [('Region', selected_region), ('Area', selected_area), (TABLES[name]['shop'], selected_shop)]
+    return [(column, '==', value) for column, value in chosen if value != 'All']
+
+
+def window(name, start_date, end_date):
+    """ The filters of the rows of table `name` dated from start_date to end_date, none for a table without dates. """
+    column = TABLES[name]['date']
+    if column is None:
+        return []
+    return [(column, '>=', start_date), (column, '<=', end_date)]
+
+
+def _value(value):
+    # Dates as they are stored, numpy scalars as Python values
+    if isinstance(value, (datetime, date)):
+        return pd.Timestamp(value).strftime(TIMESTAMP_FORMAT)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _where(filters):
+    """ The WHERE conditions and parameters of (column, op, value) filters, op one of OPERATORS, 'in' or 'not in'. """
+    conditions = []
+    params = []
+    for column, op, value in filters:
+        if op in ('in', 'not in'):
+            values = [_value(item) for item in value]
+            if not values:
+                conditions.append('0' if op == 'in' else '1')
+                continue
+            conditions.append(f'{_quote(column)} {op.upper()} ({", ".join("?" * len(values))})')
+            params.extend(values)
+        else:
+            conditions.append(f'{_quote(column)} {OPERATORS[op]} ?')
+            params.append(_value(value))
+    return conditions, params
+
+
+def read(name, snapshot, filters=(), columns=None, distinct=False, path=DB_PATH):
+    """ Rows of snapshot `snapshot` of table `name` passing `filters`, typed as its Parquet snapshot.
+
+    The filters are (column, op, value) tuples as in rollups.read. `columns` keeps those
+    columns only and `distinct` drops repeated rows. No snapshot gives no rows. """
+    schema = snapshots.SCHEMAS[name]
+    columns = list(columns) if columns is not None else schema.names
+    if snapshot is None or not os.path.exists(path):
+        df = pd.DataFrame(columns=columns)
+    else:
+        conditions, params = _where([(SNAPSHOT, '==', snapshot)] + list(filters))
+        sql = (f'SELECT {"DISTINCT " if distinct else ""}{", ".join(_quote(column) for column in columns)} '
+               f'FROM {_quote(name)} WHERE {" AND ".join(conditions)}')
+        con = sqlite3.connect(path, timeout=60)
+        try:
+            df = pd.read_sql_query(sql, con, params=params)
+        finally:
+            con.close()
+        # Parsed with their one format, much faster than letting to_table guess it
+        for field in schema:
+            if pa.types.is_timestamp(field.type) and field.name in df.columns:
+                df[field.name] = pd.to_datetime(df[field.name], format=TIMESTAMP_FORMAT)
+    return snapshots.to_table(df, name).select(columns).to_pandas()
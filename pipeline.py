@@ -0,0 +1,270 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+import pandas as pd
+import datacache
+import profiling
+import runreport
+import tracing
+
+# Minimal stage runner for openslotsdata.py. Every stage declares the artifacts it
+# reads and writes, the source files and run parameters it depends on, and the code
+# modules it calls. A stage's key hashes all of these (the keys of its input artifacts
+# stand in for their content), and its outputs are stored under that key, so a run
+# skips every stage whose key is unchanged and a failed run resumes at the failed stage.
+# Stages that do not depend on each other can run at the same time in worker processes.
+
+CACHE_DIR = os.path.join(datacache.CACHE_DIR, 'stages')
+
+# Module files in a stage's `code` are named relative to this folder, so a run from
+# another working directory (see benchmarks.py) hashes the same files
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """ A named step of the pipeline.
+
+    func receives the input artifacts and the requested run parameters as keyword
+    arguments and returns a dict with one entry per output artifact. `files` is a
+    list of paths, or a callable returning one, whose content is part of the key.
+    `params` are part of the key, `options` are passed through but do not change
+    the result. `code` lists the helper functions and module files besides func
+    whose changes invalidate the cache, and `targets` the files the stage writes,
+    which must still exist for the stage to be skipped. """
+
+    def __init__(self, name, func, inputs=(), outputs=(), files=(), params=(), options=(), code=(), targets=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.files = files
+        self.params = list(params)
+        self.options = list(options)
+        self.code = list(code)
+        self.targets = targets
+
+    def resolve(self, spec, run_params):
+        return list(spec(run_params) if callable(spec) else spec)
+
+
+def _code_hash(code):
+    # Functions are hashed by their source, anything else is a module file
+    if callable(code):
+        return hashlib.sha256(inspect.getsource(code).encode('utf-8')).hexdigest()
+    with open(os.path.join(MODULE_DIR, code), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def stage_key(stage, artifact_keys, run_params):
+    """ Hash of everything a stage's result depends on. """
+    parts = {
+        'stage': stage.name,
+        'code': [_code_hash(code) for code in [stage.func] + stage.code],
+        'inputs': {name: artifact_keys[name] for name in stage.inputs},
+        'files': {path: datacache.content_hash(path) for path in stage.resolve(stage.files, run_params)},
+        'params': {name: run_params[name] for name in stage.params},
+        'targets': stage.resolve(stage.targets, run_params),
+    }
+    encoded = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:20]
+
+
+def _stage_dir(cache_dir, stage, key):
+    return os.path.join(cache_dir, stage.name, key)
+
+
+def _is_complete(stage_dir, stage, run_params):
+    if not os.path.exists(os.path.join(stage_dir, 'done.json')):
+        return False
+    return all(os.path.exists(target) for target in stage.resolve(stage.targets, run_params))
+
+
+def _save_outputs(cache_dir, stage, key, outputs):
+    stage_dir = _stage_dir(cache_dir, stage, key)
+    os.makedirs(stage_dir, exist_ok=True)
+    for name in stage.outputs:
+        pd.to_pickle(outputs[name], os.path.join(stage_dir, f'{name}.pkl'))
+    with open(os.path.join(stage_dir, 'done.json'), 'w') as f:
+        json.dump({'stage': stage.name, 'key': key, 'outputs': stage.outputs}, f, indent=2)
+    # Only the latest result of a stage is kept
+    for other in os.listdir(os.path.join(cache_dir, stage.name)):
+        if other != key:
+            shutil.rmtree(os.path.join(cache_dir, stage.name, other), ignore_errors=True)
+
+
+def _artifact_path(cache_dir, stage, key, name):
+    return os.path.join(_stage_dir(cache_dir, stage, key), f'{name}.pkl')
+
+
+def upstream(stages, names):
+    """ The stages, in run order, that the artifacts `names` are computed by, directly or through their inputs. """
+    producers = {name: stage for stage in stages for name in stage.outputs}
+    needed = set()
+    wanted = list(names)
+    while wanted:
+        stage = producers[wanted.pop()]
+        if stage.name not in needed:
+            needed.add(stage.name)
+            wanted.extend(stage.inputs)
+    return [stage for stage in stages if stage.name in needed]
+
+
+def load_artifacts(stages, artifact_keys, names, cache_dir=CACHE_DIR):
+    """ The artifacts `names` of a finished run, read from the stage cache. artifact_keys is what `run` returned. """
+    producers = {name: stage for stage in stages for name in stage.outputs}
+    return {name: pd.read_pickle(_artifact_path(cache_dir, producers[name], artifact_keys[name], name)) for name in names}
+
+
+def _call(stage, kwargs, profile_dir):
+    if profile_dir is not None:
+        return profiling.call(stage.name, stage.func, kwargs, profile_dir) or {}
+    return stage.func(**kwargs) or {}
+
+
+def _run_in_worker(stage, key, input_paths, kwargs, cache_dir, profile_dir, trace_config):
+    # Inputs are read from and outputs written to the stage cache, nothing large goes through the pool
+    tracing.configure(**trace_config)
+    kwargs = dict(kwargs, **{name: pd.read_pickle(path) for name, path in input_paths.items()})
+    started = runreport.start_stage()
+    outputs = _call(stage, kwargs, profile_dir)
+    record = runreport.finish_stage(stage.name, started, kwargs, outputs)
+    _save_outputs(cache_dir, stage, key, outputs)
+    return record
+
+
+def _failure(stage, error):
+    print(f"Stage {stage.name} failed, the next run resumes from here")
+    return ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+
+def _raise_failures(failures, skipped):
+    if not failures:
+        return
+    for name, message in failures.items():
+        print(f"----- Stage {name} -----")
+        print(message)
+    if skipped:
+        print(f"Not run because an input stage failed: {', '.join(skipped)}")
+    raise RuntimeError(f"{len(failures)} stage(s) failed: {', '.join(failures)}")
+
+
+def run(stages, run_params, cache_dir=CACHE_DIR, use_cache=True, workers=1, report_path=None, profile=(), profile_dir=None):
+    """ Run the stages, skipping those whose cached result is still valid. Returns the artifact keys.
+
+    With workers > 1 every stage whose inputs are ready runs in a worker process, so
+    independent branches overlap. A failed stage only stops the stages downstream of
+    it, the others still run and all failures are reported at the end. The telemetry
+    of every stage is appended to the run report at report_path, if given, and the
+    stages named in `profile` are profiled into profile_dir (see profiling.py). """
+    run_started = time.perf_counter()
+    report = runreport.new_run(run_params, workers, profile)
+    records = {}
+    producers = {}
+    for stage in stages:
+        for name in stage.outputs:
+            producers[name] = stage
+
+    # Keys only depend on upstream keys, so they are all known before anything runs
+    artifact_keys = {}
+    keys = {}
+    pending = []
+    for stage in stages:
+        key = stage_key(stage, artifact_keys, run_params)
+        keys[stage.name] = key
+        for name in stage.outputs:
+            artifact_keys[name] = key
+        # Profiled and traced stages always run, a cached result leaves nothing to profile or trace
+        if use_cache and stage.name not in profile and not tracing.enabled() and _is_complete(_stage_dir(cache_dir, stage, key), stage, run_params):
+            print(f"Stage {stage.name}: unchanged, using cached result")
+            records[stage.name] = runreport.cached_stage(stage.name)
+        else:
+            pending.append(stage)
+
+    waiting_on = {stage.name: {producers[name].name for name in stage.inputs} & {other.name for other in pending} for stage in pending}
+    failures = {}
+    skipped = []
+
+    def blocked(stage):
+        # Stages downstream of a failed or skipped stage are not run
+        return any(name in failures or name in skipped for name in waiting_on[stage.name])
+
+    def options(stage):
+        return {name: run_params[name] for name in stage.params + stage.options}
+
+    def stage_profile_dir(stage):
+        return profile_dir if stage.name in profile else None
+
+    if workers <= 1:
+        artifacts = {}
+
+        def artifact(name):
+            # Cached artifacts are only read when a stage that needs them actually runs
+            if name not in artifacts:
+                artifacts[name] = pd.read_pickle(_artifact_path(cache_dir, producers[name], artifact_keys[name], name))
+            return artifacts[name]
+
+        for stage in pending:
+            if blocked(stage):
+                skipped.append(stage.name)
+                continue
+            print(f"Stage {stage.name}: running")
+            kwargs = {name: artifact(name) for name in stage.inputs}
+            kwargs.update(options(stage))
+            started = runreport.start_stage()
+            try:
+                outputs = _call(stage, kwargs, stage_profile_dir(stage))
+            except Exception as error:
+                failures[stage.name] = _failure(stage, error)
+                records[stage.name] = runreport.failed_stage(stage.name, error)
+                continue
+            records[stage.name] = runreport.finish_stage(stage.name, started, kwargs, outputs)
+            for name in stage.outputs:
+                artifacts[name] = outputs[name]
+            _save_outputs(cache_dir, stage, keys[stage.name], outputs)
+    else:
+        # Forked workers start without re-importing the caller, elsewhere the platform default is used
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        running = {}
+        finished = set()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as pool:
+            while pending or running:
+                for stage in list(pending):
+                    if blocked(stage):
+                        pending.remove(stage)
+                        skipped.append(stage.name)
+                    elif waiting_on[stage.name] <= finished:
+                        pending.remove(stage)
+                        print(f"Stage {stage.name}: running")
+                        input_paths = {name: _artifact_path(cache_dir, producers[name], artifact_keys[name], name) for name in stage.inputs}
+                        future = pool.submit(
+                            _run_in_worker, stage, keys[stage.name], input_paths, options(stage), cache_dir,
+                            stage_profile_dir(stage), tracing.config()
+                        )
+                        running[future] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        records[stage.name] = future.result()
+                    except Exception as error:
+                        failures[stage.name] = _failure(stage, error)
+                        records[stage.name] = runreport.failed_stage(stage.name, error)
+                        continue
+                    print(f"Stage {stage.name}: done")
+                    finished.add(stage.name)
+
+    if report_path is not None:
+        for name in skipped:
+            records[name] = runreport.skipped_stage(name)
+        report['stages'] = [records[stage.name] for stage in stages if stage.name in records]
+        runreport.write_report(report_path, runreport.close_run(report, run_started))
+    _raise_failures(failures, skipped)
+    return artifact_keys
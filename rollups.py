@@ -0,0 +1,151 @@
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rollups of the shiftslots rows for the dashboard. A run stores the sums of the
+# measures per Region, Area and Shop and per ISO week, date and month, as
+# output/rollups/<level>_<grain>/snapshot=YYYY-MM-DD/part-0.parquet. The snapshot is
+# the run date, as in the shiftslots history. The dashboard reads the few rows of
+# its selection instead of summing the month's rows on every rerun. Sums can be
+# added up, so a coarser selection is the sum of the rows of a finer one. Weeks are
+# split at month ends: the week rows of a calendar month give the Overview's weeks,
+# and summed over months they give whole weeks.
+
+ROLLUPS_FOLDER = os.path.join('output', 'rollups')
+
+# Additive measures. SaturatedHours / TotalHours is the saturation of the rows summed,
+# SaturationPercentageSum / SaturationPercentageCount the mean of their SaturationPercentage
+MEASURES = [
+    'TotalHours', 'BlockedHours', 'BookedHours', 'OpenHours',
+    'SaturatedHours', 'SaturationPercentageSum', 'SaturationPercentageCount',
+]
+
+LEVELS = {
+    'region': ['Region'],
+    'area': ['Region', 'Area'],
+    'shop': ['Region', 'Area', 'GT_ShopCode__c', 'Shop[Name]'],
+}
+
+GRAINS = {
+    'week': ['month', 'iso_year', 'iso_week'],
+    'date': ['month', 'iso_year', 'iso_week', 'date'],
+    'month': ['month'],
+}
+
+TABLES = [f'{level}_{grain}' for level in LEVELS for grain in GRAINS]
+
+# Only the latest snapshot keeps these, the comparisons with earlier runs use weeks and months
+LATEST_ONLY_GRAINS = ['date']
+
+
+def level_of(selected_region, selected_area, selected_shop):
+    """ The coarsest level holding a Region / Area / Shop[Name] selection, 'All' leaving a filter open. """
+    if selected_shop != 'All':
+        return 'shop'
+    if selected_area != 'All':
+        return 'area'
+    return 'region'
+
+
+def selection(selected_region, selected_area, selected_shop):
+    """ The (column, op, value) filters of a Region / Area / Shop[Name] selection. """
+    chosen = [('Region', selected_region), ('Area', selected_area), ('Shop[Name]', selected_shop)]
+    return [(column, '==', value) for column, value in chosen if value != 'All']
+
+
+def build(shift_slots, tables=TABLES):
+    """ The rollups `tables` of some shiftslots rows, as {name: frame}. """
+    dates = pd.to_datetime(shift_slots['date'])
+    iso = dates.dt.isocalendar()
+    rows = pd.DataFrame({
+        'Region': shift_slots['Region'],
+        'Area': shift_slots['Area'],
+        'GT_ShopCode__c': shift_slots['GT_ShopCode__c'],
+        'Shop[Name]': shift_slots['Shop[Name]'],
+        'month': dates.dt.strftime('%Y-%m'),
+        'iso_year': iso['year'].astype('Int64'),
+        'iso_week': iso['week'].astype('Int64'),
+        'date': dates,
+        'TotalHours': shift_slots['TotalHours'],
+        'BlockedHours': shift_slots['BlockedHours'],
+        'BookedHours': shift_slots['BookedHours'],
+        'OpenHours': shift_slots['OpenHours'],
+        # Missing blocked or booked hours count as none, like in their separate sums
+        'SaturatedHours': shift_slots['BlockedHours'].add(shift_slots['BookedHours'], fill_value=0),
+        'SaturationPercentageSum': shift_slots['SaturationPercentage'],
+        'SaturationPercentageCount': shift_slots['SaturationPercentage'].notna().astype('int64'),
+    })
+    cubes = {}
+    for table in tables:
+        level, grain = table.split('_')
+        keys = LEVELS[level] + GRAINS[grain]
+        # Rows without a region or date stay in the totals, as they do in the row sums
+        cube = rows.groupby(keys, dropna=False, as_index=False)[MEASURES].sum()
+        cubes[table] = cube.sort_values(keys).reset_index(drop=True)
+    return cubes
+
+
+def _partition_path(folder, table, snapshot):
+    return os.path.join(folder, table, f'snapshot={snapshot}', 'part-0.parquet')
+
+
+def snapshot_ids(table, folder=ROLLUPS_FOLDER):
+    """ The snapshots of rollup `table`, oldest first. """
+    table_folder = os.path.join(folder, table)
+    if not os.path.isdir(table_folder):
+        return []
+    return sorted(
+        name.split('=', 1)[1] for name in os.listdir(table_folder)
+        if name.startswith('snapshot=') and os.path.exists(os.path.join(table_folder, name, 'part-0.parquet'))
+    )
+
+
+def resolve(table, when, folder=ROLLUPS_FOLDER):
+    """ The latest snapshot of rollup `table` on or before `when` (a date or YYYY-MM-DD), None if there is none. """
+    when = pd.Timestamp(when).strftime('%Y-%m-%d')
+    earlier = [snapshot for snapshot in snapshot_ids(table, folder) if snapshot <= when]
+    return earlier[-1] if earlier else None
+
+
+def write(shift_slots, snapshot, keep=None, folder=ROLLUPS_FOLDER):
+    """ Store the rollups of the shiftslots rows `shift_slots` as snapshot `snapshot` (YYYY-MM-DD), then prune (see prune). """
+    cubes = build(shift_slots)
+    for table, cube in cubes.items():
+        partition_path = _partition_path(folder, table, snapshot)
+        os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(cube, preserve_index=False), partition_path + '.tmp')
+        os.replace(partition_path + '.tmp', partition_path)
+    prune(keep, folder)
+    print(f"Rollups: snapshot {snapshot} written, {sum(len(cube) for cube in cubes.values())} rows in {len(cubes)} tables")
+
+
+def prune(keep=None, folder=ROLLUPS_FOLDER):
+    """ Drop the snapshots not in `keep` (all kept when None) and the date rollups of all but the latest snapshot. """
+    for table in TABLES:
+        ids = snapshot_ids(table, folder)
+        for snapshot in ids:
+            dropped = keep is not None and snapshot not in keep
+            if table.split('_')[1] in LATEST_ONLY_GRAINS and snapshot != ids[-1]:
+                dropped = True
+            if dropped:
+                shutil.rmtree(os.path.dirname(_partition_path(folder, table, snapshot)))
+
+
+def select(cube, filters=()):
+    """ Rows of a rollup passing the (column, op, value) filters, as `read` applies them. """
+    if not filters:
+        return cube
+    table = pa.Table.from_pandas(cube, preserve_index=False)
+    return table.filter(pq.filters_to_expression(list(filters))).to_pandas()
+
+
+def read(table, when, filters=(), folder=ROLLUPS_FOLDER):
+    """ Rows of rollup `table` passing `filters`, as the latest snapshot on or before `when` had them. None without such a snapshot.
+
+    The filters are (column, op, value) tuples and are pushed down into the Parquet read. """
+    snapshot = resolve(table, when, folder)
+    if snapshot is None:
+        return None
+    return pq.read_table(_partition_path(folder, table, snapshot), filters=list(filters) or None).to_pandas()
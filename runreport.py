@@ -0,0 +1,192 @@
+from datetime import datetime
+import json
+import os
+import time
+import tracemalloc
+import pandas as pd
+import tracing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-stage telemetry of a pipeline run: wall time, memory and row counts, written to
+# a JSON report that keeps the previous runs so a slower stage can be traced back to
+# the run where it started.
+
+HISTORY_LENGTH = 50
+
+# A stage taking this many times longer than in the previous run is reported as slower
+_SLOWER_FACTOR = 1.5
+
+
+# Entries the running stage adds to its own record, see add_details
+_details = {}
+
+
+def _rss_mb():
+    # Current resident set size, from /proc where there is one
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _reset_peak_rss():
+    # Linux resets the peak resident set size (VmHWM) when 5 is written to clear_refs, True if it did
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    # Peak resident set size since the last reset, from /proc where there is one
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError):
+        pass
+    # Elsewhere the peak of the process so far, ru_maxrss is in kilobytes on Linux
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+def _megabytes(value):
+    if isinstance(value, pd.DataFrame):
+        return round(value.memory_usage(deep=True).sum() / 2**20, 2)
+    if isinstance(value, pd.Series):
+        return round(value.memory_usage(deep=True) / 2**20, 2)
+    return None
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def start_stage():
+    """ Take the measurements a stage's record is based on, call right before the stage runs. """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    peak_reset = _reset_peak_rss()
+    # Probes and details of an earlier stage that failed are not this stage's
+    tracing.collect()
+    _details.clear()
+    return {'clock': time.perf_counter(), 'rss_mb': _rss_mb(), 'peak_reset': peak_reset}
+
+
+def finish_stage(name, started, inputs, outputs):
+    """ Telemetry record of a stage that ran successfully. """
+    rss_mb = _rss_mb()
+    record = {
+        'stage': name,
+        'status': 'ok',
+        'seconds': round(time.perf_counter() - started['clock'], 3),
+        'rss_mb_before': _round(started['rss_mb']),
+        'rss_mb_after': _round(rss_mb),
+        'rss_mb_change': None if rss_mb is None or started['rss_mb'] is None else _round(rss_mb - started['rss_mb']),
+        # Peak of the stage itself where the peak could be reset when it started, of the process so far otherwise
+        'peak_rss_mb': _round(_peak_rss_mb()),
+        'peak_rss_scope': 'stage' if started['peak_reset'] else 'process',
+        'input_rows': {name: _rows(value) for name, value in inputs.items() if _rows(value) is not None},
+        'output_rows': {name: _rows(value) for name, value in outputs.items() if _rows(value) is not None},
+        # Memory held by each output frame, strings included
+        'output_mb': {name: _megabytes(value) for name, value in outputs.items() if _megabytes(value) is not None},
+        'pid': os.getpid(),
+    }
+    # Python allocation peak of the stage itself, only when tracemalloc is on (PYTHONTRACEMALLOC=1 or --profile)
+    if tracemalloc.is_tracing():
+        record['tracemalloc_peak_mb'] = _round(tracemalloc.get_traced_memory()[1] / 2**20)
+    if _details:
+        record['details'] = dict(_details)
+        _details.clear()
+    trace = tracing.collect()
+    if trace:
+        record['trace'] = trace
+    return record
+
+
+def add_details(**details):
+    """ Add entries to the record of the running stage, e.g. which of its source files came from a cache. """
+    _details.update(details)
+
+
+def cached_stage(name):
+    return {'stage': name, 'status': 'cached'}
+
+
+def failed_stage(name, error):
+    return {'stage': name, 'status': 'failed', 'error': f"{type(error).__name__}: {error}"}
+
+
+def skipped_stage(name):
+    return {'stage': name, 'status': 'skipped'}
+
+
+def _slower_stages(run, previous):
+    previous_seconds = {record['stage']: record['seconds'] for record in previous['stages'] if record['status'] == 'ok'}
+    return [
+        (record['stage'], previous_seconds[record['stage']], record['seconds'])
+        for record in run['stages']
+        if record['status'] == 'ok' and record['stage'] in previous_seconds
+        and record['seconds'] > _SLOWER_FACTOR * previous_seconds[record['stage']] and record['seconds'] > 1
+    ]
+
+
+def write_report(path, run):
+    """ Append a run to the report at `path`, keeping the last HISTORY_LENGTH runs. """
+    runs = []
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                runs = json.load(f)['runs']
+        except (ValueError, KeyError):
+            print(f"Run report {path} could not be read, starting a new history")
+
+    # Compare with the last run that actually ran stages, profiled runs are slower by design
+    previous = next((
+        other for other in reversed(runs)
+        if not other.get('profiled') and any(record['status'] == 'ok' for record in other['stages'])
+    ), None)
+    if previous is not None and not run.get('profiled'):
+        for stage, before, after in _slower_stages(run, previous):
+            print(f"Stage {stage} took {after:.1f}s, {before:.1f}s in the run of {previous['started_at']}")
+
+    runs = (runs + [run])[-HISTORY_LENGTH:]
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'runs': runs}, f, indent=2, default=str)
+    print(f"Run report written to {path}")
+
+
+def new_run(run_params, workers, profiled=()):
+    """ Header of a run record, the stages are appended as they finish. """
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {name: str(value) for name, value in run_params.items()},
+        'workers': workers,
+        'profiled': list(profiled),
+        'traced': tracing.config(),
+        'stages': [],
+    }
+
+
+def close_run(run, started):
+    run['seconds'] = round(time.perf_counter() - started, 3)
+    run['status'] = 'failed' if any(record['status'] == 'failed' for record in run['stages']) else 'ok'
+    return run
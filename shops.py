@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Shop dimension, built once per run from the region mapping. Every shop not flagged
+# SYM = N gets an integer shop_id (1, 2, ... in the order of the mapping, 0 is no
+# shop) next to its code, name, normalized name, Region, Area and SYM flag. Stages
+# turn their shop codes or shop names into ids with one hash lookup per distinct
+# value, then take the columns they need from the dimension by id, instead of
+# merging the mapping into every wide frame. Names are matched through the alias
+# table: the normalized name of every shop, plus the variants listed in
+# datasets/shop_aliases.csv (ALIAS, CODE) for names the normalization cannot tell apart.
+
+SHOP_ID = 'shop_id'
+NO_SHOP = 0
+
+ALIASES_FILE = os.path.join('datasets', 'shop_aliases.csv')
+
+# Characters written in several ways in the exports, as one of them
+CHARACTER_VARIANTS = {
+    '’': "'",  # right single quotation mark, "L’HOSPITALET"
+    '‘': "'",
+    '´': "'",
+    '`': "'",
+    '–': '-',  # en dash, "ES - SHOP – L’ ELIANA"
+    '—': '-',
+}
+
+
+def normalize_names(names):
+    """ Shop names as compared: variant quotes and dashes as ' and -, single spaces, upper case. """
+    names = pd.Series(names, dtype=object).astype('string')
+    for variant, character in CHARACTER_VARIANTS.items():
+        names = names.str.replace(variant, character, regex=False)
+    return names.str.replace(r'\s+', ' ', regex=True).str.strip().str.upper().astype(object)
+
+
+def build(region_mapping, aliases=None):
+    """ The shop dimension and the alias table of a region mapping, as two frames.
+
+    `aliases` holds extra (ALIAS, CODE) name variants. A name shared by several shops
+    is kept for the first one flagged SYM = Y, or the first one if none is. """
+    mapping = region_mapping[region_mapping['SYM'] != 'N']
+    dimension = pd.DataFrame({
+        SHOP_ID: np.arange(1, len(mapping) + 1, dtype='int32'),
+        'CODE': mapping['CODE'].to_numpy(dtype=object),
+        'DESCR': mapping['DESCR'].to_numpy(dtype=object),
+        'name': normalize_names(mapping['DESCR']).to_numpy(dtype=object),
+        'REGION': mapping['REGION'].to_numpy(dtype=object),
+        'AREA': mapping['AREA'].to_numpy(dtype=object),
+        'SYM': (mapping['SYM'] == 'Y').to_numpy(),
+    })
+    duplicated = dimension.loc[dimension['CODE'].duplicated(), 'CODE'].unique().tolist()
+    if duplicated:
+        print(f"Shop codes listed more than once in the region mapping, the first row is used: {duplicated}")
+        dimension = dimension.drop_duplicates('CODE').reset_index(drop=True)
+        dimension[SHOP_ID] = np.arange(1, len(dimension) + 1, dtype='int32')
+
+    alias_table = dimension[['name', SHOP_ID, 'SYM']].rename(columns={'name': 'alias'})
+    if aliases is not None and len(aliases):
+        extra = pd.DataFrame({'alias': normalize_names(aliases['ALIAS']).to_numpy(dtype=object),
+                              SHOP_ID: ids(dimension, aliases['CODE'])})
+        unknown = aliases.loc[extra[SHOP_ID].to_numpy() == NO_SHOP, 'CODE'].tolist()
+        if unknown:
+            print(f"Shop aliases of codes not in the region mapping are left out: {unknown}")
+        extra = extra[extra[SHOP_ID] != NO_SHOP]
+        extra = extra.assign(SYM=column(dimension, extra[SHOP_ID], 'SYM'))
+        alias_table = pd.concat([alias_table, extra], ignore_index=True)
+    alias_table = alias_table.dropna(subset=['alias'])
+    shared = alias_table.loc[alias_table.duplicated('alias', keep=False), 'alias'].unique().tolist()
+    if shared:
+        print(f"Shop names shared by several shops, matched to the first one flagged SYM = Y: {shared}")
+    alias_table = (alias_table.sort_values('SYM', ascending=False, kind='stable')
+                   .drop_duplicates('alias')[['alias', SHOP_ID]]
+                   .sort_values(SHOP_ID, kind='stable').reset_index(drop=True))
+    return dimension, alias_table
+
+
+def _positions(index, values, normalize=None):
+    # Position of each value in the index, -1 for missing values and values not in it, one lookup per distinct value
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    if normalize is not None:
+        uniques = normalize(uniques)
+    return np.append(index.get_indexer(uniques), -1)[codes]
+
+
+def ids(dimension, codes):
+    """ The shop_id of each shop code, NO_SHOP for codes not in the dimension. """
+    # Ids are the positions in the dimension plus one
+    return (_positions(pd.Index(dimension['CODE']), codes) + 1).astype('int32')
+
+
+def name_ids(alias_table, names):
+    """ The shop_id of each shop name through the alias table, NO_SHOP for names of no shop. """
+    positions = _positions(pd.Index(alias_table['alias']), names, normalize_names)
+    return np.append(alias_table[SHOP_ID].to_numpy(), NO_SHOP)[positions].astype('int32')
+
+
+def column(dimension, shop_ids, name):
+    """ Column `name` of the dimension for each shop id, missing (False for SYM) for NO_SHOP. """
+    values = dimension[name].to_numpy()
+    if values.dtype == bool:
+        values = np.append(False, values)
+    else:
+        values = np.append(np.array([np.nan], dtype=object), values.astype(object))
+    return values[np.asarray(shop_ids)]
+
+
+def attach(df, dimension, shop_ids, columns):
+    """ df with the dimension's `columns` ({dimension column: df column}) of `shop_ids` added at the end. """
+    return df.assign(**{target: column(dimension, shop_ids, source) for source, target in columns.items()})
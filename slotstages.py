@@ -0,0 +1,174 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import multiprocessing
+import numpy as np
+import pandas as pd
+import keys
+import occupancy
+
+# Per resource-day slot stages of openslotsdata.py. Every output row belongs to a
+# single resource and date, so the stages can run on any subset of resource-days.
+
+RESOURCE_KEYS = ['GT_ShopCode__c', 'PersonalidId']
+
+# Shop code column of each stage input, used to split the work by shop
+SHOP_COLUMNS = {
+    'shifts': 'GT_ShopCode__c',
+    'absences': 'Resource.RelatedRecord.GT_StoreCode__c',
+    'appointments': 'Service Appointment[GT_ShopCode__c]',
+}
+
+ABSENCE_SLOT_COLUMNS = [
+    'GT_ShopCode__c', 'AbsenceSlotDate', 'PersonalNumberId', 'AbsenceSlots', 'AbsenceNumber',
+    'Resource.GT_PersonalNumber__c', 'Type', 'Resource.Name', 'Service Resource[Id]', 'PersonalidId', 'ShiftSlot'
+]
+
+
+def prepare_absence_days(absences_grouped):
+    """ Add the per-day absence window and the shop/resource keys to the grouped absences. """
+    absence_days = absences_grouped.copy()
+    # Each absence day covers the absence's start to end time of day on that date
+    absence_day = pd.to_datetime(absence_days['AbsenceDate'])
+    absence_days['AbsenceSlotStart'] = (absence_day + (absence_days['AbsenceStartTime'] - absence_days['AbsenceStartTime'].dt.normalize())).fillna(absence_day)
+    absence_days['AbsenceSlotEnd'] = (absence_day + (absence_days['AbsenceEndTime'] - absence_days['AbsenceEndTime'].dt.normalize())).fillna(absence_day + timedelta(hours=8))
+    absence_days['GT_ShopCode__c'] = absence_days['Resource.RelatedRecord.GT_StoreCode__c']
+    absence_days['PersonalidId'] = keys.ids(absence_days['GT_ShopCode__c'], absence_days['Service Resource[Id]'])
+    return absence_days
+
+
+def absence_slots_per_day(shifts_grouped, absence_days):
+    """ Unique absence slots per resource and date, with the descriptive columns of the day's first absence. """
+    absence_intervals = occupancy.slot_intervals(absence_days, ['GT_ShopCode__c', 'PersonalNumberId'], 'AbsenceSlotStart', 'AbsenceSlotEnd')
+
+    # Overlapping absences are counted once
+    absence_slots = occupancy.slots_per_day(absence_intervals, ['GT_ShopCode__c', 'PersonalNumberId'], name='AbsenceSlots')
+    absence_slots['AbsenceSlotDate'] = absence_slots.pop('date').dt.date
+
+    # Descriptive columns come from the earliest absence of the resource-day
+    absence_firsts = absence_days[absence_days['AbsenceSlotEnd'] > absence_days['AbsenceSlotStart']]
+    absence_firsts = absence_firsts.sort_values('AbsenceSlotStart', kind='stable').groupby(
+        ['GT_ShopCode__c', 'AbsenceDate', 'PersonalNumberId']
+    ).agg({
+        'AbsenceNumber': 'first',
+        'Resource.GT_PersonalNumber__c': 'first',
+        'Type': 'first',
+        'Resource.Name': 'first',
+        'Service Resource[Id]': 'first',
+        'PersonalidId': 'first',
+    }).reset_index().rename(columns={'AbsenceDate': 'AbsenceSlotDate'})
+
+    # ShiftSlot is the shift slot nearest (within 5 minutes) to the first absence slot of the day
+    nearest_shift_slots = occupancy.nearest_slot(
+        occupancy.slot_intervals(absence_days, ['PersonalNumberId'], 'AbsenceSlotStart', 'AbsenceSlotEnd'),
+        occupancy.slot_intervals(shifts_grouped, ['PersonalNumberId'], 'StartTime', 'EndTime'),
+        ['PersonalNumberId']
+    )
+    nearest_shift_slots['AbsenceSlotDate'] = nearest_shift_slots['date'].dt.date
+    nearest_shift_slots['ShiftSlot'] = nearest_shift_slots['nearest']
+
+    absence_slots = absence_slots.merge(absence_firsts, on=['GT_ShopCode__c', 'AbsenceSlotDate', 'PersonalNumberId'], how='left')
+    absence_slots = absence_slots.merge(nearest_shift_slots[['PersonalNumberId', 'AbsenceSlotDate', 'ShiftSlot']], on=['PersonalNumberId', 'AbsenceSlotDate'], how='left')
+    return absence_slots[ABSENCE_SLOT_COLUMNS]
+
+
+def adjust_shift_hours(shifts_grouped, absence_slots):
+    """ Merge absence slots into the grouped shifts and derive the absence-adjusted shift hours. """
+    sfshifts_merged = pd.merge(
+        shifts_grouped,
+        absence_slots,
+        how='left',
+        left_on=['PersonalNumberId', 'ShiftDate'],
+        right_on=['PersonalNumberId', 'AbsenceSlotDate'],
+        suffixes=('', '_absence')
+    )
+    sfshifts_merged['AbsenceSlots'] = sfshifts_merged['AbsenceSlots'].fillna(0)
+    # Absence hours never exceed the shift hours of the day
+    sfshifts_merged['AbsenceDurationHours'] = np.minimum(sfshifts_merged['AbsenceSlots'] * 5 / 60, sfshifts_merged['ShiftDurationHours'])
+    sfshifts_merged['ShiftDurationHoursAdjusted'] = (sfshifts_merged['ShiftDurationHours'] - sfshifts_merged['AbsenceDurationHours'].fillna(0)).clip(lower=0)
+    sfshifts_merged['ShiftDurationMinutesAdjusted'] = sfshifts_merged['ShiftDurationHoursAdjusted'] * 60
+    sfshifts_merged['ShiftDate'] = pd.to_datetime(sfshifts_merged['ShiftDate'])
+    return sfshifts_merged
+
+
+def booked_and_overlapping_slots(shifts_grouped, absence_days, appointments_filtered):
+    """ Booked slots and booked slots overlapping an absence, per resource and date. """
+    # Shift coverage per resource-day runs from the first shift start to the last shift end
+    shift_intervals = occupancy.slot_intervals(
+        shifts_grouped.rename(columns={'ShopResourceId': 'PersonalidId'}),
+        RESOURCE_KEYS, 'StartTime', 'EndTime'
+    )
+    # Booked time is appointment time that falls within the resource's shift coverage
+    appointments = appointments_filtered.assign(GT_ShopCode__c=appointments_filtered['Service Appointment[GT_ShopCode__c]'])
+    appointments['PersonalidId'] = keys.ids(appointments['GT_ShopCode__c'], appointments['Service Appointment[GT_ServiceResource__c]'])
+    appointment_intervals = occupancy.slot_intervals(appointments, RESOURCE_KEYS, 'ApptStartTime', 'ApptEndTime')
+    booked_intervals = occupancy.intersect(appointment_intervals, shift_intervals, RESOURCE_KEYS)
+
+    # Overlapping absence time is booked time that is also blocked by an absence of the same resource
+    absence_intervals = occupancy.slot_intervals(absence_days, RESOURCE_KEYS, 'AbsenceSlotStart', 'AbsenceSlotEnd')
+    overlapping_intervals = occupancy.intersect(absence_intervals, booked_intervals, RESOURCE_KEYS)
+
+    booked_slots = occupancy.slots_per_day(booked_intervals, RESOURCE_KEYS, name='Count')
+    overlapping_slots = occupancy.slots_per_day(overlapping_intervals, RESOURCE_KEYS, name='TotalOverlappingAbsenceSlots')
+    return booked_slots, overlapping_slots
+
+
+def resource_day_slots(shifts_grouped, absences_grouped, appointments_filtered):
+    """ Run every per resource-day slot stage. Returns sfshifts_merged, booked slots and overlapping absence slots. """
+    absence_days = prepare_absence_days(absences_grouped)
+    absence_slots = absence_slots_per_day(shifts_grouped, absence_days)
+    sfshifts_merged = adjust_shift_hours(shifts_grouped, absence_slots)
+    booked_slots, overlapping_slots = booked_and_overlapping_slots(shifts_grouped, absence_days, appointments_filtered)
+    return sfshifts_merged, booked_slots, overlapping_slots
+
+
+def shop_partitions(shop_weights, partitions):
+    """ Spread shops over at most `partitions` groups, heaviest shop first onto the lightest group so far. """
+    loads = [0] * partitions
+    groups = [[] for _ in range(partitions)]
+    for shop, weight in sorted(shop_weights.items(), key=lambda item: (-item[1], item[0])):
+        target = loads.index(min(loads))
+        groups[target].append(shop)
+        loads[target] += weight
+    return [group for group in groups if group]
+
+
+def resource_day_slots_by_shop(shifts_grouped, absences_grouped, appointments_filtered, workers=1):
+    """ resource_day_slots run on shop partitions in a process pool.
+
+    Nothing in the stages crosses shops, so the concatenated partition results are
+    sorted back into the serial order and do not depend on the worker count. """
+    if workers <= 1:
+        return resource_day_slots(shifts_grouped, absences_grouped, appointments_filtered)
+
+    shops = {
+        'shifts': shifts_grouped[SHOP_COLUMNS['shifts']].fillna(''),
+        'absences': absences_grouped[SHOP_COLUMNS['absences']].fillna(''),
+        'appointments': appointments_filtered[SHOP_COLUMNS['appointments']].fillna(''),
+    }
+    # Shops are weighted by their number of input rows
+    shop_weights = pd.concat(shops.values()).value_counts().to_dict()
+    partitions = shop_partitions(shop_weights, workers)
+    print(f"Running slot stages on {len(partitions)} shop partitions with {workers} workers")
+
+    # Forked workers start without re-importing the caller, elsewhere the platform default is used
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as pool:
+        results = list(pool.map(
+            resource_day_slots,
+            [shifts_grouped[shops['shifts'].isin(partition)] for partition in partitions],
+            [absences_grouped[shops['absences'].isin(partition)] for partition in partitions],
+            [appointments_filtered[shops['appointments'].isin(partition)] for partition in partitions],
+        ))
+
+    sfshifts_merged = pd.concat([result[0] for result in results], ignore_index=True)
+    sfshifts_merged = sfshifts_merged.sort_values(['PersonalNumberId', 'ShiftDate'], kind='stable').reset_index(drop=True)
+    booked_slots, overlapping_slots = [
+        pd.concat([result[i] for result in results], ignore_index=True).sort_values(RESOURCE_KEYS + ['date']).reset_index(drop=True)
+        for i in (1, 2)
+    ]
+    return sfshifts_merged, booked_slots, overlapping_slots
+
+
+def shop_day_totals(slots, column):
+    """ Sum a per resource-day slot count to shop and date. """
+    return slots.groupby(['GT_ShopCode__c', 'date'], as_index=False)[column].sum()
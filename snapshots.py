@@ -0,0 +1,200 @@
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Typed Parquet snapshots of the pipeline outputs, written next to the Excel exports
+# as a dataset partitioned by Region and iso_week. The dashboard reads these and the
+# Excel files stay as the human-facing export.
+
+SNAPSHOT_FOLDER = 'parquet'
+
+PARTITIONING = pa.schema([
+    ('Region', pa.string()),
+    ('iso_week', pa.int64()),
+])
+
+_TIMESTAMP = pa.timestamp('ns')
+
+SCHEMAS = {
+    'shiftslots': pa.schema([
+        ('GT_ShopCode__c', pa.string()),
+        ('date', _TIMESTAMP),
+        ('Region', pa.string()),
+        ('Area', pa.string()),
+        ('Shop[Name]', pa.string()),
+        ('ShiftDurationMinutesAdjusted', pa.float64()),
+        ('ShiftDurationHours', pa.float64()),
+        ('AbsenceDurationHours', pa.float64()),
+        ('ShiftDurationHoursAdjusted', pa.float64()),
+        ('TotalOverlappingAbsenceSlots', pa.float64()),
+        ('OverlapHours', pa.float64()),
+        ('TotalSlots_net', pa.float64()),
+        ('TotalSlots_net_gross', pa.float64()),
+        ('TotalHours', pa.float64()),
+        ('BlockedHours', pa.float64()),
+        ('AvailableHours', pa.float64()),
+        ('BlockedHoursPercentage', pa.float64()),
+        ('TotalBookedSlots', pa.float64()),
+        ('BookedHours', pa.float64()),
+        ('SaturationPercentage', pa.float64()),
+        ('OpenHours', pa.float64()),
+        ('day', pa.int64()),
+        ('weekday', pa.string()),
+        ('iso_week', pa.int64()),
+        ('month', pa.string()),
+    ]),
+    'hcpshiftslots': pa.schema([
+        ('PersonalNumberKey', pa.string()),
+        ('ShiftDate', _TIMESTAMP),
+        ('ShiftDurationHours', pa.float64()),
+        ('Service Resource[GT_Role__c]', pa.string()),
+        ('GT_ServiceResource__r.Name', pa.string()),
+        ('GT_ShopCode__c', pa.string()),
+        ('Shift[Label]', pa.string()),
+        ('ShopResourceKey', pa.string()),
+        ('StartDateHour', pa.string()),
+        ('iso_year', pa.int64()),
+        ('iso_week', pa.int64()),
+        ('date', pa.string()),
+        ('LastModifiedDate', _TIMESTAMP),
+        ('Shop[Name]', pa.string()),
+        ('Shop[GT_CountryCode__c]', pa.string()),
+        ('Shop[Country]', pa.string()),
+        ('Shop[GT_AreaManagerCode__c]', pa.string()),
+        ('Shop[GT_AreaCode__c]', pa.string()),
+        ('Shop[GT_StoreType__c]', pa.string()),
+        ('StartTime', _TIMESTAMP),
+        ('EndTime', _TIMESTAMP),
+        ('GT_ShopCode__c_absence', pa.string()),
+        ('AbsenceSlotDate', _TIMESTAMP),
+        ('AbsenceSlots', pa.float64()),
+        ('AbsenceNumber', pa.string()),
+        ('Resource.GT_PersonalNumber__c', pa.string()),
+        ('Type', pa.string()),
+        ('Resource.Name', pa.string()),
+        ('Service Resource[Id]', pa.string()),
+        ('PersonalidKey', pa.string()),
+        ('ShiftSlot', _TIMESTAMP),
+        ('AbsenceDurationHours', pa.float64()),
+        ('ShiftDurationHoursAdjusted', pa.float64()),
+        ('ShiftDurationMinutesAdjusted', pa.float64()),
+        ('Region', pa.string()),
+        ('Area', pa.string()),
+        # Region mapping shop name, the Excel export holds it as a second Shop[Name] column
+        ('Shop[Name].1', pa.string()),
+        ('weekday', pa.string()),
+    ]),
+    'hcm_sf_merged': pa.schema([
+        ('Clave compuesta', pa.string()),
+        ('Duración SF', pa.float64()),
+        ('Duración HCM', pa.float64()),
+        ('ServiceResourceName SF', pa.string()),
+        ('Shop Code', pa.string()),
+        ('shop_pn', pa.string()),
+        ('iso_week', pa.int64()),
+        ('Personal Number', pa.string()),
+        ('Resource Name', pa.string()),
+        ('Diferencia de hcm duración', pa.float64()),
+        ('Code', pa.string()),
+        ('Area', pa.string()),
+        ('Region', pa.string()),
+        ('Shop Name', pa.string()),
+    ]),
+    'clock': pa.schema([
+        ('Date', _TIMESTAMP),
+        # Hours or 'NC' when the day has no valid clock-in/clock-out pair
+        ('hours_worked', pa.string()),
+        ('hours_worked_numeric', pa.float64()),
+        ('PersonalNumber', pa.string()),
+        ('ShiftDate', _TIMESTAMP),
+        ('ShiftDurationHours', pa.float64()),
+        ('AbsenceDurationHours', pa.float64()),
+        ('ShiftDurationHoursAdjusted', pa.float64()),
+        ('PersonalNumber SF', pa.string()),
+        ('Shop Code', pa.string()),
+        ('Code', pa.string()),
+        ('Area', pa.string()),
+        ('Region', pa.string()),
+        ('Shop[Name]', pa.string()),
+        ('Resource Name', pa.string()),
+        ('weekday', pa.string()),
+        ('iso_week', pa.int64()),
+        ('Diferencia de act duración', pa.float64()),
+    ]),
+}
+
+
+def snapshot_path(excel_path):
+    """ Dataset directory of the snapshot belonging to an Excel export. """
+    folder, file_name = os.path.split(excel_path)
+    return os.path.join(folder, SNAPSHOT_FOLDER, os.path.splitext(file_name)[0])
+
+
+def _unique_columns(df):
+    # Repeated column names get .1, .2, ... the way read_excel names them
+    seen = {}
+    columns = []
+    for column in df.columns:
+        count = seen.get(column, 0)
+        columns.append(column if count == 0 else f"{column}.{count}")
+        seen[column] = count + 1
+    return df.set_axis(columns, axis=1)
+
+
+def _to_arrow(series, field):
+    if pa.types.is_timestamp(field.type):
+        # Exports fill missing dates with 0, which is not a date
+        if series.dtype == object:
+            series = series.mask(pd.to_numeric(series, errors='coerce').notna())
+        values = pd.to_datetime(series, errors='coerce')
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert(None)
+        return pa.array(values, type=field.type, from_pandas=True)
+    if pa.types.is_integer(field.type):
+        return pa.array(pd.to_numeric(series, errors='coerce').astype('Int64'), type=field.type, from_pandas=True)
+    if pa.types.is_floating(field.type):
+        return pa.array(pd.to_numeric(series, errors='coerce').astype(float), type=field.type, from_pandas=True)
+    return pa.array(series.where(series.isna(), series.astype(str)), type=field.type, from_pandas=True)
+
+
+def to_table(df, name):
+    """ Cast an output frame to its snapshot schema. Columns outside the schema are left out. """
+    schema = SCHEMAS[name]
+    df = _unique_columns(df)
+    extra = [column for column in df.columns if column not in schema.names]
+    if extra:
+        print(f"Snapshot {name}: columns not in the schema are not written: {extra}")
+    arrays = [
+        _to_arrow(df[field.name], field) if field.name in df.columns else pa.nulls(len(df), type=field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_snapshot(df, excel_path, name):
+    """ Write the Parquet snapshot of an Excel export, replacing the previous one. """
+    path = snapshot_path(excel_path)
+    table = to_table(df, name)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    ds.write_dataset(
+        table,
+        path,
+        format='parquet',
+        partitioning=ds.partitioning(PARTITIONING, flavor='hive'),
+        basename_template='part-{i}.parquet'
+    )
+    print(f"Snapshot written to {path}")
+    return path
+
+
+def read_snapshot(excel_path, name, columns=None):
+    """ Read the Parquet snapshot of an Excel export, or None if there is none. """
+    path = snapshot_path(excel_path)
+    if not os.path.isdir(path):
+        return None
+    schema = SCHEMAS[name]
+    dataset = ds.dataset(path, schema=schema, format='parquet', partitioning=ds.partitioning(PARTITIONING, flavor='hive'))
+    return dataset.to_table(columns=columns).to_pandas()
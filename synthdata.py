@@ -0,0 +1,460 @@
+import json
+import os
+import string
+import numpy as np
+import pandas as pd
+import xlsxwriter
+import exports
+
+# Synthetic extracts for the scale benchmarks (see benchmarks.py). generate() writes
+# the files the pipeline reads into a folder: datasets/SFshifts_query.xlsx,
+# Appointments_aug_oct.xlsx, absences.csv, resource_query.csv, HCMShifts.csv,
+# regionmapping.xlsx and hcm_mapping.xlsx with the columns and value formats of the
+# Salesforce and HCM extracts, and the clock exports in files/ laid out like the
+# originals (title, labels row, header on row 7). Shops, resources, personal numbers
+# and shop names are shared by all of them, so every join of the pipeline finds its
+# rows. The size is set by the number of shops, the resources per shop and the days,
+# the load by the appointments per shift hour and the rate and length of absences.
+# The same parameters and seed always give the same files. An Excel extract with more
+# rows than a sheet holds is written as CSV under the same name instead, the way the
+# pipeline reads it (openslotsdata.extract_path).
+
+DATASETS_FOLDER = 'datasets'
+CLOCK_FOLDER = 'files'
+MANIFEST = 'synthdata.json'
+
+# Default parameters, about the size of the Spanish extracts of October 2024
+DEFAULTS = {
+    'shops': 600,
+    'resources_per_shop': 2,
+    # Monday of the first ISO week of October 2024 to Sunday of its last one
+    'start': '2024-09-30',
+    'days': 35,
+    'appointments_per_hour': 0.4,
+    'absence_rate': 0.08,
+    'absence_hours': 4.0,
+    'duplicate_rate': 0.02,
+    'seed': 0,
+}
+
+# Rows of an Excel sheet, larger extracts are written as CSV
+EXCEL_MAX_ROWS = 1048576
+
+# Shop codes are 3 characters, the HCM and clock joins cut them out of longer strings
+SHOP_CODE_CHARACTERS = string.digits + string.ascii_uppercase
+MAX_SHOPS = len(SHOP_CODE_CHARACTERS) ** 3 - 1
+
+SHOPS_PER_AREA = 20
+AREAS_PER_REGION = 9
+# Shops flagged SYM = N, the pipeline leaves them out
+SYM_N_SHARE = 0.1
+SHOP_IN_SHOP_SHARE = 0.03
+INACTIVE_RESOURCE_SHARE = 0.03
+
+# Shift patterns as (label, start hour, end hour). The labels are local time, the
+# start and end times of the extract are two hours earlier (UTC in summer time)
+MORNING_SHIFTS = [('T__9-14', 7, 12), ('T__9:30-14', 7.5, 12), ('T__9-13:30', 7, 11.5)]
+AFTERNOON_SHIFTS = [('T__16-19:30', 14, 17.5), ('T__16-19', 14, 17), ('T__16-20', 14, 18)]
+# Share of working days with an afternoon shift as well
+AFTERNOON_SHARE = 0.8
+UTC_OFFSET_HOURS = 2
+
+APPOINTMENT_MINUTES = [30, 45, 60]
+APPOINTMENT_STATUSES = ['Scheduled', 'Completed', 'Canceled']
+MACROCATEGORIES = ['Fitting', 'Post-Sales', 'First Visit ', None]
+ABSENCE_TYPES = {
+    'NOT AVAILABLE (HOLIDAY/ABSENCE)': 0.4,
+    'STORE MEETING': 0.25,
+    'ACTIVITY (BANK/ADMINISTRATIVE)': 0.1,
+    'AREA MEETING': 0.1,
+    'Training': 0.1,
+    'OTHER': 0.05,
+}
+FTE_VALUES = [1.0, 0.75, 0.5]
+FTE_SHARES = [0.8, 0.1, 0.1]
+
+# Clock stamps without their pair, the days the pipeline reports as 'NC'
+MISSING_STAMP_RATE = 0.01
+CLOCK_ROWS_PER_FILE = 20000
+CLOCK_TITLE = 'Fichaje de empleados tiendas'
+CLOCK_LABELS = ['Id.Empleado', 'Fecha y hora del fichaje', 'Unidad Organizativa', 'ID Responsable directo',
+                'Nombre Responsoble Directo', 'Nombre del Puesto', 'DIRECCION IP']
+CLOCK_COLUMNS = ['ID RH', 'Fecha y hora fichaje/declarac.', 'Nombre unidad org.', 'ID Responsable directo',
+                 'Nombre completo', 'Nombre puesto', 'Dirección IP']
+
+
+def shop_code(number):
+    """ The 3-character code of shop `number` (1 to MAX_SHOPS), '001', '002', ... '00Z', '010', ... """
+    digits = []
+    for _ in range(3):
+        number, digit = divmod(number, len(SHOP_CODE_CHARACTERS))
+        digits.append(SHOP_CODE_CHARACTERS[digit])
+    return ''.join(reversed(digits))
+
+
+def _working_days(start, days):
+    # Monday to Friday, the shops' agenda days
+    dates = pd.date_range(start, periods=days, freq='D')
+    return dates[dates.dayofweek < 5]
+
+
+def expected_rows(shops, resources_per_shop, start, days, appointments_per_hour, duplicate_rate, **_):
+    """ About how many rows the shift and appointment extracts of these parameters get. """
+    resource_days = shops * resources_per_shop * len(_working_days(start, days))
+    shift_rows = resource_days * (1 + AFTERNOON_SHARE) * (1 + duplicate_rate)
+    # Mean hours of a morning and an afternoon shift
+    shift_hours = np.mean([end - begin for _, begin, end in MORNING_SHIFTS]) + AFTERNOON_SHARE * np.mean([end - begin for _, begin, end in AFTERNOON_SHIFTS])
+    appointment_rows = resource_days * shift_hours * appointments_per_hour * (1 + duplicate_rate)
+    return {'SFshifts_query.xlsx': int(shift_rows), 'Appointments_aug_oct.xlsx': int(appointment_rows)}
+
+
+def scaled(params, scale):
+    """ The parameters of `scale` times as many resources as `params`.
+
+    The shops grow with the scale, and once the shop codes run out the resources
+    per shop grow instead. """
+    resources = params['shops'] * params['resources_per_shop'] * scale
+    shops = min(max(1, round(params['shops'] * scale)), MAX_SHOPS)
+    return dict(params, shops=shops, resources_per_shop=max(1, round(resources / shops)))
+
+
+def _check(params):
+    # Fail before building anything when the shop codes could not tell the shops apart
+    if not 1 <= params['shops'] <= MAX_SHOPS:
+        raise ValueError(f"{params['shops']} shops, the 3-character shop codes allow 1 to {MAX_SHOPS}")
+
+
+def _file_name(file_name, rows):
+    # An Excel extract too large for a sheet becomes a CSV of the same name
+    if file_name.endswith('.xlsx') and rows + 1 > EXCEL_MAX_ROWS:
+        return os.path.splitext(file_name)[0] + '.csv'
+    return file_name
+
+
+def _shops(count, rng):
+    numbers = np.arange(1, count + 1)
+    area_codes = (numbers - 1) // SHOPS_PER_AREA + 1
+    region_numbers = (area_codes - 1) // AREAS_PER_REGION + 1
+    codes = [shop_code(number) for number in numbers]
+    return pd.DataFrame({
+        'number': numbers,
+        'code': codes,
+        'name': [f'SHOP {code}' for code in codes],
+        'territory_id': [f'0Hh{number:015X}' for number in numbers],
+        'area_code': area_codes,
+        'area': [f'A{area_code:02d} AREA {area_code}' for area_code in area_codes],
+        'sf_area': [f'Area {area_code}' for area_code in area_codes],
+        'area_manager': [str(30000 + area_code) for area_code in area_codes],
+        'region': [f'REGION {region_number}' for region_number in region_numbers],
+        'sym': np.where(rng.random(count) < SYM_N_SHARE, 'N', 'Y'),
+        'store_type': np.where(rng.random(count) < SHOP_IN_SHOP_SHARE, 'Shop-in-Shop', 'Shop'),
+    })
+
+
+def _resources(shops, resources_per_shop, rng):
+    resources = shops.loc[shops.index.repeat(resources_per_shop)].reset_index(drop=True)
+    numbers = np.arange(1, len(resources) + 1)
+    resources['resource_id'] = [f'0Hn{number:015X}' for number in numbers]
+    resources['personal_number'] = (10000 + numbers).astype(str)
+    resources['resource_name'] = [f'RESOURCE {number}' for number in numbers]
+    resources['active'] = np.where(rng.random(len(resources)) < INACTIVE_RESOURCE_SHARE, 'False', 'True')
+    return resources
+
+
+def _shifts(resources, start, days, rng):
+    # One morning shift per resource and working day, an afternoon one on most of them
+    working_days = _working_days(start, days)
+    resource_rows = np.repeat(np.arange(len(resources)), len(working_days))
+    day_values = np.tile(working_days.values, len(resources))
+    parts = []
+    for patterns, share in ((MORNING_SHIFTS, 1.0), (AFTERNOON_SHIFTS, AFTERNOON_SHARE)):
+        keep = rng.random(len(resource_rows)) < share
+        chosen = rng.integers(0, len(patterns), keep.sum())
+        labels = np.array([label for label, _, _ in patterns])[chosen]
+        begins = np.array([begin for _, begin, _ in patterns])[chosen]
+        ends = np.array([end for _, _, end in patterns])[chosen]
+        days_kept = pd.DatetimeIndex(day_values[keep])
+        parts.append(pd.DataFrame({
+            'resource': resource_rows[keep],
+            'label': labels,
+            'start': days_kept + pd.to_timedelta(begins, unit='h'),
+            'end': days_kept + pd.to_timedelta(ends, unit='h'),
+        }))
+    shifts = pd.concat(parts, ignore_index=True).sort_values(['resource', 'start'], kind='stable').reset_index(drop=True)
+    shifts['modified'] = shifts['start'].dt.normalize() - pd.to_timedelta(rng.integers(1, 60, len(shifts)), unit='D') + pd.Timedelta(hours=12)
+    return shifts
+
+
+def _with_duplicates(df, rate, rng, modified='modified'):
+    # Earlier versions of some rows, the pipeline keeps the last modified one
+    older = df.sample(frac=rate, random_state=rng.integers(2**31)) if rate else df.iloc[:0]
+    older = older.assign(**{modified: older[modified] - pd.to_timedelta(rng.integers(1, 10, len(older)), unit='D')})
+    return pd.concat([df, older], ignore_index=True)
+
+
+def _shifts_extract(shifts, resources):
+    resource = resources.loc[shifts['resource']].reset_index(drop=True)
+    return pd.DataFrame({
+        'Shift[ShiftNumber]': [f'SFT-{1000000 + number}' for number in range(len(shifts))],
+        'Shop[GT_CountryCode__c]': '002',
+        'Shop[Country]': 'Spain',
+        'Shop[GT_ShopCode__c]': resource['code'],
+        'Shift[Label]': shifts['label'],
+        'Shift[ServiceResourceId]': resource['resource_id'],
+        'Service Resource[Name]': resource['resource_name'],
+        'Shop[Name]': resource['name'],
+        'Service Resource[GT_Role__c]': 'Audiologist',
+        'Shift[EndTime]': shifts['end'],
+        'Shift[StartTime]': shifts['start'],
+        'Shift[LastModifiedDate]': shifts['modified'],
+        'Service Resource[GT_PersonalNumber__c]': resource['personal_number'],
+        'Shop[GT_StoreType__c]': resource['store_type'],
+        'Shop[GT_AreaManagerCode__c]': resource['area_manager'],
+        'Shop[GT_AreaCode__c]': resource['sf_area'],
+    })
+
+
+def _appointments(shifts, appointments_per_hour, rng):
+    # A Poisson number of appointments per shift, starting on a quarter hour of the shift
+    hours = (shifts['end'] - shifts['start']).dt.total_seconds().to_numpy() / 3600
+    counts = rng.poisson(appointments_per_hour * hours)
+    rows = np.repeat(np.arange(len(shifts)), counts)
+    quarters = (hours[rows] * 4).astype(int)
+    starts = shifts['start'].to_numpy()[rows] + pd.to_timedelta(rng.integers(0, np.maximum(quarters, 1)) * 15, unit='m').to_numpy()
+    minutes = np.array(APPOINTMENT_MINUTES)[rng.integers(0, len(APPOINTMENT_MINUTES), len(rows))]
+    starts = pd.DatetimeIndex(starts)
+    return pd.DataFrame({
+        'resource': shifts['resource'].to_numpy()[rows],
+        'start': starts,
+        'end': starts + pd.to_timedelta(minutes, unit='m'),
+        'status': np.array(APPOINTMENT_STATUSES)[rng.integers(0, len(APPOINTMENT_STATUSES), len(rows))],
+        'category': np.array(MACROCATEGORIES, dtype=object)[rng.integers(0, len(MACROCATEGORIES), len(rows))],
+        'account': rng.integers(1, 50000, len(rows)),
+        'modified': starts.normalize() - pd.to_timedelta(rng.integers(1, 30, len(rows)), unit='D') + pd.Timedelta(hours=10),
+    })
+
+
+def _appointments_extract(appointments, resources):
+    resource = resources.loc[appointments['resource']].reset_index(drop=True)
+    return pd.DataFrame({
+        'Service Appointment[AppointmentNumber]': [f'SA-{number}' for number in range(len(appointments))],
+        'Service Appointment[ServiceTerritoryId]': resource['territory_id'],
+        'Service Appointment[Business_Shop__c]': resource['name'],
+        'Service Appointment[GT_ShopCode__c]': resource['code'],
+        'Shop[GT_CountryCode__c]': '002',
+        'Service Appointment[GT_Cluster__c]': 'C1',
+        'Service Appointment[GT_Macrocategory__c]': appointments['category'],
+        'Service Appointment[GT_AccountNameConcatenated__c]': 'Acc' + appointments['account'].astype(str),
+        'Shop[GT_AreaCode__c]': resource['sf_area'],
+        'Shop[GT_StoreType__c]': resource['store_type'],
+        'Shop[GT_AreaManagerCode__c]': resource['area_manager'],
+        # Text in the extract, not Excel dates
+        'Service Appointment[SchedStartTime]': appointments['start'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'Service Appointment[SchedEndTime]': appointments['end'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'Service Resource[GT_Role__c]': 'Audiologist',
+        'Service Appointment[GT_ServiceResource__c]': resource['resource_id'],
+        'Service Resource[Name]': resource['resource_name'],
+        'Service Appointment[Status]': appointments['status'],
+        'Service Appointment[LastModifiedDate]': appointments['modified'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+def _absences(resources, start, days, absence_rate, absence_hours, rng):
+    # Absences on some working days, from a quarter hour of the day and about absence_hours long.
+    # The long ones run over several days, like holidays
+    working_days = _working_days(start, days)
+    resource_rows = np.repeat(np.arange(len(resources)), len(working_days))
+    day_values = np.tile(working_days.values, len(resources))
+    absent = rng.random(len(resource_rows)) < absence_rate
+    count = absent.sum()
+    starts = pd.DatetimeIndex(day_values[absent]) + pd.to_timedelta(7 * 60 + rng.integers(0, 36, count) * 15, unit='m')
+    minutes = np.maximum(np.round(rng.exponential(absence_hours * 4, count)), 1) * 15
+    types = list(ABSENCE_TYPES)
+    return pd.DataFrame({
+        'resource': resource_rows[absent],
+        'start': starts,
+        'end': starts + pd.to_timedelta(minutes, unit='m'),
+        'type': np.array(types)[rng.choice(len(types), count, p=list(ABSENCE_TYPES.values()))],
+    })
+
+
+def _absences_extract(absences, resources):
+    resource = resources.loc[absences['resource']].reset_index(drop=True)
+    return pd.DataFrame({
+        'Resource Absence[AbsenceNumber]': [f'RA-{100000 + number}' for number in range(len(absences))],
+        'Resource Absence[Type]': absences['type'],
+        'Resource Absence[Start]': absences['start'].dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        'Resource Absence[End]': absences['end'].dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        'Service Resource[Name]': resource['resource_name'],
+        'Service Resource[IsActive]': resource['active'],
+        'Service Resource[GT_PersonalNumber__c]': resource['personal_number'],
+        'User[GT_CountryCode__c]': 'ES',
+        'User[GT_StoreCode__c]': resource['code'],
+        'Service Resource[GT_Role__c]': 'Audiologist',
+        'Service Resource[Id]': resource['resource_id'],
+    })
+
+
+def _resources_extract(resources):
+    return pd.DataFrame({
+        'Shop[GT_CountryCode__c]': '002',
+        # Open-ended memberships end in the year 4000
+        'Service Territory Member[EffectiveEndDate]': '4000-12-30T23:00:00',
+        'Service Territory Member[EffectiveStartDate]': '2020-01-01T00:00:00',
+        'Shop[Country]': 'Spain',
+        'Service Territory Member[ServiceTerritoryId]': resources['territory_id'],
+        'Shop[GT_ShopCode__c]': resources['code'],
+        'Shop[Name]': resources['name'],
+        'Service Territory Member[ServiceResourceId]': resources['resource_id'],
+        'Service Resource[Name]': resources['resource_name'],
+        'Service Resource[IsActive]': resources['active'],
+        'Service Resource[GT_PersonalNumber__c]': resources['personal_number'],
+        'Service Resource[GT_Role__c]': 'Audiologist',
+    })
+
+
+def _hcm_extract(resources, start, days, rng):
+    # One contract row per resource and ISO week
+    weeks = pd.date_range(start, periods=days, freq='D').isocalendar()[['year', 'week']].drop_duplicates()
+    resource_rows = np.repeat(np.arange(len(resources)), len(weeks))
+    resource = resources.loc[resource_rows].reset_index(drop=True)
+    return pd.DataFrame({
+        'Unique Employee[Employee Full Name]': resource['resource_name'],
+        'Unique Employee[Employee Person Number]': resource['personal_number'],
+        'Calendar[ISO Week]': np.tile(weeks['week'].to_numpy(dtype=int), len(resources)),
+        'Calendar[ISO Year]': np.tile(weeks['year'].to_numpy(dtype=int), len(resources)),
+        '[IsGrandTotalRowTotal]': 'False',
+        '[Audiologist_FTE]': rng.choice(FTE_VALUES, len(resource), p=FTE_SHARES),
+        '[v_Audiologist_FTE_FormatString]': '#,0.000',
+        'Shop[Shop Code - Descr]': resource['code'] + '-' + resource['name'],
+    })
+
+
+def _hcm_mapping(resources):
+    keys = resources['code'] + '_' + resources['personal_number']
+    return pd.DataFrame({
+        'PersonalNumber HCM': keys,
+        'ServiceResourceName SF': resources['resource_name'],
+        'PersonalNumber SF': keys,
+        'PersonalNumber': resources['personal_number'].astype(int),
+    })
+
+
+def _region_mapping(shops):
+    return pd.DataFrame({
+        'REGION': shops['region'],
+        'AREA CODE': shops['area_code'],
+        'AREA': shops['area'],
+        'DESCR': shops['name'],
+        'CODE': shops['code'],
+        'SYM': shops['sym'],
+        'AREAMAIL': [f'area{area_code}@example.com' for area_code in shops['area_code']],
+    })
+
+
+def _clock_records(shifts, resources, rng):
+    # A clock-in and a clock-out per shift in local time, a few minutes off the shift's times
+    stamps = pd.concat([
+        pd.DataFrame({'resource': shifts['resource'], 'stamp': shifts['start']}),
+        pd.DataFrame({'resource': shifts['resource'], 'stamp': shifts['end']}),
+    ], ignore_index=True)
+    stamps = stamps[resources.loc[stamps['resource'], 'active'].to_numpy() == 'True']
+    stamps = stamps[rng.random(len(stamps)) >= MISSING_STAMP_RATE]
+    jitter = pd.to_timedelta(rng.normal(0, 300, len(stamps)).round(), unit='s')
+    stamps = stamps.assign(stamp=stamps['stamp'] + pd.Timedelta(hours=UTC_OFFSET_HOURS) + jitter)
+    stamps = stamps.sort_values(['resource', 'stamp'], kind='stable').reset_index(drop=True)
+    resource = resources.loc[stamps['resource']].reset_index(drop=True)
+    return pd.DataFrame({
+        'ID RH': resource['personal_number'],
+        'Fecha y hora fichaje/declarac.': stamps['stamp'],
+        'Nombre unidad org.': 'ES - SHOP - ' + resource['name'],
+        'ID Responsable directo': resource['area_manager'],
+        'Nombre completo': resource['resource_name'],
+        'Nombre puesto': 'Country HC Professional Law-Certified',
+        'Dirección IP': '10.0.0.1',
+    })
+
+
+def write_clock_export(df, path):
+    """ Write clock records like an export of the clock system: title on row 1, labels on row 6, header on row 7, column A empty. """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False})
+    try:
+        worksheet = workbook.add_worksheet('Hoja1')
+        stamp_format = workbook.add_format({'num_format': exports.DATETIME_FORMAT})
+        worksheet.write(0, 1, CLOCK_TITLE)
+        worksheet.write_row(5, 1, CLOCK_LABELS)
+        worksheet.write_row(6, 1, CLOCK_COLUMNS)
+        for row, values in enumerate(df[CLOCK_COLUMNS].itertuples(index=False), start=7):
+            for column, value in enumerate(values, start=1):
+                if isinstance(value, pd.Timestamp):
+                    worksheet.write_datetime(row, column, value.to_pydatetime(), stamp_format)
+                else:
+                    worksheet.write_string(row, column, value)
+    finally:
+        workbook.close()
+    return path
+
+
+def generate(folder, **params):
+    """ Write synthetic extracts into `folder`/datasets and clock exports into `folder`/files.
+
+    `params` override DEFAULTS. Returns the rows written per file, which are also
+    kept with the parameters in `folder`/synthdata.json. """
+    params = dict(DEFAULTS, **params)
+    _check(params)
+    rng = np.random.default_rng(params['seed'])
+    start = pd.Timestamp(params['start'])
+
+    shops = _shops(params['shops'], rng)
+    resources = _resources(shops, params['resources_per_shop'], rng)
+    shifts = _shifts(resources, start, params['days'], rng)
+    appointments = _appointments(shifts, params['appointments_per_hour'], rng)
+    absences = _absences(resources, start, params['days'], params['absence_rate'], params['absence_hours'], rng)
+
+    datasets_folder = os.path.join(folder, DATASETS_FOLDER)
+    clock_folder = os.path.join(folder, CLOCK_FOLDER)
+    os.makedirs(datasets_folder, exist_ok=True)
+    os.makedirs(clock_folder, exist_ok=True)
+    extracts = {
+        'SFshifts_query.xlsx': _shifts_extract(_with_duplicates(shifts, params['duplicate_rate'], rng), resources),
+        'Appointments_aug_oct.xlsx': _appointments_extract(_with_duplicates(appointments, params['duplicate_rate'], rng), resources),
+        'absences.csv': _absences_extract(absences, resources),
+        'resource_query.csv': _resources_extract(resources),
+        'HCMShifts.csv': _hcm_extract(resources, start, params['days'], rng),
+        'regionmapping.xlsx': _region_mapping(shops),
+        'hcm_mapping.xlsx': _hcm_mapping(resources),
+    }
+    rows = {}
+    for extract_name, df in extracts.items():
+        file_name = _file_name(extract_name, len(df))
+        path = os.path.join(datasets_folder, file_name)
+        # The Excel version of an earlier generation would be read instead of a CSV one
+        if file_name != extract_name and os.path.exists(os.path.join(datasets_folder, extract_name)):
+            os.remove(os.path.join(datasets_folder, extract_name))
+        if file_name.endswith('.csv'):
+            df.to_csv(path, index=False)
+        else:
+            exports.write_excel(df, path)
+        rows[file_name] = len(df)
+
+    # Clock exports of CLOCK_ROWS_PER_FILE records, named like the exports of the clock system
+    for name in os.listdir(clock_folder):
+        os.remove(os.path.join(clock_folder, name))
+    clock = _clock_records(shifts, resources, rng)
+    for part, first in enumerate(range(0, len(clock), CLOCK_ROWS_PER_FILE), start=1):
+        write_clock_export(clock.iloc[first:first + CLOCK_ROWS_PER_FILE], os.path.join(clock_folder, f'1000000000_{part}_1_1_ .xlsx'))
+    rows[CLOCK_FOLDER] = len(clock)
+
+    with open(os.path.join(folder, MANIFEST), 'w') as f:
+        json.dump({'params': params, 'rows': rows}, f, indent=2, default=str)
+    print(f"Synthetic extracts written to {folder}: " + ', '.join(f'{name} {count}' for name, count in rows.items()))
+    return rows
+
+
+def load_manifest(folder):
+    """ Parameters and rows of the extracts generated into `folder`, None when there are none. """
+    path = os.path.join(folder, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
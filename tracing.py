@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pandas as pd
+import keys
+
+# Trace mode. Off by default; with --trace-key or --trace-shop the pipeline stages
+# record the rows of the traced resources or shops at fixed points (probes), and the
+# run report lists them under each stage. Probes do nothing when tracing is off, so
+# production runs skip the filtering entirely.
+
+# Rows kept per probe in the run report
+MAX_ROWS = 200
+
+_config = {'keys': [], 'shops': []}
+_records = []
+
+
+def configure(keys=(), shops=()):
+    """ Trace the given PersonalNumberKeys (shop code, '_', personal number) and shop codes. """
+    _config['keys'] = list(keys)
+    _config['shops'] = list(shops)
+
+
+def config():
+    return {'keys': list(_config['keys']), 'shops': list(_config['shops'])}
+
+
+def enabled():
+    return bool(_config['keys'] or _config['shops'])
+
+
+def _traced_keys(column):
+    # Id columns are matched against the resource ids of the traced keys
+    if not pd.api.types.is_integer_dtype(column):
+        return _config['keys']
+    parts = [traced.partition('_') for traced in _config['keys']]
+    return keys.ids(pd.Series([shop for shop, _, _ in parts]), pd.Series([number for _, _, number in parts])).dropna()
+
+
+def _unique_columns(rows):
+    # Repeated column names (a merge keeping both Shop[Name]) get .1, .2, ... so the rows serialize
+    seen = {}
+    columns = []
+    for column in rows.columns:
+        count = seen.get(column, 0)
+        columns.append(column if count == 0 else f"{column}.{count}")
+        seen[column] = count + 1
+    return rows.set_axis(columns, axis=1)
+
+
+def probe(name, df, key=None, number=None, shop=None, columns=None):
+    """ Record the rows of df that belong to a traced resource or shop.
+
+    key is the column holding PersonalNumberKeys or resource ids, number a column holding the personal
+    number alone (clock exports, HCM) and shop a column holding shop codes. """
+    if not enabled():
+        return
+    mask = np.zeros(len(df), dtype=bool)
+    if key is not None and _config['keys']:
+        mask |= df[key].isin(_traced_keys(df[key])).to_numpy()
+    if number is not None and _config['keys']:
+        numbers = [traced.split('_', 1)[-1] for traced in _config['keys']]
+        mask |= df[number].astype(str).isin(numbers).to_numpy()
+    if shop is not None and _config['shops']:
+        mask |= df[shop].isin(_config['shops']).to_numpy()
+    rows = df[mask]
+    if columns is not None:
+        rows = rows[columns]
+    record = {'probe': name, 'rows': len(rows)}
+    # A probe is a debugging aid, it never fails the stage it sits in
+    try:
+        record['data'] = json.loads(_unique_columns(rows.head(MAX_ROWS)).to_json(orient='records', date_format='iso'))
+    except (ValueError, TypeError, OverflowError) as e:
+        print(f"Trace probe {name}: rows could not be serialized ({e})")
+        record['error'] = str(e)
+    _records.append(record)
+
+
+def collect():
+    """ Probe records since the last call. """
+    records = list(_records)
+    _records.clear()
+    return records